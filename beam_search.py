@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 18:00:00 2026
+
+@author: magfrump
+
+A best-first beam search over a document index. Unexplored nodes wait in a
+heap ordered by the relevance their parent's summary was given, so the most
+promising node is always expanded next, and the frontier is cut back to the
+beam width whenever it grows past it. The search can be run one node at a
+time, or with asyncio, scoring the best several nodes at once.
+
+The search can be held to a number of LLM calls, a wall-clock deadline and
+a depth, and reports how it spent them; a search cut short still returns
+the best text nodes found so far. It can also be seeded with text nodes
+found some other way, such as by keyword search, which are scored before
+the walk and may make it unnecessary. One walk can serve several personas
+at once when every score is a list with one relevance per persona.
+
+Classes:
+    SearchReport: What a search spent and why it stopped.
+    BeamSearch: The search engine.
+
+Functions:
+    gather_until(coroutines, seconds): Runs coroutines concurrently for at
+        most a number of seconds.
+"""
+
+import asyncio
+from dataclasses import dataclass
+import heapq
+import itertools
+import time
+
+# Retrieval keeps at most this many nodes to explore and text nodes found.
+MAX_MEMORY_NODES = 10
+# Besides the best child of a node, children scoring above this are explored.
+RELEVANCE_THRESHOLD = 0.1
+
+@dataclass
+class SearchReport:
+    """
+    What a search spent and why it stopped.
+
+    Attributes:
+        llm_calls (int): The relevance calls made.
+        nodes_expanded (int): The branch nodes whose children were scored.
+        texts_scored (int): The text nodes whose text was scored,
+            including seeds.
+        seeds_scored (int): The seed text nodes scored before the walk.
+        deepest (int): The depth of the deepest node reached; the root is 0.
+        pruned (int): Children not explored because they scored at or below
+            the relevance threshold, were cut from the beam, or were below
+            the maximum depth.
+        stopped (str): "exhausted" if every promising node was explored,
+            "llm_calls" if the call budget ran out first, "deadline" if the
+            time budget did, or "seeds" if a seed scored well enough that
+            the tree was not walked.
+        seconds (float): How long the search took.
+    """
+    llm_calls: int = 0
+    nodes_expanded: int = 0
+    texts_scored: int = 0
+    seeds_scored: int = 0
+    deepest: int = 0
+    pruned: int = 0
+    stopped: str = "exhausted"
+    seconds: float = 0.0
+
+    @property
+    def truncated(self):
+        """
+        Whether a budget ran out before every promising node was explored.
+        """
+        return self.stopped in ("llm_calls", "deadline")
+
+    def __str__(self):
+        return (f"{self.llm_calls} LLM calls, {self.nodes_expanded} nodes "
+                f"expanded, {self.texts_scored} texts scored "
+                f"({self.seeds_scored} seeds), depth "
+                f"{self.deepest}, {self.pruned} pruned, stopped: "
+                f"{self.stopped} after {self.seconds:.2f}s")
+
+class BeamSearch:
+    """
+    Searches an index for the text nodes most relevant to a question.
+
+    Each branch node expanded has its children scored. The best child, and
+    every other child scoring above the relevance threshold, join the
+    frontier. Text nodes taken from the frontier have their own text scored
+    and are kept if they are among the best max_results.
+
+    With personas set, each score is a list of one relevance per persona.
+    A child joins the frontier if it is the best child or scores above the
+    threshold for any persona, the frontier is ordered by the best of its
+    scores, and each persona keeps its own best max_results text nodes.
+
+    The search is written once, in _rounds, as a generator of rounds of
+    scoring jobs; search runs each round's jobs one after another and
+    asearch runs them concurrently, so both keep to the same budgets.
+    """
+    def __init__(self, load_node, score_children, score_text,
+                 beam_width=MAX_MEMORY_NODES, max_results=MAX_MEMORY_NODES,
+                 max_llm_calls=None, max_depth=None,
+                 relevance_threshold=RELEVANCE_THRESHOLD,
+                 children_cost=None, personas=None, max_seconds=None,
+                 clock=time.monotonic):
+        """
+        Args:
+            load_node: A function from a node reference to its
+                IndexedInfoNode.
+            score_children: A function from a list of ChildNodes and the
+                most LLM calls it may make to a pair of the list of their
+                relevance scores and the number of LLM calls made. For
+                asearch, a coroutine function.
+            score_text: A function from a text and the most LLM calls it may
+                make to a pair of its relevance score and the number of LLM
+                calls made, usually one. For asearch, a coroutine function.
+            beam_width (int): The most nodes kept on the frontier.
+            max_results (int): The most text nodes returned.
+            max_llm_calls (int): The most LLM calls to make, or None for no
+                limit. Expansions that would go over it are not started.
+            max_depth (int): The deepest level to explore, the root being 0,
+                or None for no limit.
+            relevance_threshold (float): Children other than a node's best
+                one are explored only if they score above this.
+            children_cost: A function from a number of children to the LLM
+                calls scoring them is expected to take, to keep within
+                max_llm_calls, or None for one call per child. A scorer
+                told it may make more calls than this can spend them on a
+                fallback.
+            personas (int): The number of personas scored at once, or None
+                if scores are single numbers.
+            max_seconds (float): How long the search may run, or None for
+                no limit. search checks it before each LLM call, so a call
+                already started is allowed to finish; asearch also cancels
+                the calls still running when it passes.
+            clock: A function returning the time in seconds.
+        """
+        self._load_node = load_node
+        self._score_children = score_children
+        self._score_text = score_text
+        self.beam_width = beam_width
+        self.max_results = max_results
+        self.max_llm_calls = max_llm_calls
+        self.max_depth = max_depth
+        self.relevance_threshold = relevance_threshold
+        self._children_cost = children_cost or (lambda count: count)
+        self.personas = personas
+        self.max_seconds = max_seconds
+        self._clock = clock
+        self._started = None
+
+    def search(self, root, seeds=(), enough=None):
+        """
+        Runs the search from a root node reference, scoring one node at a
+        time.
+
+        Args:
+            root (str): The reference of the node to start from.
+            seeds (list): References of text nodes to score before walking
+                the tree. The walk does not score them again.
+            enough (float): If a seed scores at least this, the tree is not
+                walked. None always walks it.
+
+        Returns:
+            tuple: A list of (score, IndexedInfoNode) pairs for the text
+                nodes found, best first, and a SearchReport. With personas
+                set, the first item is instead one such list per persona.
+        """
+        rounds = self._rounds(root, seeds, enough, 1)
+        answers = None
+        try:
+            while True:
+                jobs = rounds.send(answers)
+                answers = [self._job(kind, argument, max_calls)
+                           for kind, argument, max_calls in jobs]
+        except StopIteration as done:
+            return done.value
+
+    async def asearch(self, root, seeds=(), enough=None, width=4):
+        """
+        Runs the search like search, but takes the best width nodes from
+        the frontier at a time and scores them concurrently. The scoring
+        functions must be coroutine functions.
+
+        Args:
+            root (str): The reference of the node to start from.
+            seeds (list): References of text nodes to score before walking
+                the tree.
+            enough (float): If a seed scores at least this, the tree is not
+                walked.
+            width (int): The most nodes scored at once.
+
+        Returns:
+            tuple: The results and the SearchReport, as from search.
+        """
+        rounds = self._rounds(root, seeds, enough, width)
+        answers = None
+        try:
+            while True:
+                jobs = rounds.send(answers)
+                seconds = None
+                if self.max_seconds is not None:
+                    seconds = self.max_seconds - (self._clock() -
+                                                  self._started)
+                answers, _ = await gather_until(
+                    [self._job(kind, argument, max_calls)
+                     for kind, argument, max_calls in jobs], seconds)
+        except StopIteration as done:
+            return done.value
+
+    def _job(self, kind, argument, max_calls):
+        if kind == "text":
+            return self._score_text(argument, max_calls)
+        return self._score_children(argument, max_calls)
+
+    def _rounds(self, root, seeds, enough, width):
+        """
+        The search, as a generator. Each round it yields a list of at most
+        width jobs, (kind, argument, max_calls) triples asking for the
+        "text" of a text node or the "children" of a branch node to be
+        scored with at most max_calls LLM calls, and is sent back each
+        job's (score, calls) pair, or None for a job cancelled at the
+        deadline. It returns what search returns.
+        """
+        report = SearchReport()
+        self._started = self._clock()
+        # ties go to the node found first
+        order = itertools.count()
+        results = [[] for _ in range(self.personas or 1)]
+        seeds = list(dict.fromkeys(seeds))
+        scored = set()
+        for start in range(0, len(seeds), width):
+            references = seeds[start:start + width]
+            nodes = [self._load_node(reference) for reference in references]
+            jobs = self._reserve(report, [("text", node.get_text)
+                                          for node in nodes])
+            answers = (yield jobs) if jobs else []
+            for reference, node, answer in zip(references, nodes, answers):
+                if answer is None:
+                    report.stopped = "deadline"
+                    continue
+                self._keep_text(node, answer, report, results, order)
+                report.seeds_scored += 1
+                scored.add(reference)
+            if len(jobs) < len(nodes) or report.truncated:
+                return self._finish(results, report)
+        if enough is not None and \
+                any(persona and max(persona)[0] >= enough
+                    for persona in results):
+            report.stopped = "seeds"
+            return self._finish(results, report)
+        frontier = [(-1, next(order), 0, root)]
+        while frontier:
+            batch = []
+            while frontier and len(batch) < width:
+                _, _, depth, reference = heapq.heappop(frontier)
+                if reference in scored:
+                    continue
+                node = self._load_node(reference)
+                report.deepest = max(report.deepest, depth)
+                if node.get_type == 'TEXT':
+                    batch.append((depth, node, ("text", node.get_text)))
+                    continue
+                children = node.get_children()
+                if not children:
+                    continue
+                if self.max_depth is not None and depth >= self.max_depth:
+                    report.pruned += len(children)
+                    continue
+                batch.append((depth, node, ("children", children)))
+            if not batch:
+                continue
+            jobs = self._reserve(report, [work for _, _, work in batch])
+            answers = (yield jobs) if jobs else []
+            for (depth, node, (kind, argument)), answer in zip(batch,
+                                                               answers):
+                if answer is None:
+                    report.stopped = "deadline"
+                elif kind == "text":
+                    self._keep_text(node, answer, report, results, order)
+                else:
+                    self._expand(argument, depth, answer, report, frontier,
+                                 order)
+            if len(frontier) > self.beam_width:
+                report.pruned += len(frontier) - self.beam_width
+                frontier = heapq.nsmallest(self.beam_width, frontier)
+                heapq.heapify(frontier)
+            if len(jobs) < len(batch) or report.truncated:
+                break
+        return self._finish(results, report)
+
+    def _reserve(self, report, work):
+        """
+        Picks the scoring jobs of a round that fit the budgets, in order,
+        stopping at the first that does not and recording in the report
+        which budget stopped the search. Any calls left over after every
+        job's expected cost are shared among the jobs, for fallbacks.
+
+        Args:
+            report (SearchReport): The search's report.
+            work (list): (kind, argument) pairs to score.
+
+        Returns:
+            list: The (kind, argument, max_calls) jobs to run.
+        """
+        if self.max_seconds is not None and \
+                self._clock() - self._started >= self.max_seconds:
+            report.stopped = "deadline"
+            return []
+        costs = []
+        for kind, argument in work:
+            cost = 1 if kind == "text" else self._children_cost(len(argument))
+            if self.max_llm_calls is not None and \
+                    report.llm_calls + sum(costs) + cost > self.max_llm_calls:
+                report.stopped = "llm_calls"
+                break
+            costs.append(cost)
+        if self.max_llm_calls is None:
+            return [(kind, argument, None)
+                    for (kind, argument), _ in zip(work, costs)]
+        spare = self.max_llm_calls - report.llm_calls - sum(costs)
+        shares = [spare // len(costs) + (i < spare % len(costs))
+                  for i in range(len(costs))] if costs else []
+        return [(kind, argument, cost + share) for (kind, argument), cost,
+                share in zip(work, costs, shares)]
+
+    def _expand(self, children, depth, answer, report, frontier, order):
+        """
+        Adds the children of a scored branch node worth exploring to the
+        frontier.
+        """
+        scores, calls = answer
+        report.llm_calls += calls
+        report.nodes_expanded += 1
+        scores = [self._as_list(score) for score in scores]
+        explored = set()
+        for persona in range(len(scores[0])):
+            ranked = sorted(range(len(children)),
+                            key=lambda i: -scores[i][persona])
+            explored.add(ranked[0])
+            explored.update(i for i in ranked[1:] if
+                            scores[i][persona] > self.relevance_threshold)
+        report.pruned += len(children) - len(explored)
+        for i in sorted(explored):
+            heapq.heappush(frontier, (-max(scores[i]), next(order),
+                                      depth + 1, children[i].node_reference))
+
+    def _keep_text(self, node, answer, report, results, order):
+        """
+        Keeps a scored text node if it is among the best found.
+        """
+        score, calls = answer
+        report.llm_calls += calls
+        report.texts_scored += 1
+        tiebreak = -next(order)
+        for persona, persona_score in zip(results, self._as_list(score)):
+            entry = (persona_score, tiebreak, node)
+            if len(persona) < self.max_results:
+                heapq.heappush(persona, entry)
+            else:
+                heapq.heappushpop(persona, entry)
+
+    def _as_list(self, score):
+        return list(score) if self.personas is not None else [score]
+
+    def _finish(self, results, report):
+        report.seconds = self._clock() - self._started
+        return self._ranked(results), report
+
+    def _ranked(self, results):
+        ranked = [[(score, node) for score, _, node in
+                   sorted(persona, reverse=True)] for persona in results]
+        return ranked if self.personas is not None else ranked[0]
+
+async def gather_until(coroutines, seconds):
+    """
+    Runs coroutines concurrently until they finish or a number of seconds
+    pass, cancelling any still running then.
+
+    Args:
+        coroutines (list): The coroutines to run.
+        seconds (float): How long to wait, or None to wait for them all.
+
+    Returns:
+        tuple: The result of each coroutine, in order, or None for those
+            cancelled, and whether any were.
+    """
+    if seconds is None:
+        return await asyncio.gather(*coroutines), False
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    if not tasks:
+        return [], False
+    _, pending = await asyncio.wait(tasks, timeout=max(seconds, 0))
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+    return [None if task in pending else task.result()
+            for task in tasks], bool(pending)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 16:50:00 2026
+
+@author: magfrump
+
+Compares the binary node codec of lookup_index with the JSON that
+IndexedInfoNode.write_to_file writes, on the branch nodes of an existing
+index. Branch nodes hold the child summaries and references that both
+formats store, and no text.
+
+For each format it reports the total encoded size and the time to encode
+and decode every node, best of several rounds. Binary nodes are decoded
+from memoryviews into one shared buffer, as they would be from a memory
+map.
+
+Usage:
+    python benchmark_codec.py [directory] [rounds]
+"""
+
+import io
+import json
+import sys
+import timeit
+
+import indexed_info_node as iin
+import lookup_index as li
+
+def _time(func, rounds):
+    return min(timeit.repeat(func, number=1, repeat=rounds))
+
+def run(directory="data", rounds=20):
+    """
+    Times both formats on the branch nodes of an index directory.
+
+    Returns:
+        dict: (size in bytes, encode seconds, decode seconds) per format.
+    """
+    nodes = [node for node in li.nodes_from_index_dir(directory)
+             if node.children]
+    index_nodes = [iin.IndexedInfoNode.fromfilename(node.reference)
+                   for node in nodes]
+
+    def encode_json():
+        encoded = []
+        for index_node in index_nodes:
+            out = io.StringIO()
+            json.dump(index_node.to_json(), out)
+            encoded.append(out.getvalue())
+        return encoded
+
+    json_nodes = encode_json()
+
+    def decode_json():
+        return [iin.IndexedInfoNode.fromjson(json.loads(encoded))
+                for encoded in json_nodes]
+
+    def encode_binary():
+        return [li.serialize_node(node) for node in nodes]
+
+    binary_nodes = encode_binary()
+    buffer = memoryview(b"".join(binary_nodes))
+    views = []
+    offset = 0
+    for encoded in binary_nodes:
+        views.append(buffer[offset:offset+len(encoded)])
+        offset += len(encoded)
+
+    def decode_binary():
+        return [li.deserialize_node(view) for view in views]
+
+    return {
+        "json": (sum(len(encoded.encode('utf-8')) for encoded in json_nodes),
+                 _time(encode_json, rounds), _time(decode_json, rounds)),
+        "binary": (len(buffer), _time(encode_binary, rounds),
+                   _time(decode_binary, rounds)),
+    }
+
+if __name__ == '__main__':
+    index_directory = sys.argv[1] if len(sys.argv) > 1 else "data"
+    timing_rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    results = run(index_directory, timing_rounds)
+    print(f"{'format':>8} {'bytes':>9} {'encode ms':>10} {'decode ms':>10}")
+    for codec, (size, encode, decode) in results.items():
+        print(f"{codec:>8} {size:>9} {encode*1000:>10.3f} "
+              f"{decode*1000:>10.3f}")
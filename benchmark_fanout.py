@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 15:40:00 2026
+
+@author: magfrump
+
+Compares how many LLM calls RagNodes.retrieve makes on indexes of the same
+text built with different fan-outs (max_subtopics). A wider tree is
+shallower, so retrieval descends fewer levels but scores more children at
+each one.
+
+No Ollama server is needed: summaries and relevance scores come from
+stand-in models that count their calls. The summarizer keeps the most
+common words of a text, and the scorer rates a text by the share of the
+question's words it contains, so retrieval follows the branches whose
+summaries mention the question.
+
+Usage:
+    python benchmark_fanout.py [question] [fan-out ...]
+"""
+
+import json
+import os
+import re
+import sys
+import tempfile
+from collections import Counter
+
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+import indexed_info_node as iin
+import knowledge_graph as kg
+import node_definitions as nodedef
+
+DEFAULT_QUESTION = "How long may a sword be in a fight?"
+DEFAULT_FANOUTS = [4, 8, 16, 32, 64]
+
+_WORD = re.compile(r"[a-z]+")
+
+class CountingModel:
+    """
+    A stand-in chat model that counts its calls.
+    """
+    def __init__(self, respond):
+        self.calls = 0
+        self._respond = respond
+        self.llm = RunnableLambda(self._invoke)
+
+    def _invoke(self, prompt):
+        self.calls += 1
+        return AIMessage(content=self._respond(prompt.to_string()))
+
+def _summarize(prompt):
+    text = prompt.split("The text to be summarized is:")[-1]
+    words = Counter(word for word in _WORD.findall(text.lower())
+                    if len(word) > 3)
+    return " ".join(word for word, _ in words.most_common(30))
+
+def _score(prompt):
+    query = prompt.split("Query to find sources for:")[-1]
+    question, source = query.split("Source:", 1)
+    wanted = {word for word in _WORD.findall(question.lower())
+              if len(word) > 3}
+    found = set(_WORD.findall(source.lower()))
+    relevance = len(wanted & found) / max(len(wanted), 1)
+    return json.dumps({"relevance": relevance})
+
+def load_corpus(directory="data"):
+    """
+    Returns:
+        list: The text of every leaf of the index in a directory.
+    """
+    texts = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith("_kg.json"):
+            node = iin.IndexedInfoNode.fromfilename(
+                os.path.join(directory, name))
+            if node.get_type in ("TEXT", "TEXT_DOCUMENT"):
+                texts.append(node.get_text)
+    return texts
+
+def _depth(graph):
+    return 1 + max((_depth(sub) for sub in graph.subtopics), default=0)
+
+def run(question=DEFAULT_QUESTION, fanouts=None, corpus=None):
+    """
+    Builds an index at each fan-out and retrieves from it once.
+
+    Returns:
+        list: A dict of results for each fan-out.
+    """
+    corpus = corpus if corpus is not None else load_corpus()
+    results = []
+    for fanout in fanouts or DEFAULT_FANOUTS:
+        summarizer = CountingModel(_summarize)
+        graph = kg.KnowledgeGraph(corpus, 400, 20, fanout,
+                                  llm=summarizer.llm)
+        with tempfile.TemporaryDirectory() as directory:
+            graph.write_doc_to_dir(directory, "bench")
+            scorer = CountingModel(_score)
+            nodes = nodedef.RagNodes(directory+"/bench_kg.json",
+                                     scorer.llm, num_personas=1)
+            nodes.retrieve({"original_claim": question})
+        results.append({"fanout": fanout, "nodes": graph.num_nodes,
+                        "depth": _depth(graph),
+                        "build_calls": summarizer.calls,
+                        "retrieve_calls": scorer.calls})
+    return results
+
+if __name__ == '__main__':
+    benchmark_question = sys.argv[1] if len(sys.argv) > 1 \
+        else DEFAULT_QUESTION
+    benchmark_fanouts = [int(arg) for arg in sys.argv[2:]] or DEFAULT_FANOUTS
+    rows = run(benchmark_question, benchmark_fanouts)
+    print(f"{'fan-out':>8} {'nodes':>6} {'depth':>6} {'build calls':>12} "
+          f"{'retrieve calls':>15}")
+    for row in rows:
+        print(f"{row['fanout']:>8} {row['nodes']:>6} {row['depth']:>6} "
+              f"{row['build_calls']:>12} {row['retrieve_calls']:>15}")
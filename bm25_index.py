@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 20:10:00 2026
+
+@author: magfrump
+
+A BM25 inverted index over the text leaves of a document index, so that
+questions sharing words with the text can find it without walking the
+summary tree.
+
+The index of a graph is stored next to it in two files:
+    prefix_bm25.json: The sorted vocabulary, the leaf references and the
+        BM25 parameters.
+    prefix_bm25.npz: For each term, its postings (leaf numbers and term
+        counts) as slices of two flat integer arrays, plus the length of
+        every leaf.
+
+Classes:
+    BM25Index: A stored index, searched with numpy.
+
+Functions:
+    build_bm25(directory, prefix): Indexes every leaf of a written graph.
+
+Run as a script to index an existing graph:
+    python bm25_index.py data belegarth
+"""
+
+from collections import Counter
+import json
+import re
+import sys
+
+import numpy as np
+import indexed_info_node as iin
+
+K1 = 1.5
+B = 0.75
+
+_WORD = re.compile(r"\w+")
+
+def tokenize(text):
+    """
+    Returns:
+        list: The lowercased words of a text.
+    """
+    return _WORD.findall(text.lower())
+
+def _paths(directory, prefix):
+    return (directory+"/"+prefix+"_bm25.json",
+            directory+"/"+prefix+"_bm25.npz")
+
+def build_bm25(directory, prefix, k1=K1, b=B):
+    """
+    Walks a written graph from its root and indexes the text of every TEXT
+    and TEXT_DOCUMENT node. No LLM calls are made.
+
+    Args:
+        directory (str): The directory the graph is written to.
+        prefix (str): The name of the root node.
+        k1, b (float): The BM25 parameters stored with the index.
+
+    Returns:
+        int: The number of leaves indexed.
+    """
+    references = []
+    lengths = []
+    postings = {}
+    seen = set()
+    to_visit = [directory+"/"+prefix+"_kg.json"]
+    while to_visit:
+        reference = to_visit.pop()
+        node = iin.IndexedInfoNode.fromfilename(reference)
+        if node.get_type in ("TEXT", "TEXT_DOCUMENT"):
+            words = tokenize(node.get_text)
+            for term, count in Counter(words).items():
+                postings.setdefault(term, []).append((len(references),
+                                                      count))
+            references.append(reference)
+            lengths.append(len(words))
+        for child in reversed(node.get_children()):
+            if child.node_reference not in seen:
+                seen.add(child.node_reference)
+                to_visit.append(child.node_reference)
+    terms = sorted(postings)
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    for i, term in enumerate(terms):
+        offsets[i + 1] = offsets[i] + len(postings[term])
+    flat = [posting for term in terms for posting in postings[term]]
+    docs = np.array([doc for doc, _ in flat], dtype=np.int32)
+    counts = np.array([count for _, count in flat], dtype=np.int32)
+    json_path, arrays_path = _paths(directory, prefix)
+    with open(json_path, 'w', encoding='utf-8') as f:
+        json.dump({"k1": k1, "b": b, "terms": terms,
+                   "references": references}, f)
+    np.savez_compressed(arrays_path, offsets=offsets, docs=docs,
+                        counts=counts,
+                        lengths=np.array(lengths, dtype=np.int32))
+    return len(references)
+
+class BM25Index:
+    """
+    The stored BM25 index of one graph.
+
+    Methods:
+        search(query, k): The k leaves scoring highest for a query.
+    """
+    def __init__(self, directory, prefix):
+        """
+        Opens the index written by build_bm25.
+
+        Args:
+            directory (str): The directory the graph is written to.
+            prefix (str): The name of the root node.
+        """
+        json_path, arrays_path = _paths(directory, prefix)
+        with open(json_path, encoding='utf-8') as f:
+            header = json.load(f)
+        self.k1 = header["k1"]
+        self.b = header["b"]
+        self.references = header["references"]
+        self._terms = {term: i for i, term in enumerate(header["terms"])}
+        with np.load(arrays_path) as arrays:
+            self._offsets = arrays["offsets"]
+            self._docs = arrays["docs"]
+            self._counts = arrays["counts"].astype(np.float32)
+            self._lengths = arrays["lengths"].astype(np.float32)
+        self._average_length = float(self._lengths.mean()) \
+            if len(self._lengths) else 0.0
+
+    def scores(self, query):
+        """
+        Scores every leaf for a query.
+
+        Args:
+            query (str): The query.
+
+        Returns:
+            numpy.ndarray: The BM25 score of each leaf, in the order of
+                references.
+        """
+        scores = np.zeros(len(self.references), dtype=np.float32)
+        if not self.references:
+            return scores
+        norms = self.k1 * (1 - self.b + self.b * self._lengths /
+                           max(self._average_length, 1e-9))
+        for term in set(tokenize(query)):
+            i = self._terms.get(term)
+            if i is None:
+                continue
+            start, end = self._offsets[i], self._offsets[i + 1]
+            docs = self._docs[start:end]
+            counts = self._counts[start:end]
+            frequency = end - start
+            idf = np.log((len(self.references) - frequency + 0.5) /
+                         (frequency + 0.5) + 1)
+            scores[docs] += idf * counts * (self.k1 + 1) / \
+                (counts + norms[docs])
+        return scores
+
+    def search(self, query, k=10):
+        """
+        Finds the leaves scoring highest for a query.
+
+        Args:
+            query (str): The query.
+            k (int): The most leaves to return.
+
+        Returns:
+            list: (score, reference) pairs of the leaves with a positive
+                score, best first.
+        """
+        scores = self.scores(query)
+        best = np.argsort(-scores, kind="stable")[:k]
+        return [(float(scores[i]), self.references[i]) for i in best
+                if scores[i] > 0]
+
+    def __len__(self):
+        return len(self.references)
+
+if __name__ == '__main__':
+    index_dir = sys.argv[1] if len(sys.argv) > 1 else "data"
+    index_prefix = sys.argv[2] if len(sys.argv) > 2 else "belegarth"
+    print("Indexed", build_bm25(index_dir, index_prefix), "leaves of",
+          index_dir+"/"+index_prefix+"_kg.json")
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 13:50:00 2026
+
+@author: magfrump
+
+A journal of the summaries finished during an index build, so that a build
+interrupted by a crash can resume without redoing them.
+
+Classes:
+    BuildJournal: An append-only file of summaries keyed by the content hash
+        of the node they summarize.
+"""
+
+import json
+import os
+import threading
+
+class BuildJournal:
+    """
+    An append-only record of finished summaries. Each summary is written and
+    flushed to disk as soon as it is recorded, so at most the summary in
+    flight is lost if the process dies. Opening an existing journal loads
+    the summaries recorded by the interrupted build.
+
+    Attributes:
+        path (str): The journal file.
+    """
+    def __init__(self, path):
+        """
+        Opens (or creates) a journal.
+
+        Args:
+            path (str): The journal file.
+        """
+        self.path = path
+        self._summaries = {}
+        self._lock = threading.Lock()
+        torn = False
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    torn = not line.endswith("\n")
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # a record torn by the crash being recovered from
+                        continue
+                    self._summaries[entry["key"]] = entry["summary"]
+        self._file = open(path, 'a', encoding='utf-8')
+        if torn:
+            # start new records on their own line
+            self._file.write("\n")
+
+    def get(self, key):
+        """
+        Args:
+            key (str): The content hash of the summarized node.
+
+        Returns:
+            str: The recorded summary, or None if it was not recorded.
+        """
+        with self._lock:
+            return self._summaries.get(key)
+
+    def record(self, key, summary):
+        """
+        Records a finished summary and flushes it to disk.
+
+        Args:
+            key (str): The content hash of the summarized node.
+            summary (str): The summary.
+        """
+        with self._lock:
+            self._summaries[key] = summary
+            self._file.write(json.dumps({"key": key, "summary": summary})
+                             + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def __len__(self):
+        return len(self._summaries)
+
+    def close(self):
+        """
+        Closes the journal, keeping it on disk to resume from.
+        """
+        self._file.close()
+
+    def discard(self):
+        """
+        Closes and deletes the journal once the build has been written.
+        """
+        self.close()
+        os.remove(self.path)
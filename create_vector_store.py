@@ -6,8 +6,8 @@ Created on Mon Sep 23 15:26:13 2024
 @author: magfrump
 """
 import time
-from langchain_community.document_loaders import WebBaseLoader
-import knowledge_graph as kg
+from ingest_pipeline import IngestPipeline
+from summary_cache import SummaryCache
 
 # def create_vector_store():
 #     urls = [
@@ -33,26 +33,28 @@ import knowledge_graph as kg
 #     )
 #     return vectorstore.as_retriever()
 
-urls = [
-    # "https://www.magfrump.net",
-     "https://www.belegarth.com/rules",
-    # "https://en.wikipedia.org/wiki/List_of_common_misconceptions",
-    # "https://www.library.illinois.edu/infosci/research/guides/dewey/",
+sources = [
+    # ("https://www.magfrump.net", "magfrump"),
+     ("https://www.belegarth.com/rules", "belegarth"),
+    # ("https://en.wikipedia.org/wiki/List_of_common_misconceptions",
+    #  "misconceptions"),
+    # ("https://www.library.illinois.edu/infosci/research/guides/dewey/",
+    #  "dewey"),
 ]
 t0 = time.time()
-docs = [WebBaseLoader(url).load() for url in urls]
-print(docs)
-print("Loaded web page at time: ", time.time()-t0)
-docs_list = [item for sublist in docs for item in sublist]
-
-parsed_docs = [kg.KnowledgeGraph([docs_list[i].page_content],
-                                 800, 20, 10, docs_list[i].metadata)
-               for i in range(len(docs_list))]
-print("\n\nParsed docs at time: ", time.time()-t0)
-
-for pardoc in parsed_docs:
-    pardoc.write_doc_to_dir("data", "belegarth")
-print("\n\nWrote parsed doc to disk at time: ",time.time()-t0)
+summary_cache = SummaryCache("data/summary_cache.sqlite")
+# Pages are fetched, summarized and written by separate stages, so several
+# pages can be in flight at once. Each page's nodes are written as they are
+# summarized, with its text stored once in a blob file.
+pipeline = IngestPipeline("data", 800, 20, 10, cache=summary_cache,
+                          streaming=True, blob=True)
+pipeline.run(sources)
+print("\n\nWrote parsed docs to disk at time: ",time.time()-t0)
+for stage_stats in pipeline.stats.values():
+    print(stage_stats)
+print("LLM calls made: ", pipeline.build_stats.llm_calls)
+print("Summaries from cache: ", pipeline.build_stats.cache_hits)
+summary_cache.close()
 # text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
 #     chunk_size=4000, chunk_overlap=100
 # )
@@ -12,12 +12,21 @@ Classes:
     ChildNode: Represents a child node, containing a reference and summary.
     NodeMetaData: Represents metadata for a node, including creation and update
         timestamps, source, and type.
+    TextSpan: Represents a byte range of text stored in a shared blob file.
     IndexedInfoNode: Represents an indexed information node, containing
         children, metadata, and text.
+    LazyIndexedInfoNode: An IndexedInfoNode that reads its text on first use,
+        for stores that keep the text apart from the rest of the node.
 """
 
 from dataclasses import dataclass
 import json
+import mmap
+import threading
+
+# Open blob files, mapped once per process and shared by every node.
+_blobs = {}
+_blobs_lock = threading.Lock()
 
 @dataclass
 class ChildNode:
@@ -42,11 +51,71 @@ class NodeMetaData:
         updated (int): The timestamp when the node was last updated.
         source (str): The source of the node.
         node_type (str): The type of the node.
+        content_hash (str): A hash of the text of the node's subtree, built
+            from its children's hashes, or None if it was not recorded.
     """
     created: int
     updated: int
     source: str
     node_type: str
+    content_hash: str = None
+
+@dataclass
+class TextSpan:
+    """
+    Represents a byte range of UTF-8 text stored in a shared blob file, so
+    that overlapping chunks of a document do not each store a copy.
+
+    Attributes:
+        blob (str): The path of the blob file.
+        start (int): The byte offset where the text starts.
+        end (int): The byte offset where the text ends.
+    """
+    blob: str
+    start: int
+    end: int
+
+def _map_blob(blob):
+    """
+    Returns a read-only memory map of a blob file, opening it on first use.
+    """
+    with _blobs_lock:
+        if blob not in _blobs:
+            with open(blob, 'rb') as f:
+                _blobs[blob] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return _blobs[blob]
+
+def read_span(span):
+    """
+    Reads the text of a TextSpan through a memory map of its blob, decoding
+    straight from the mapped pages.
+
+    Args:
+        span (TextSpan): The span to read.
+
+    Returns:
+        str: The text in the span.
+    """
+    if span.start == span.end:
+        return ""
+    with memoryview(_map_blob(span.blob)) as view:
+        with view[span.start:span.end] as text:
+            return str(text, 'utf-8')
+
+def release_blobs(blob=None):
+    """
+    Closes mapped blob files, for example before a blob is rewritten.
+
+    Args:
+        blob (str): The path of the blob file to close, or None to close
+            every one.
+    """
+    with _blobs_lock:
+        blobs = list(_blobs) if blob is None else [blob]
+        for path in blobs:
+            mapped = _blobs.pop(path, None)
+            if mapped is not None:
+                mapped.close()
 
 class IndexedInfoNode():
     """
@@ -56,19 +125,25 @@ class IndexedInfoNode():
         _children: A tuple of child nodes.
         _meta_data: Metadata for the node.
         _text: The text associated with the node.
+        _span: Where the node's text is stored in a blob file, if it is not
+            stored in _text.
 
     Methods:
         __eq__(self, other): Checks if two IndexedInfoNode instances are equal.
         fromfilename(cls, json_file): Creates an IndexedInfoNode instance from
             a JSON file.
+        fromjson(cls, as_json): Creates an IndexedInfoNode instance from its
+            parsed JSON form.
+        to_json(self): Returns the node's data as a JSON-ready dict.
         write_to_file(self, filename): Writes the node's data to a JSON file.
         get_type(self): Returns the type of the node.
+        get_hash(self): Returns the hash of the node's subtree.
         get_text(self): Returns the text associated with the node.
         get_children(self): Returns the children of the node.
         retrieve_child(self, index): Retrieves a child node by its index and
             returns an IndexedInfoNode instance.
     """
-    def __init__(self, children, meta_data, text):
+    def __init__(self, children, meta_data, text, span=None):
         """
         Initializes an IndexedInfoNode instance.
 
@@ -76,11 +151,13 @@ class IndexedInfoNode():
             children: A tuple of child nodes.
             meta_data: Metadata for the node.
             text: The text associated with the node.
+            span: A TextSpan to read the text from instead, or None.
         """
         # Children are a tuple of (node_name, node_summary)
         self._children = children
         self._meta_data = meta_data
         self._text = text
+        self._span = span
 
     def __eq__(self, other):
         """
@@ -94,7 +171,14 @@ class IndexedInfoNode():
         """
         return (self._children == other._children
                 and self._meta_data == other._meta_data
-                and self._text == other._text)
+                and self._loaded_text() == other._loaded_text()
+                and self._span == other._span)
+
+    def _loaded_text(self):
+        """
+        Returns the inline text of the node, reading it first if needed.
+        """
+        return self._text
 
     @classmethod
     def fromfilename(cls, json_file):
@@ -110,23 +194,43 @@ class IndexedInfoNode():
         """
         with open(json_file, encoding='utf-8') as jf:
             as_json = json.loads(jf.read())
-            children = []
-            for child in as_json["children"]:
-                children.append(ChildNode(node_reference=child["reference"],
-                                          node_summary=child["summary"]))
-            metadata = NodeMetaData(created=as_json["created"],
-                                    updated = as_json["updated"],
-                                    source = as_json["source"],
-                                    node_type=as_json["type"])
-            text = as_json["text"]
-        return cls(children, metadata, text)
+        return cls.fromjson(as_json)
 
-    def write_to_file(self, filename):
+    @classmethod
+    def fromjson(cls, as_json, **kwargs):
         """
-        Writes the node's data to a JSON file.
+        Creates an IndexedInfoNode instance from its parsed JSON form.
 
         Args:
-            filename: The path to the output JSON file.
+            as_json (dict): The node as returned by to_json.
+            **kwargs: Passed on to the constructor, such as the load_text
+                of a LazyIndexedInfoNode.
+
+        Returns:
+            IndexedInfoNode: An IndexedInfoNode instance.
+        """
+        children = []
+        for child in as_json["children"]:
+            children.append(ChildNode(node_reference=child["reference"],
+                                      node_summary=child["summary"]))
+        metadata = NodeMetaData(created=as_json["created"],
+                                updated = as_json["updated"],
+                                source = as_json["source"],
+                                node_type=as_json["type"],
+                                content_hash=as_json.get("hash"))
+        text = as_json["text"]
+        span = None
+        if "blob" in as_json:
+            span = TextSpan(blob=as_json["blob"], start=as_json["start"],
+                            end=as_json["end"])
+        return cls(children, metadata, text, span, **kwargs)
+
+    def to_json(self):
+        """
+        Returns the node's data in the form written to JSON files.
+
+        Returns:
+            dict: The node's children, metadata and text.
         """
         as_json = {"children": []}
         for child in self._children:
@@ -136,9 +240,24 @@ class IndexedInfoNode():
         as_json["updated"] = self._meta_data.updated
         as_json["source"] = self._meta_data.source
         as_json["type"] = self._meta_data.node_type
-        as_json["text"] = self._text
+        if self._meta_data.content_hash is not None:
+            as_json["hash"] = self._meta_data.content_hash
+        if self._span is not None:
+            as_json["blob"] = self._span.blob
+            as_json["start"] = self._span.start
+            as_json["end"] = self._span.end
+        as_json["text"] = self._loaded_text()
+        return as_json
+
+    def write_to_file(self, filename):
+        """
+        Writes the node's data to a JSON file.
+
+        Args:
+            filename: The path to the output JSON file.
+        """
         with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(as_json, f)
+            json.dump(self.to_json(), f)
 
     @property
     def get_type(self):
@@ -150,6 +269,16 @@ class IndexedInfoNode():
         """
         return self._meta_data.node_type
 
+    @property
+    def get_hash(self):
+        """
+        Returns the hash of the node's subtree.
+
+        Returns:
+            str: The content hash, or None if it was not recorded.
+        """
+        return self._meta_data.content_hash
+
     @property
     def get_text(self):
         """
@@ -158,7 +287,9 @@ class IndexedInfoNode():
         Returns:
             str: The text associated with the node.
         """
-        return self._text
+        if self._span is not None:
+            return read_span(self._span)
+        return self._loaded_text()
 
     def get_children(self):
         """
@@ -182,3 +313,34 @@ class IndexedInfoNode():
                 retrieved child node.
         """
         return self.fromfilename(self._children[index].node_reference)
+
+
+class LazyIndexedInfoNode(IndexedInfoNode):
+    """
+    An IndexedInfoNode that loads its children and metadata up front but
+    only reads its text, with a function it is given, the first time the
+    text is used. Traversals that only need child summaries never read it.
+    This only pays where the text is stored apart from the rest of the node,
+    as in NodeStore; a node file is read whole anyway, so fromfilename
+    loads the text with everything else.
+    """
+    def __init__(self, children, meta_data, text, span=None, load_text=None):
+        """
+        Initializes a LazyIndexedInfoNode instance.
+
+        Args:
+            children: A tuple of child nodes.
+            meta_data: Metadata for the node.
+            text: The text associated with the node, or None to read it
+                with load_text when it is first needed.
+            span: A TextSpan to read the text from instead, or None.
+            load_text: A function returning the text.
+        """
+        super().__init__(children, meta_data, text, span)
+        self._load_text = load_text
+
+    def _loaded_text(self):
+        if self._text is None and self._load_text is not None:
+            self._text = self._load_text()
+            self._load_text = None
+        return self._text
@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 12:10:00 2026
+
+@author: magfrump
+
+A staged pipeline that fetches web pages and writes them to the document
+index. Each stage runs on its own pool of threads and hands work to the
+next stage through a bounded queue, so a slow stage applies back-pressure
+instead of letting work pile up in memory.
+
+Stages:
+    fetch: Loads each url with WebBaseLoader.
+    chunk: Splits the loaded pages into an undescribed KnowledgeGraph.
+    summarize: Summarizes every branch of the graph with the LLM.
+    write: Writes the graph as IndexedInfoNode files.
+
+In streaming mode the pages are instead handed to a StreamingGraphBuilder,
+which the summarize stage feeds page by page, writing nodes as soon as they
+are summarized, and the write stage only finishes the build.
+
+Items that fail with a load or LLM error are recorded in the stage's stats
+and skipped. Any other error stops every stage and is raised from run, so
+a broken stage cannot leave the others blocked on a full queue.
+
+Classes:
+    StageStats: Throughput counters for one stage.
+    IngestPipeline: Runs sources through the four stages.
+"""
+
+import queue
+import threading
+import time
+
+import requests
+from langchain_community.document_loaders import WebBaseLoader
+from build_journal import BuildJournal
+import knowledge_graph as kg
+
+# Marks the end of the input to a stage.
+_DONE = object()
+
+# How often a worker blocked on a queue checks whether the pipeline stopped.
+_POLL_SECONDS = 0.1
+
+# Pages that cannot be fetched and files that cannot be read or written.
+_LOAD_ERRORS = (requests.RequestException, OSError)
+# An LLM server that cannot be reached or whose reply is not a chat response.
+_LLM_ERRORS = (requests.RequestException, ConnectionError, KeyError,
+               ValueError)
+
+class StageStats:
+    """
+    Throughput counters for one pipeline stage.
+
+    Attributes:
+        name (str): The name of the stage.
+        workers (int): The number of threads running the stage.
+        items (int): The number of items the stage finished.
+        busy_seconds (float): The time spent working on items, summed over
+            all workers.
+        errors (list): (item, exception) pairs for items that failed.
+    """
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.errors = []
+        self._started = None
+        self._finished = None
+        self._lock = threading.Lock()
+
+    def record(self, started, finished, item=None, error=None):
+        """
+        Records one item handled by a worker between two times.
+        """
+        with self._lock:
+            if self._started is None or started < self._started:
+                self._started = started
+            if self._finished is None or finished > self._finished:
+                self._finished = finished
+            self.busy_seconds += finished - started
+            if error is None:
+                self.items += 1
+            else:
+                self.errors.append((item, error))
+
+    @property
+    def elapsed_seconds(self):
+        """
+        The wall-clock time from the first item starting to the last one
+        finishing.
+        """
+        if self._started is None:
+            return 0.0
+        return self._finished - self._started
+
+    @property
+    def throughput(self):
+        """
+        Items finished per second of wall-clock time.
+        """
+        if self.elapsed_seconds == 0:
+            return 0.0
+        return self.items / self.elapsed_seconds
+
+    def __str__(self):
+        return (f"{self.name}: {self.items} items, {len(self.errors)} "
+                f"errors, {self.throughput:.2f} items/s, "
+                f"{self.busy_seconds:.2f}s busy on {self.workers} workers")
+
+def _put(items, item, stop):
+    """
+    Puts an item on a queue, waiting for room unless the pipeline stops.
+    """
+    while not stop.is_set():
+        try:
+            items.put(item, timeout=_POLL_SECONDS)
+            return
+        except queue.Full:
+            pass
+
+def _get(items, stop):
+    """
+    Takes an item from a queue, or _DONE once the pipeline stops.
+    """
+    while not stop.is_set():
+        try:
+            return items.get(timeout=_POLL_SECONDS)
+        except queue.Empty:
+            pass
+    return _DONE
+
+class _Stage:
+    """
+    A pool of threads applying one function to every item of a queue.
+
+    Attributes:
+        stats (StageStats): The stage's throughput counters.
+        error (Exception): The first unexpected error that stopped a
+            worker, or None.
+    """
+    def __init__(self, name, func, workers, inbox, outbox, stop):
+        self.stats = StageStats(name, workers)
+        self.error = None
+        self._func = func
+        self._inbox = inbox
+        self._outbox = outbox
+        self._stop = stop
+        self._running = workers
+        self._lock = threading.Lock()
+        self._threads = [threading.Thread(target=self._work, daemon=True,
+                                          name=f"{name}-{i}")
+                         for i in range(workers)]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+    def _work(self):
+        try:
+            self._work_until_done()
+        except Exception as error:  # pylint: disable=broad-exception-caught
+            # stop every stage rather than leave them blocked on this one
+            with self._lock:
+                if self.error is None:
+                    self.error = error
+            self._stop.set()
+        finally:
+            with self._lock:
+                self._running -= 1
+                last = self._running == 0
+            if last and self._outbox is not None:
+                _put(self._outbox, _DONE, self._stop)
+
+    def _work_until_done(self):
+        while True:
+            item = _get(self._inbox, self._stop)
+            if item is _DONE:
+                # let the other workers of this stage see the end too
+                _put(self._inbox, _DONE, self._stop)
+                break
+            started = time.time()
+            try:
+                result = self._func(item)
+            except _LOAD_ERRORS + _LLM_ERRORS as error:
+                print("---", self.stats.name.upper(), "FAILED:", error, "---")
+                self.stats.record(started, time.time(), item, error)
+                continue
+            except Exception as error:
+                self.stats.record(started, time.time(), item, error)
+                raise
+            self.stats.record(started, time.time())
+            if self._outbox is not None:
+                _put(self._outbox, result, self._stop)
+
+class IngestPipeline:
+    """
+    Fetches web pages concurrently and writes each one to the document
+    index as a summarized knowledge graph.
+
+    Attributes:
+        stats (dict): StageStats for each stage, keyed by stage name.
+        build_stats (BuildStats): LLM and cache counters shared by every
+            graph the pipeline builds.
+    """
+    def __init__(self, directory, chunk_length=800, chunk_overlap=20,
+                 max_subtopics=10, llm=None, cache=None, fetch_workers=4,
+                 summarize_workers=2, queue_size=4, fetch=None,
+                 resumable=True, max_workers=1, streaming=False,
+                 blob=False):
+        """
+        Args:
+            directory (str): The directory to write node files to.
+            chunk_length, chunk_overlap, max_subtopics, llm, cache,
+                max_workers: As for KnowledgeGraph.
+            fetch_workers (int): The number of pages fetched at once.
+            summarize_workers (int): The number of graphs summarized at once.
+            queue_size (int): The most items waiting between two stages.
+            fetch: A function from url to a list of langchain Documents.
+                Defaults to WebBaseLoader over a shared requests session.
+            resumable (bool): Whether to journal each source's summaries to
+                prefix.journal, so a rerun after a crash resumes the build.
+                The journal is deleted once the graph is written.
+            streaming (bool): Whether to build each graph with a
+                StreamingGraphBuilder, holding only its open nodes in memory
+                instead of the whole graph. max_workers is then unused.
+            blob (bool): In streaming mode, whether to store leaf text once
+                in a blob file, as for StreamingGraphBuilder.
+        """
+        self.directory = directory
+        self.chunk_length = chunk_length
+        self.chunk_overlap = chunk_overlap
+        self.max_subtopics = max_subtopics
+        self.llm = llm
+        self.cache = cache
+        self.queue_size = queue_size
+        self.resumable = resumable
+        self.max_workers = max_workers
+        self.streaming = streaming
+        self.blob = blob
+        self.workers = {"fetch": fetch_workers, "chunk": 1,
+                        "summarize": summarize_workers, "write": 1}
+        self._session = requests.Session()
+        self._fetch = fetch if fetch is not None else self._load_url
+        self.build_stats = kg.BuildStats()
+        self.stats = {}
+        self._written = []
+        # graphs chunked but not yet written, keyed by prefix
+        self._unfinished = {}
+        self._lock = threading.Lock()
+
+    def run(self, sources):
+        """
+        Runs every source through the pipeline and waits for it to finish.
+        The files and journals of graphs that failed are closed, leaving
+        the journals on disk to resume from.
+
+        Args:
+            sources: An iterable of (url, prefix) pairs. Each url is written
+                as a graph whose root node is named by its prefix.
+
+        Returns:
+            list: The root node filenames written, in the order they
+                finished.
+
+        Raises:
+            Exception: The first error other than a load or LLM error,
+                after every stage has stopped.
+        """
+        funcs = {"fetch": self._fetch_stage, "chunk": self._chunk_stage,
+                 "summarize": self._summarize_stage,
+                 "write": self._write_stage}
+        names = list(funcs)
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in names]
+        stop = threading.Event()
+        stages = [_Stage(name, funcs[name], self.workers[name], queues[i],
+                         queues[i+1] if i+1 < len(names) else None, stop)
+                  for i, name in enumerate(names)]
+        self.stats = {stage.stats.name: stage.stats for stage in stages}
+        self._written = []
+        self._unfinished = {}
+        try:
+            for stage in stages:
+                stage.start()
+            for source in sources:
+                if stop.is_set():
+                    break
+                _put(queues[0], source, stop)
+            _put(queues[0], _DONE, stop)
+        finally:
+            for stage in stages:
+                stage.join()
+            self._close_unfinished()
+        for stage in stages:
+            if stage.error is not None:
+                raise stage.error
+        return list(self._written)
+
+    def _close_unfinished(self):
+        """
+        Closes the builder files and journals of graphs that were not
+        written.
+        """
+        with self._lock:
+            unfinished = list(self._unfinished.values())
+            self._unfinished = {}
+        for graph in unfinished:
+            if isinstance(graph, kg.StreamingGraphBuilder):
+                graph.close()
+            if graph.journal is not None:
+                # keep the journal on disk so a rerun can resume
+                graph.journal.close()
+
+    def _load_url(self, url):
+        return WebBaseLoader(url, session=self._session,
+                             raise_for_status=True).load()
+
+    def _fetch_stage(self, source):
+        url, prefix = source
+        return url, prefix, self._fetch(url)
+
+    def _chunk_stage(self, fetched):
+        url, prefix, docs = fetched
+        source = docs[0].metadata if len(docs) == 1 else url
+        journal = None
+        if self.resumable:
+            journal = BuildJournal(self.directory+"/"+prefix+".journal")
+        try:
+            if self.streaming:
+                graph = kg.StreamingGraphBuilder(
+                    self.directory, prefix, self.chunk_length,
+                    self.chunk_overlap, self.max_subtopics, source,
+                    llm=self.llm, stats=self.build_stats, cache=self.cache,
+                    blob=self.blob, journal=journal)
+            else:
+                graph = kg.KnowledgeGraph([doc.page_content for doc in docs],
+                                          self.chunk_length,
+                                          self.chunk_overlap,
+                                          self.max_subtopics, source,
+                                          llm=self.llm,
+                                          max_workers=self.max_workers,
+                                          describe=False,
+                                          stats=self.build_stats,
+                                          cache=self.cache, journal=journal)
+        except Exception:
+            if journal is not None:
+                journal.close()
+            raise
+        with self._lock:
+            self._unfinished[prefix] = graph
+        return prefix, graph, docs if self.streaming else None
+
+    @staticmethod
+    def _summarize_stage(chunked):
+        _, graph, docs = chunked
+        if docs is None:
+            graph.add_descriptions()
+        else:
+            for doc in docs:
+                graph.add_document(doc.page_content, doc.metadata)
+        return chunked
+
+    def _write_stage(self, summarized):
+        prefix, graph, docs = summarized
+        if docs is None:
+            graph.write_doc_to_dir(self.directory, prefix)
+        else:
+            graph.finish()
+        if graph.journal is not None:
+            graph.journal.discard()
+        with self._lock:
+            del self._unfinished[prefix]
+        self._written.append(self.directory+"/"+prefix+"_kg.json")
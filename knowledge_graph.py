@@ -6,19 +6,38 @@ Created on Fri Oct  4 14:06:13 2024
 @author: magfrump
 """
 
+from concurrent.futures import ThreadPoolExecutor
 from math import ceil
+import hashlib
 import json
+import os
+import sqlite3
+import threading
 import time
-from langchain_community.chat_models import ChatOllama
 from langchain_core.prompts import PromptTemplate
 import indexed_info_node as iin
+import llm_client
+from node_ids import NodeIdAllocator
+from bm25_index import build_bm25
+from summary_cache import SummaryCache
+from summary_vectors import build_vectors
+
+# Bump whenever the summary prompt changes so cached summaries are not reused.
+SUMMARY_PROMPT_VERSION = 1
 
 def _split_document(document, chunk_length, chunk_overlap):
-    chunks = []
-    for i in range(0, len(document)-1, chunk_length - chunk_overlap):
-        chunk = document[i:i + chunk_length]
-        chunks.append(chunk)
-    return chunks
+    return list(_iter_chunks(document, chunk_length, chunk_overlap))
+
+def _iter_chunks(document, chunk_length, chunk_overlap):
+    for start, end in _iter_spans(len(document), chunk_length, chunk_overlap):
+        yield document[start:end]
+
+def _iter_spans(document_length, chunk_length, chunk_overlap):
+    """
+    Yields the (start, end) character offsets of each chunk of a document.
+    """
+    for i in range(0, document_length-1, chunk_length - chunk_overlap):
+        yield i, min(i + chunk_length, document_length)
 
 def _summarize(document, llm):
     summary_prompt = PromptTemplate(
@@ -38,20 +57,185 @@ def _summarize(document, llm):
     summary = prompt.invoke({"text": document})
     return summary.pretty_repr()
 
+def _hash_leaf(text):
+    return hashlib.sha256(b"TEXT\x00" + text.encode('utf-8')).hexdigest()
+
+def _hash_children(child_hashes):
+    return hashlib.sha256(("NODE\x00" + ",".join(child_hashes))
+                          .encode('utf-8')).hexdigest()
+
+def _stored_hash(filename):
+    """
+    Reads the content hash of a node file, or None if there is no such file.
+    """
+    if not os.path.exists(filename):
+        return None
+    return iin.IndexedInfoNode.fromfilename(filename).get_hash
+
+def _node_filename(directory, ids, path):
+    """
+    The file of the node at a tree path, named by a NodeIdAllocator.
+    """
+    return directory+"/"+ids.node_id(path)+"_kg.json"
+
+def _default_llm(chunk_length, max_subtopics):
+    """
+    The shared pooled chat model, limited to summaries of about one
+    subtopic's share of a chunk.
+    """
+    return llm_client.shared_llm().bind(
+        num_predict=int(chunk_length/max_subtopics))
+
+def _model_name(llm):
+    """
+    Names the model behind an LLM for use in cache keys.
+    """
+    return getattr(llm, "model", type(llm).__name__)
+
+def summarize_text(text, llm, stats, cache=None, journal=None, key=None):
+    """
+    Summarizes text with the LLM, unless a build journal or the summary
+    cache already has a summary of it, and counts the work in stats.
+
+    Args:
+        text (str): The text to summarize.
+        llm: The chat model used for summaries.
+        stats (BuildStats): The counters to update.
+        cache (SummaryCache): An optional on-disk summary cache.
+        journal (BuildJournal): An optional journal of the current build.
+            Summaries are recorded in it under key as soon as they finish.
+        key (str): The content hash of the node being summarized.
+
+    Returns:
+        str: The summary.
+    """
+    if journal is not None:
+        summary = journal.get(key)
+        if summary is not None:
+            stats.count_resumed()
+            return summary
+    summary = _cached_summarize(text, llm, stats, cache)
+    if journal is not None:
+        journal.record(key, summary)
+    return summary
+
+def _cached_summarize(text, llm, stats, cache):
+    if cache is None:
+        stats.count_llm_call()
+        return _summarize(text, llm)
+    key = SummaryCache.make_key(text, _model_name(llm), SUMMARY_PROMPT_VERSION)
+    summary = cache.get(key)
+    if summary is not None:
+        stats.count_cache_hit()
+        return summary
+    stats.count_llm_call()
+    summary = _summarize(text, llm)
+    cache.put(key, summary)
+    return summary
+
+class BuildStats:
+    """
+    Counts the work done while building a knowledge graph. One instance is
+    shared by every node of a graph, so it is safe to update from worker
+    threads.
+
+    Attributes:
+        llm_calls (int): The number of summaries requested from the LLM.
+        cache_hits (int): The number of summaries served from a
+            SummaryCache instead of the LLM.
+        resumed (int): The number of summaries recovered from the journal
+            of an interrupted build.
+        nodes_reused (int): The number of stored nodes a refresh kept.
+        nodes_rebuilt (int): The number of nodes a refresh rewrote.
+    """
+    def __init__(self):
+        self.llm_calls = 0
+        self.cache_hits = 0
+        self.resumed = 0
+        self.nodes_reused = 0
+        self.nodes_rebuilt = 0
+        self._lock = threading.Lock()
+
+    def count_llm_call(self):
+        """
+        Records one call to the LLM.
+        """
+        with self._lock:
+            self.llm_calls += 1
+
+    def count_cache_hit(self):
+        """
+        Records one summary served from the cache.
+        """
+        with self._lock:
+            self.cache_hits += 1
+
+    def count_resumed(self):
+        """
+        Records one summary recovered from a build journal.
+        """
+        with self._lock:
+            self.resumed += 1
+
+    def count_nodes_reused(self, count):
+        """
+        Records stored nodes kept by a refresh.
+        """
+        with self._lock:
+            self.nodes_reused += count
+
+    def count_nodes_rebuilt(self, count):
+        """
+        Records nodes rewritten by a refresh.
+        """
+        with self._lock:
+            self.nodes_rebuilt += count
+
 class KnowledgeGraph:
     def __init__(self, input_documents, chunk_length, chunk_overlap, \
-                 max_subtopics = 10, source = ""):
+                 max_subtopics = 10, source = "", llm = None, max_workers = 1,
+                 describe = True, stats = None, cache = None, journal = None):
+        """
+        Splits the input documents into a tree of chunks and, unless
+        describe is False, summarizes every branch.
+
+        Args:
+            llm: The chat model used for summaries. Defaults to the pooled
+                llm_client.shared_llm(); it is shared with every subtopic.
+            max_workers (int): The number of summaries that may be in flight
+                at once. 1 builds serially; more summarizes siblings
+                concurrently. The resulting tree is the same either way.
+            describe (bool): Whether to summarize the tree on construction.
+                Subtopics are built with describe=False and summarized by
+                the root.
+            stats (BuildStats): Counters shared with every subtopic. A new
+                BuildStats is created when none is given.
+            cache (SummaryCache): An optional on-disk cache consulted before
+                asking the LLM for a summary.
+            journal (BuildJournal): An optional journal recording each
+                summary as it finishes. Building the same documents with the
+                journal of an interrupted build skips the summaries it holds.
+        """
         self.chunk_length = chunk_length
         self.chunk_overlap = chunk_overlap
         self.max_subtopics = max_subtopics
+        self.max_workers = max_workers
         self.subtopics = []
+        # summaries[i] is the summary of subtopics[i]
+        self.summaries = []
         self.text = ""
         self.source = str(source)
-        self.llm = ChatOllama(model="Kale", temperature=0, \
-                              num_predict = int(self.chunk_length/self.max_subtopics))
+        self.stats = stats if stats is not None else BuildStats()
+        self.cache = cache
+        self.journal = journal
+        self._content_hash = None
+        if llm is None:
+            llm = _default_llm(chunk_length, max_subtopics)
+        self.llm = llm
         self._process_input_documents(input_documents, chunk_length, \
                                       chunk_overlap, max_subtopics)
-        self.add_descriptions()
+        if describe:
+            self.add_descriptions()
 
     @classmethod
     def from_file(cls, input_directory):
@@ -85,16 +269,11 @@ class KnowledgeGraph:
                 chunks = _split_document(doc, chunk_length, chunk_overlap)
                 #print("text of length ", len(doc), "split into ", len(chunks), " chunks")
                 #print(chunks)
-                self.subtopics.append(KnowledgeGraph(chunks,
-                                                     chunk_length,
-                                                     chunk_overlap,
-                                                     max_subtopics))
+                self.subtopics.append(self._subgraph(chunks))
                 return
             #print("medium text ", len(doc))
             chunks = _split_document(doc, chunk_length, chunk_overlap)
-            self.subtopics.extend([KnowledgeGraph([_], chunk_length, \
-                                                 chunk_overlap, \
-                                                 max_subtopics) for _ in chunks])
+            self.subtopics.extend([self._subgraph([_]) for _ in chunks])
             return
 
         if len(input_documents) > max_subtopics:
@@ -103,15 +282,23 @@ class KnowledgeGraph:
             #print(docs_per_subtopic)
             for i in range(0, len(input_documents), docs_per_subtopic):
                 self.subtopics.append( \
-                                KnowledgeGraph( \
-                                    input_documents[i:i+docs_per_subtopic], \
-                                    chunk_length, chunk_overlap, max_subtopics))
+                                self._subgraph( \
+                                    input_documents[i:i+docs_per_subtopic]))
             return
 
         #print("few documents")
         for doc in input_documents:
-            self.subtopics.append(KnowledgeGraph([doc], chunk_length, \
-                                                 chunk_overlap, max_subtopics))
+            self.subtopics.append(self._subgraph([doc]))
+
+    def _subgraph(self, input_documents):
+        """
+        Builds an undescribed subtopic sharing this graph's settings.
+        """
+        return KnowledgeGraph(input_documents, self.chunk_length,
+                              self.chunk_overlap, self.max_subtopics,
+                              llm=self.llm, max_workers=self.max_workers,
+                              describe=False, stats=self.stats,
+                              cache=self.cache, journal=self.journal)
 
     def add_descriptions(self):
         """
@@ -119,38 +306,178 @@ class KnowledgeGraph:
         """
         if len(self.text) > 0:
             return self.get_text()
+        if self.max_workers > 1:
+            self._add_descriptions_concurrently()
+            return self.get_text()
         for subtopic in self.subtopics:
-            self.text += _summarize(subtopic.add_descriptions(), self.llm)
-            self.text += "\nAND\n"
+            subtopic.add_descriptions()
+            self.add_summary(self.summarize_subtopic(subtopic))
         return self.get_text()
 
+    def summarize_subtopic(self, subtopic):
+        """
+        Summarizes a described subtopic of this node with this graph's LLM,
+        cache and journal.
+
+        Returns:
+            str: The summary.
+        """
+        return summarize_text(subtopic.get_text(), self.llm, self.stats,
+                              self.cache, self.journal, subtopic.content_hash)
+
+    def add_summary(self, summary):
+        """
+        Keeps the summary of the next subtopic and appends it to this
+        node's text. Summaries must be added in subtopic order.
+        """
+        self.summaries.append(summary)
+        self.text += summary
+        self.text += "\nAND\n"
+
+    def _levels(self):
+        """
+        Groups the nodes of this graph by depth, starting with this node.
+        """
+        levels = []
+        level = [self]
+        while level:
+            levels.append(level)
+            level = [sub for node in level for sub in node.subtopics]
+        return levels
+
+    def _add_descriptions_concurrently(self):
+        """
+        Summarizes the tree one level at a time, deepest level first. All
+        subtopics on a level are independent of each other, so they are
+        handed to a pool of max_workers threads; summaries are joined in
+        subtopic order so the text matches a serial build.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            for level in reversed(self._levels()):
+                jobs = [(node, subtopic) for node in level if not node.text
+                        for subtopic in node.subtopics]
+                summaries = pool.map(
+                    lambda job: job[0].summarize_subtopic(job[1]), jobs)
+                for (node, _), summary in zip(jobs, summaries):
+                    node.add_summary(summary)
+
     def write_doc_to_dir(self, directory, prefix="", node_type="DOCUMENT"):
         """
         Writes a node to file in the given directory, writing all
-        descendents of that node to separate files with numerical
-        suffixes.
+        descendents of that node to separate files. The root is named by
+        prefix and other nodes by a NodeIdAllocator, which records the name
+        of each tree path in the graph's manifest. Child summaries are the
+        ones computed by add_descriptions, so writing makes no LLM calls.
+        The summaries' vectors and a BM25 index of the leaf text are written
+        next to the graph for retrieval to use.
+        """
+        ids = NodeIdAllocator.load(directory, prefix)
+        self.write_tree(directory, ids, (), node_type)
+        ids.write(directory)
+        build_vectors(directory, prefix)
+        build_bm25(directory, prefix)
+
+    def write_tree(self, directory, ids, path, node_type):
+        """
+        Writes this node and its descendents, naming each by its tree path.
+        write_doc_to_dir calls this on the root.
 
-        Warning: if max_subtopics > 10, numerical suffixes could collide
-        causing undefined behavior.
+        Args:
+            directory (str): The directory to write node files to.
+            ids (NodeIdAllocator): The names of the graph's nodes.
+            path (tuple): The tree path of this node.
+            node_type (str): The type recorded on this node.
         """
         # writes as indexed_info_node
-        node = None
+        if self.subtopics:
+            self.add_descriptions()
+            for i, subtopic in enumerate(self.subtopics):
+                subtopic.write_tree(directory, ids, path+(i,), \
+                                     "DOCUMENT_SECTION")
+        self._write_node(directory, ids, path, node_type)
+
+    def refresh_doc_in_dir(self, directory, prefix="", node_type="DOCUMENT"):
+        """
+        Updates a graph previously written by write_doc_to_dir so that it
+        matches this graph, which should be built with describe=False.
+
+        Stored nodes whose content hash matches the new chunking are kept,
+        along with the summaries their parents hold for them. Only changed
+        subtrees and their ancestors are re-summarized and rewritten. Files
+        of stored nodes that no longer exist in the graph are left in place.
+        Stored nodes are found through the graph's manifest, so a graph
+        written without one is rebuilt in full. Graphs written by a
+        StreamingGraphBuilder group their nodes differently and are
+        refreshed by building them again with refresh=True.
+
+        Returns:
+            BuildStats: The stats of this graph, with nodes_reused and
+                nodes_rebuilt counting the nodes kept and rewritten.
+
+        Raises:
+            ValueError: If the stored graph was written by a
+                StreamingGraphBuilder.
+        """
+        ids = NodeIdAllocator.load(directory, prefix)
+        if ids.layout == "streaming":
+            raise ValueError(prefix+" was built by a StreamingGraphBuilder; "
+                             "refresh it with StreamingGraphBuilder("
+                             "refresh=True)")
+        filename = directory+"/"+prefix+"_kg.json"
+        if _stored_hash(filename) == self.content_hash:
+            self.stats.count_nodes_reused(self.num_nodes)
+            return self.stats
+        self.refresh_tree(directory, ids, (), node_type)
+        ids.write(directory)
+        build_vectors(directory, prefix)
+        build_bm25(directory, prefix)
+        return self.stats
+
+    def refresh_tree(self, directory, ids, path, node_type):
+        """
+        Rewrites this node, reusing the stored summaries of unchanged
+        children and refreshing the rest. refresh_doc_in_dir calls this on
+        the root; the arguments are as for write_tree.
+        """
+        filename = _node_filename(directory, ids, path)
+        stored_summaries = {}
+        if os.path.exists(filename):
+            stored = iin.IndexedInfoNode.fromfilename(filename)
+            stored_summaries = {child.node_reference: child.node_summary
+                                for child in stored.get_children()}
+        if self.subtopics:
+            self.summaries = []
+            self.text = ""
+        for i, subtopic in enumerate(self.subtopics):
+            reference = _node_filename(directory, ids, path+(i,))
+            if reference in stored_summaries and \
+                    _stored_hash(reference) == subtopic.content_hash:
+                ids.keep(path+(i,))
+                self.stats.count_nodes_reused(subtopic.num_nodes)
+                self.add_summary(stored_summaries[reference])
+                continue
+            subtopic.refresh_tree(directory, ids, path+(i,), "DOCUMENT_SECTION")
+            self.add_summary(self.summarize_subtopic(subtopic))
+        self._write_node(directory, ids, path, node_type)
+        self.stats.count_nodes_rebuilt(1)
+
+    def _write_node(self, directory, ids, path, node_type):
+        """
+        Writes this node, but not its descendents, to file.
+        """
         node_children = []
         node_metadata = iin.NodeMetaData(created=time.time(), \
                                          updated=time.time(), \
                                          source=self.source, \
-                                         node_type=node_type)
+                                         node_type=node_type, \
+                                         content_hash=self.content_hash)
 
         # If no subtopics, write a single text node
         if self.subtopics:
             for i in range(len(self.subtopics)):
-                subtopic = self.subtopics[i]
                 node_children.append( iin.ChildNode(
-                    node_reference= directory+"/"+prefix+str(i)+"_kg.json", \
-                    node_summary= _summarize(subtopic.get_text(), self.llm)))
-                self.subtopics[i].write_doc_to_dir(directory, \
-                                                   prefix=prefix+str(i), \
-                                                   node_type="DOCUMENT_SECTION")
+                    node_reference= _node_filename(directory, ids, path+(i,)),
+                    node_summary= self.summaries[i]))
             node = iin.IndexedInfoNode(node_children, node_metadata, "")
         else:
             if node_type=="DOCUMENT":
@@ -159,8 +486,25 @@ class KnowledgeGraph:
             else:
                 node_metadata.node_type = "TEXT"
             node = iin.IndexedInfoNode(node_children, node_metadata, self.text)
-        if node:
-            node.write_to_file(directory+"/"+prefix+"_kg.json")
+        node.write_to_file(_node_filename(directory, ids, path))
+
+    @property
+    def content_hash(self):
+        """
+        A Merkle-style hash of this subtree: leaves hash their text and
+        other nodes hash their subtopics' hashes.
+        """
+        if self._content_hash is None:
+            if self.subtopics:
+                self._content_hash = _hash_children(
+                    [subtopic.content_hash for subtopic in self.subtopics])
+            else:
+                self._content_hash = _hash_leaf(self.text)
+        return self._content_hash
+
+    @property
+    def num_nodes(self):
+        return 1 + sum(subtopic.num_nodes for subtopic in self.subtopics)
 
     @property
     def num_subtopics(self):
@@ -180,3 +524,311 @@ class KnowledgeGraph:
             print("\n{")
             subtopic.print()
             print("}")
+
+
+class StreamingGraphBuilder:
+    """
+    Builds a knowledge graph on disk from a stream of documents, writing
+    each node as an IndexedInfoNode file as soon as it is summarized.
+
+    Chunks become TEXT leaves in arrival order. Every max_subtopics
+    summaries on one level are closed into a DOCUMENT_SECTION node whose
+    summary moves up a level, so only one partly filled node per level is
+    held in memory: peak memory grows with depth times fan-out, not with
+    the size of the corpus. Nodes are named by a NodeIdAllocator in the
+    order they are written, and finish writes the graph's manifest. The
+    children of each written section are kept in a prefix_links.sqlite
+    file until then, rather than in memory.
+
+    With blob=True, documents are appended once to a prefix.blob file and
+    leaves store only the byte offsets of their chunk, which
+    IndexedInfoNode reads back through a memory map. Overlapping chunks then
+    cost no extra disk space.
+
+    With refresh=True, a graph stored under the same prefix is rebuilt from
+    the new documents reusing the summary of every stored node whose
+    content hash is unchanged, so only changed nodes and their ancestors
+    are summarized again. Nodes are named in the order they are written,
+    so unchanged nodes keep their names; stored files no longer in the
+    graph are left in place.
+
+    Methods:
+        build(documents): Adds every document and writes the root node.
+        add_document(document, source): Chunks, writes and summarizes one
+            document.
+        finish(): Closes the open nodes and writes the root node.
+        close(): Closes the builder's files without writing the root node.
+    """
+    def __init__(self, directory, prefix, chunk_length, chunk_overlap,
+                 max_subtopics=10, source="", llm=None, stats=None,
+                 cache=None, blob=False, journal=None, refresh=False):
+        """
+        Args:
+            directory (str): The directory to write node files to.
+            prefix (str): The name of the root node; other nodes are named
+                prefix_N.
+            source: The source recorded on nodes when a document gives
+                none.
+            llm, stats, cache, journal: As for KnowledgeGraph.
+            blob (bool): Whether to store leaf text as offsets into a
+                shared blob file instead of in each leaf.
+            refresh (bool): Whether to reuse the summaries of a graph
+                already stored under prefix. stats then counts the nodes
+                whose summary was reused and the nodes summarized again.
+
+        Raises:
+            ValueError: If refreshing a graph that was written by a
+                KnowledgeGraph.
+        """
+        self.directory = directory
+        self.prefix = prefix
+        self.chunk_length = chunk_length
+        self.chunk_overlap = chunk_overlap
+        self.max_subtopics = max_subtopics
+        self.source = str(source)
+        if llm is None:
+            llm = _default_llm(chunk_length, max_subtopics)
+        self.llm = llm
+        self.stats = stats if stats is not None else BuildStats()
+        self.cache = cache
+        self.journal = journal
+        # _levels[0] holds leaf summaries, _levels[1] section summaries, ...
+        self._levels = [[]]
+        # _hashes[i][j] is the content hash of the node in _levels[i][j]
+        self._hashes = [[]]
+        self._ids = NodeIdAllocator(prefix, layout="streaming")
+        stored = NodeIdAllocator.load(directory, prefix)
+        if refresh and stored.layout != "streaming" and \
+                os.path.exists(self._filename(prefix)):
+            raise ValueError(prefix+" was not built by a "
+                             "StreamingGraphBuilder; refresh it with "
+                             "KnowledgeGraph.refresh_doc_in_dir")
+        # the child files of each section written, to record tree paths
+        self._links_path = directory+"/"+prefix+"_links.sqlite"
+        if os.path.exists(self._links_path):
+            os.remove(self._links_path)
+        self._links = sqlite3.connect(self._links_path,
+                                      check_same_thread=False)
+        self._links.execute("""CREATE TABLE links (
+                                   parent TEXT NOT NULL,
+                                   position INTEGER NOT NULL,
+                                   child TEXT NOT NULL)""")
+        self._links.execute("CREATE INDEX links_parent ON links (parent)")
+        # the summaries of a stored graph, keyed by content hash
+        self._refresh = refresh
+        self._stored_root_hash = None
+        if refresh:
+            self._load_stored_summaries()
+        self._blob = None
+        self._blob_path = None
+        if blob:
+            self._blob_path = directory+"/"+prefix+".blob"
+            iin.release_blobs(self._blob_path)
+            self._blob = open(self._blob_path, 'wb')
+
+    def build(self, documents):
+        """
+        Adds every document from an iterable, then writes the root node.
+
+        Args:
+            documents: An iterable (such as a generator) of strings.
+
+        Returns:
+            str: The filename of the root node.
+        """
+        for document in documents:
+            self.add_document(document)
+        return self.finish()
+
+    def add_document(self, document, source=None):
+        """
+        Splits a document into chunks, writing each as a TEXT leaf.
+
+        Args:
+            document (str): The document text.
+            source: The source recorded on the leaves of this document.
+        """
+        source = self.source if source is None else str(source)
+        if self._blob is None:
+            for chunk in _iter_chunks(document, self.chunk_length,
+                                      self.chunk_overlap):
+                content_hash = _hash_leaf(chunk)
+                reference = self._write_node([], "TEXT", chunk, source,
+                                             content_hash)
+                self._add_child(0, reference, chunk, content_hash)
+            return
+        # Track the byte offset of each chunk start as the spans advance.
+        offset = self._blob.tell()
+        position = 0
+        self._blob.write(document.encode('utf-8'))
+        for start, end in _iter_spans(len(document), self.chunk_length,
+                                      self.chunk_overlap):
+            offset += len(document[position:start].encode('utf-8'))
+            position = start
+            chunk = document[start:end]
+            span = iin.TextSpan(blob=self._blob_path, start=offset,
+                                end=offset + len(chunk.encode('utf-8')))
+            content_hash = _hash_leaf(chunk)
+            reference = self._write_node([], "TEXT", "", source,
+                                         content_hash, span)
+            self._add_child(0, reference, chunk, content_hash)
+
+    def finish(self):
+        """
+        Closes every partly filled node and writes the root node.
+
+        Returns:
+            str: The filename of the root node.
+        """
+        level = 0
+        while level < len(self._levels) - 1:
+            if self._levels[level]:
+                self._close_level(level)
+            level += 1
+        root = self._filename(self.prefix)
+        metadata = self._metadata("DOCUMENT", self.source,
+                                  _hash_children(self._hashes[-1]))
+        node = iin.IndexedInfoNode(self._levels[-1], metadata, "")
+        node.write_to_file(root)
+        if self._refresh:
+            if node.get_hash == self._stored_root_hash:
+                self.stats.count_nodes_reused(1)
+            else:
+                self.stats.count_nodes_rebuilt(1)
+        self._link(root, self._levels[-1])
+        self._record_paths(root, ())
+        self._ids.write(self.directory)
+        build_vectors(self.directory, self.prefix)
+        self._levels = [[]]
+        self._hashes = [[]]
+        self.close()
+        # leaf text may be in the blob, so it is indexed once that is closed
+        build_bm25(self.directory, self.prefix)
+        return root
+
+    def close(self):
+        """
+        Closes the blob file and removes the links file. Called by finish,
+        or directly when a build is abandoned.
+        """
+        if self._blob is not None:
+            self._blob.close()
+            self._blob = None
+        if self._links is not None:
+            self._links.close()
+            self._links = None
+            os.remove(self._links_path)
+
+    def _add_child(self, level, reference, text, content_hash):
+        """
+        Summarizes a written node and adds it to the open node on a level,
+        closing that node once it has max_subtopics children.
+        """
+        summary = self._stored_summary(content_hash)
+        if summary is None:
+            summary = summarize_text(text, self.llm, self.stats, self.cache,
+                                     self.journal, content_hash)
+        self._levels[level].append(iin.ChildNode(node_reference=reference,
+                                                 node_summary=summary))
+        self._hashes[level].append(content_hash)
+        if len(self._levels[level]) >= self.max_subtopics:
+            self._close_level(level)
+
+    def _close_level(self, level):
+        """
+        Writes the open node on a level and passes it to the level above.
+        """
+        children = self._levels[level]
+        content_hash = _hash_children(self._hashes[level])
+        self._levels[level] = []
+        self._hashes[level] = []
+        if level + 1 == len(self._levels):
+            self._levels.append([])
+            self._hashes.append([])
+        reference = self._write_node(children, "DOCUMENT_SECTION", "",
+                                     self.source, content_hash)
+        text = "".join(child.node_summary + "\nAND\n" for child in children)
+        self._add_child(level + 1, reference, text, content_hash)
+
+    def _write_node(self, children, node_type, text, source, content_hash,
+                    span=None):
+        """
+        Writes a non-root node under the next free name.
+        """
+        reference = self._filename(self._ids.allocate())
+        self._link(reference, children)
+        node = iin.IndexedInfoNode(children,
+                                   self._metadata(node_type, source,
+                                                  content_hash),
+                                   text, span)
+        node.write_to_file(reference)
+        return reference
+
+    def _record_paths(self, filename, path):
+        """
+        Records the tree path of a written node and its descendents in the
+        manifest.
+        """
+        self._ids.assign(path, filename[len(self.directory)+1:
+                                        -len("_kg.json")])
+        children = self._links.execute(
+            "SELECT child FROM links WHERE parent = ? ORDER BY position",
+            (filename,)).fetchall()
+        for i, (child,) in enumerate(children):
+            self._record_paths(child, path+(i,))
+
+    def _load_stored_summaries(self):
+        """
+        Copies the summary of every node of the stored graph into the
+        links file, keyed by the node's content hash. The graph is walked
+        one node at a time, so only the nodes on the walk are in memory.
+        """
+        self._links.execute("""CREATE TABLE summaries (
+                                   content_hash TEXT PRIMARY KEY,
+                                   summary TEXT NOT NULL)""")
+        root = self._filename(self.prefix)
+        if not os.path.exists(root):
+            return
+        pending = [iin.IndexedInfoNode.fromfilename(root)]
+        self._stored_root_hash = pending[0].get_hash
+        while pending:
+            for child in pending.pop().get_children():
+                stored = iin.IndexedInfoNode.fromfilename(child.node_reference)
+                self._links.execute(
+                    "INSERT OR REPLACE INTO summaries VALUES (?, ?)",
+                    (stored.get_hash, child.node_summary))
+                pending.append(stored)
+
+    def _stored_summary(self, content_hash):
+        """
+        Returns the stored summary of a node with this content hash when
+        refreshing, counting the node as reused or rebuilt.
+        """
+        if not self._refresh:
+            return None
+        row = self._links.execute(
+            "SELECT summary FROM summaries WHERE content_hash = ?",
+            (content_hash,)).fetchone()
+        if row is None:
+            self.stats.count_nodes_rebuilt(1)
+            return None
+        self.stats.count_nodes_reused(1)
+        return row[0]
+
+    def _link(self, reference, children):
+        """
+        Records the child files of a written node in the links file.
+        """
+        self._links.executemany(
+            "INSERT INTO links VALUES (?, ?, ?)",
+            [(reference, i, child.node_reference)
+             for i, child in enumerate(children)])
+
+    def _filename(self, name):
+        return self.directory+"/"+name+"_kg.json"
+
+    @staticmethod
+    def _metadata(node_type, source, content_hash):
+        return iin.NodeMetaData(created=time.time(), updated=time.time(),
+                                source=source, node_type=node_type,
+                                content_hash=content_hash)
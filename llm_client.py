@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 13:05:00 2026
+
+@author: magfrump
+
+A single LLM client shared by the index builder and the RAG nodes.
+
+Every model handle sends its requests through one OllamaClient, which keeps
+HTTP connections to the Ollama server alive in a pool and caps how many
+requests may be in flight across the whole process. Generation parameters
+such as num_predict or format are given per call (for example with
+llm.bind(num_predict=80)) instead of by building a new client.
+
+Classes:
+    OllamaClient: The pooled HTTP session and global concurrency cap.
+    PooledChatOllama: A LangChain chat model that sends its requests
+        through an OllamaClient.
+
+Functions:
+    configure(base_url, max_concurrency, timeout): Replaces the shared client.
+    shared_client(): Returns the shared OllamaClient.
+    shared_llm(): Returns the shared chat model.
+"""
+
+import threading
+from typing import Any, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import (ChatGeneration, ChatGenerationChunk,
+                                    ChatResult)
+
+DEFAULT_BASE_URL = "http://localhost:11434"
+DEFAULT_MODEL = "Kale"
+
+_ROLES = {"human": "user", "ai": "assistant", "system": "system"}
+
+class OllamaClient:
+    """
+    Sends chat requests to an Ollama server over a pool of keep-alive
+    connections, with at most max_concurrency requests in flight.
+
+    Attributes:
+        base_url (str): The Ollama server to call.
+        max_concurrency (int): The most requests in flight at once.
+        timeout (float): Seconds to wait for a response.
+        calls (int): The number of requests sent.
+    """
+    def __init__(self, base_url=DEFAULT_BASE_URL, max_concurrency=4,
+                 timeout=300):
+        self.base_url = base_url.rstrip("/")
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.calls = 0
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+
+    def chat(self, model, messages, options=None, response_format=None):
+        """
+        Sends one chat request and waits for the whole response.
+
+        Args:
+            model (str): The Ollama model to run.
+            messages (list): Ollama chat messages, dicts with 'role' and
+                'content'.
+            options (dict): Generation options such as temperature and
+                num_predict.
+            response_format (str): Passed as Ollama's 'format', e.g. 'json'.
+
+        Returns:
+            str: The content of the model's reply.
+        """
+        payload = {"model": model, "messages": messages, "stream": False,
+                   "options": options or {}}
+        if response_format:
+            payload["format"] = response_format
+        with self._lock:
+            self.calls += 1
+        with self._slots:
+            response = self._session.post(self.base_url+"/api/chat",
+                                          json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()["message"]["content"]
+
+    def close(self):
+        """
+        Closes the pooled connections.
+        """
+        self._session.close()
+
+# The process-wide client and chat model, created on first use.
+_shared = {"client": None, "llm": None}
+_shared_lock = threading.Lock()
+
+def configure(base_url=DEFAULT_BASE_URL, max_concurrency=4, timeout=300):
+    """
+    Replaces the shared client, e.g. to point at another server or change
+    the global concurrency cap.
+
+    Returns:
+        OllamaClient: The new shared client.
+    """
+    with _shared_lock:
+        if _shared["client"] is not None:
+            _shared["client"].close()
+        _shared["client"] = OllamaClient(base_url, max_concurrency, timeout)
+        return _shared["client"]
+
+def shared_client():
+    """
+    Returns:
+        OllamaClient: The client shared by every model handle, created with
+            default settings on first use.
+    """
+    with _shared_lock:
+        if _shared["client"] is None:
+            _shared["client"] = OllamaClient()
+        return _shared["client"]
+
+class PooledChatOllama(BaseChatModel):
+    """
+    A chat model for a local Ollama server that sends every request through
+    an OllamaClient instead of opening its own connection.
+
+    Extra keyword arguments given at call time, or with bind, are sent as
+    Ollama generation options; 'format' selects Ollama's output format.
+    Responses are not streamed: stream yields the whole response as one
+    chunk. Tool calling is not supported.
+    """
+    model: str = DEFAULT_MODEL
+    temperature: float = 0
+    num_predict: Optional[int] = None
+    format: Optional[str] = None
+    client: Optional[Any] = None
+
+    @property
+    def _llm_type(self):
+        return "pooled-ollama"
+
+    def _generate(self, messages: List[BaseMessage], stop=None,
+                  run_manager=None, **kwargs):
+        options = {"temperature": self.temperature}
+        if self.num_predict is not None:
+            options["num_predict"] = self.num_predict
+        if stop:
+            options["stop"] = stop
+        response_format = kwargs.pop("format", self.format)
+        options.update(kwargs)
+        client = self.client if self.client is not None else shared_client()
+        content = client.chat(self.model,
+                              [{"role": _ROLES.get(message.type, "user"),
+                                "content": message.content}
+                               for message in messages],
+                              options, response_format)
+        return ChatResult(generations=[
+            ChatGeneration(message=AIMessage(content=content))])
+
+    def _stream(self, messages: List[BaseMessage], stop=None,
+                run_manager=None, **kwargs):
+        content = self._generate(messages, stop, **kwargs
+                                 ).generations[0].message.content
+        if run_manager is not None:
+            run_manager.on_llm_new_token(content)
+        yield ChatGenerationChunk(message=AIMessageChunk(content=content))
+
+    def bind_tools(self, tools, **kwargs):
+        raise NotImplementedError(
+            "PooledChatOllama does not support tool calling")
+
+def shared_llm():
+    """
+    Returns:
+        PooledChatOllama: The chat model shared across the process. Bind
+            per-call parameters to it rather than creating new models.
+    """
+    with _shared_lock:
+        if _shared["llm"] is None:
+            _shared["llm"] = PooledChatOllama()
+        return _shared["llm"]
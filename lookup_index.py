@@ -5,7 +5,13 @@ Created on Thu Oct  3 13:28:15 2024
 
 @author: magfrump
 """
+from collections import OrderedDict
 import json
+import os
+import sqlite3
+import struct
+import threading
+import indexed_info_node as iin
 
 class LookupIndex:
     """
@@ -83,36 +89,188 @@ class Node:
         topic (str): The topic name associated with this node.
         children (dict): A dictionary of child nodes, keyed by their topic names.
         id (int): The unique ID assigned to this node when serialized.
+        reference (str): The filename of the IndexedInfoNode this node
+            describes, or None.
     """
-    def __init__(self, topic, children=None):
+    def __init__(self, topic, children=None, reference=None):
         self.topic = topic
         self.children = children if children else {}
+        self.reference = reference
         self.id = None  # assigned when serialized
 
+# Serialized nodes start with a byte that never occurs in UTF-8, so they
+# can be told apart from text, then a format version.
+_MAGIC = b'\xff'
+CODEC_VERSION = 1
+_HEADER = _MAGIC + bytes([CODEC_VERSION])
+_LENGTH = struct.Struct('<I')
+# the reference length written for a node without a reference
+_NO_REFERENCE = 0xFFFFFFFF
+
+def _encode_text(text, out):
+    encoded = text.encode('utf-8')
+    out.append(_LENGTH.pack(len(encoded)))
+    out.append(encoded)
+
+def _encode_node(node, out):
+    """
+    Appends the body of a node: its topic, its reference and its children,
+    each prefixed by its length or count.
+    """
+    _encode_text(node.topic, out)
+    if node.reference is None:
+        out.append(_LENGTH.pack(_NO_REFERENCE))
+    else:
+        _encode_text(node.reference, out)
+    _encode_children(node.children, out)
+
+def _encode_children(children, out):
+    out.append(_LENGTH.pack(len(children)))
+    for child in children.values():
+        _encode_node(child, out)
+
+def _decode_text(view, offset):
+    """
+    Decodes a length-prefixed string straight from the buffer.
+
+    Returns:
+        tuple: The string, or None for a missing reference, and the offset
+            after it.
+    """
+    (length,) = _LENGTH.unpack_from(view, offset)
+    offset += _LENGTH.size
+    if length == _NO_REFERENCE:
+        return None, offset
+    end = offset + length
+    if end > len(view):
+        raise ValueError("Serialized node is truncated")
+    return str(view[offset:end], 'utf-8'), end
+
+def _decode_node(view, offset):
+    topic, offset = _decode_text(view, offset)
+    reference, offset = _decode_text(view, offset)
+    children, offset = _decode_children(view, offset)
+    return Node(topic, children, reference), offset
+
+def _decode_children(view, offset):
+    (count,) = _LENGTH.unpack_from(view, offset)
+    offset += _LENGTH.size
+    children = {}
+    for _ in range(count):
+        child, offset = _decode_node(view, offset)
+        children[child.topic] = child
+    return children, offset
+
+def _check_header(view):
+    if len(view) < len(_HEADER) or view[0] != _MAGIC[0]:
+        raise ValueError("Not a serialized node")
+    if view[1] != CODEC_VERSION:
+        raise ValueError(f"Unsupported node format version {view[1]}")
+
+def serialize_children(children):
+    """
+    Serializes the children of a node, and their descendents.
+
+    Args:
+        children (dict): Child nodes keyed by their topic names.
+
+    Returns:
+        bytes: The serialized children.
+    """
+    out = [_HEADER]
+    _encode_children(children, out)
+    return b''.join(out)
+
+def deserialize_children(data):
+    """
+    Deserializes the children written by serialize_children.
+
+    Args:
+        data (bytes or memoryview): The serialized children.
+
+    Returns:
+        dict: Child nodes keyed by their topic names.
+    """
+    view = memoryview(data)
+    _check_header(view)
+    try:
+        return _decode_children(view, len(_HEADER))[0]
+    except struct.error as error:
+        raise ValueError("Serialized children are truncated") from error
+
 def serialize_node(node):
     """
-   Serializes a Node instance to a binary format.
+    Serializes a Node instance, with its descendents, to a binary format:
+    a two byte header (a marker and the format version), then the topic,
+    the reference and the children of the node. Strings are UTF-8 with a
+    four byte length before them, and children follow their count, so
+    topics may contain any character.
 
-   Args:
-       node (Node): The node to be serialized.
+    Args:
+        node (Node): The node to be serialized.
 
-   Returns:
-       bytes: The serialized representation of the node.
-   """
-    return node.topic.encode('utf-8') + b'\x00' + serialize_children(node.children)
+    Returns:
+        bytes: The serialized representation of the node.
+    """
+    out = [_HEADER]
+    _encode_node(node, out)
+    return b''.join(out)
 
 def deserialize_node(data):
     """
-    Deserializes a Node instance from a binary format.
+    Deserializes a Node instance from a binary format. Strings are decoded
+    directly from the given buffer, without copying it first, so a node can
+    be read from a memoryview of a larger buffer or a memory map.
 
     Args:
-        data (bytes): The binary data containing the node's topic and children.
+        data (bytes or memoryview): The binary data containing the node's
+            topic and children.
 
     Returns:
         Node: An instance of Node representing the deserialized node.
+
+    Raises:
+        ValueError: If the data is not a serialized node, or is truncated.
     """
-    topic, children_data = data.split(b'\x00', 1)
-    return Node(topic.decode('utf-8'), deserialize_children(children_data))
+    view = memoryview(data)
+    _check_header(view)
+    try:
+        return _decode_node(view, len(_HEADER))[0]
+    except struct.error as error:
+        raise ValueError("Serialized node is truncated") from error
+
+def nodes_from_index_dir(directory):
+    """
+    Describes every *_kg.json node of a document index directory as a Node.
+    Each node's topic is the summary its parent gives it, or its filename
+    without _kg.json if it is a root, and its children are Nodes named by
+    their summaries. Nodes refer to their IndexedInfoNode files.
+
+    Args:
+        directory (str): The directory of node files.
+
+    Returns:
+        list: The Nodes, in filename order.
+    """
+    index_nodes = {}
+    for name in sorted(os.listdir(directory)):
+        if name.endswith("_kg.json"):
+            index_nodes[directory+"/"+name] = \
+                iin.IndexedInfoNode.fromfilename(
+                    os.path.join(directory, name))
+    topics = {}
+    for index_node in index_nodes.values():
+        for child in index_node.get_children():
+            topics[child.node_reference] = child.node_summary
+    nodes = []
+    for reference, index_node in index_nodes.items():
+        topic = topics.get(reference,
+                           reference.rsplit("/", 1)[-1][:-len("_kg.json")])
+        children = {child.node_summary:
+                    Node(child.node_summary, reference=child.node_reference)
+                    for child in index_node.get_children()}
+        nodes.append(Node(topic, children, reference))
+    return nodes
 
 def create_index(nodes):
     """
@@ -132,15 +290,45 @@ def create_index(nodes):
 
 class Library:
     """
-    Represents a library containing nodes and an index.
+    Represents a library containing nodes and an index. Nodes and the index
+    mapping topic names to node IDs are kept in an sqlite file, with the
+    most recently used nodes cached in memory.
 
     Attributes:
-        cache (dict): A cache of frequently accessed nodes, keyed by their topic names.
-        index (dict): An index mapping topic names to node IDs.
+        path (str): The sqlite file backing the library, or ":memory:".
+        cache (OrderedDict): (node ID, serialized node) pairs of recently
+            used nodes keyed by their topic names, least recently used
+            first.
+        max_cache_bytes (int): The most serialized bytes the cache holds.
+        cache_bytes (int): The serialized bytes the cache now holds.
+        hits (int): The get_chunk calls served from the cache.
+        misses (int): The get_chunk calls that read the node from disk.
     """
-    def __init__(self):
-        self.cache = {}  # cache for frequently accessed nodes
-        self.index = None  # index mapping topic names to node IDs
+    def __init__(self, path, max_cache_bytes=16*1024*1024):
+        """
+        Opens (or creates) a library.
+
+        Args:
+            path (str): The sqlite file backing the library, usually next to
+                the index it describes. ":memory:" keeps the library in
+                memory, to be lost when it is closed.
+            max_cache_bytes (int): The most serialized bytes to cache.
+        """
+        self.path = path
+        self.cache = OrderedDict()
+        self.max_cache_bytes = max_cache_bytes
+        self.cache_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS nodes (
+                                id INTEGER PRIMARY KEY,
+                                node BLOB NOT NULL)""")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS topics (
+                                topic TEXT PRIMARY KEY,
+                                node_id INTEGER NOT NULL)""")
+        self._conn.commit()
 
     def add_node(self, node):
         """
@@ -149,10 +337,89 @@ class Library:
         Args:
             node (Node): The node to be added.
         """
-        serialized_node = serialize_node(node)
-        self.cache[node.topic] = serialized_node
-        if not self.index:
-            self.index = create_index([node])
+        self.add_nodes([node])
+
+    def add_nodes(self, nodes):
+        """
+        Adds many nodes to the library's index in one transaction, giving
+        each node without an ID the next free one. A node whose topic is
+        already indexed replaces the earlier node in the index.
+
+        Args:
+            nodes: An iterable of Node instances.
+        """
+        with self._lock:
+            for node in nodes:
+                serialized_node = serialize_node(node)
+                if node.id is None:
+                    node.id = self._conn.execute(
+                        "INSERT INTO nodes (node) VALUES (?)",
+                        (serialized_node,)).lastrowid
+                else:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO nodes VALUES (?, ?)",
+                        (node.id, serialized_node))
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO topics VALUES (?, ?)",
+                    (node.topic, node.id))
+                self._cache_put(node.topic, node.id, serialized_node)
+            self._conn.commit()
+
+    def load_index_dir(self, directory):
+        """
+        Indexes every *_kg.json node of a document index directory, as
+        described by nodes_from_index_dir.
+
+        Args:
+            directory (str): The directory of node files.
+
+        Returns:
+            int: The number of nodes indexed.
+        """
+        nodes = nodes_from_index_dir(directory)
+        self.add_nodes(nodes)
+        return len(nodes)
+
+    def lookup(self, topic):
+        """
+        Finds the ID of the node indexed under a topic.
+
+        Args:
+            topic (str): The topic name.
+
+        Returns:
+            int: The node's ID.
+
+        Raises:
+            KeyError: If no node is indexed under the topic.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT node_id FROM topics WHERE topic = ?",
+                (topic,)).fetchone()
+        if row is None:
+            raise KeyError(f"Topic '{topic}' not found")
+        return row[0]
+
+    def load_node_from_disk(self, node_id):
+        """
+        Reads a serialized node from the library's file.
+
+        Args:
+            node_id (int): The node's ID.
+
+        Returns:
+            bytes: The serialized node.
+
+        Raises:
+            KeyError: If there is no node with the ID.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT node FROM nodes WHERE id = ?",
+                                     (node_id,)).fetchone()
+        if row is None:
+            raise KeyError(f"Node {node_id} not found")
+        return row[0]
 
     def get_chunk(self, topic):
         """
@@ -163,13 +430,57 @@ class Library:
 
         Returns:
             Node: An instance of Node representing the retrieved node.
+
+        Raises:
+            KeyError: If no node is indexed under the topic.
+        """
+        with self._lock:
+            cached = self.cache.get(topic)
+            if cached is not None:
+                self.cache.move_to_end(topic)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if cached is None:
+            # Load the node from disk lazily
+            node_id = self.lookup(topic)
+            cached = (node_id, self.load_node_from_disk(node_id))
+            with self._lock:
+                self._cache_put(topic, *cached)
+        node = deserialize_node(cached[1])
+        node.id = cached[0]
+        return node
+
+    @property
+    def hit_rate(self):
+        """
+        The share of get_chunk calls served from the cache.
+        """
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def _cache_put(self, topic, node_id, serialized_node):
+        """
+        Caches a node, evicting the least recently used nodes to stay within
+        max_cache_bytes. Call with the lock held.
         """
         if topic in self.cache:
-            return deserialize_node(self.cache[topic])
-        # Load the node from disk lazily
-        node_id = self.index.get(topic)
-        if node_id is None:
-            raise KeyError(f"Topic '{topic}' not found")
-        serialized_node = load_node_from_disk(node_id)
-        self.cache[topic] = serialized_node
-        return deserialize_node(serialized_node)
+            self.cache_bytes -= len(self.cache.pop(topic)[1])
+        if len(serialized_node) > self.max_cache_bytes:
+            return
+        self.cache[topic] = (node_id, serialized_node)
+        self.cache_bytes += len(serialized_node)
+        while self.cache_bytes > self.max_cache_bytes:
+            _, (_, evicted) = self.cache.popitem(last=False)
+            self.cache_bytes -= len(evicted)
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM topics").fetchone()[0]
+
+    def close(self):
+        """
+        Closes the underlying sqlite connection.
+        """
+        self._conn.close()
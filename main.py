@@ -6,40 +6,46 @@ Created on Thu Sep 19 13:46:47 2024
 @author: magfrump
 """
 
+import asyncio
 import os
 
-from langchain_community.chat_models import ChatOllama
 from langgraph.graph import END, StateGraph, START
 from langchain_core.runnables.config import RunnableConfig
 
+import llm_client
 import node_definitions as nodedef
+from bm25_index import BM25Index
+from node_store import NodeStore
+from relevance_cache import RelevanceCache
+from summary_vectors import SummaryVectors
 
-if __name__ == '__main__':
-    # set global variables. USER_AGENT identifies the process to html requests.
-    os.environ["USER_AGENT"] = "FnordFiddler"
-    # local llm sets the local llm profile to call using ollama
-    llm = ChatOllama(model="Kale", format="json", temperature = 0)
+def build_persona_graph(nodes):
+    """
+    Builds the graph one persona runs to write its note: retrieve, grade
+    the documents, then generate until the note is grounded and useful or
+    the persona's budget of generations is spent.
 
-    nodes = nodedef.RagNodes("data/belegarth_kg.json", llm)
+    Args:
+        nodes (RagNodes): The nodes of the graph.
 
-    ## Add nodes to workflow
-    workflow = StateGraph(nodedef.GraphState)
+    Returns:
+        The compiled graph, run on a GraphState holding only this persona's
+            responses.
+    """
+    persona = StateGraph(nodedef.GraphState)
     # Define the nodes
-    workflow.add_node("retrieve", nodes.retrieve)  # retrieve
-    workflow.add_node("grade_documents", nodes.grade_documents)  # grade documents
-    workflow.add_node("generate", nodes.generate)  # generate
-    workflow.add_node("next_note", nodes.next_note)
+    persona.add_node("retrieve", nodes.aretrieve)  # retrieve
+    persona.add_node("grade_documents", nodes.grade_documents)  # grade documents
+    persona.add_node("generate", nodes.generate)  # generate
+    persona.add_node("grade_generation", nodes.grade_generation)
     # NOT IMPLEMENTED:
-    workflow.add_node("websearch", nodes.web_search)  # web search
-    workflow.add_node("index_info", nodes.index_info)
-    workflow.add_node("rate_notes", nodes.rate_notes)
-    workflow.add_node("pick_winning_note", nodes.pick_winner)
+    persona.add_node("websearch", nodes.web_search)  # web search
+    persona.add_node("index_info", nodes.index_info)
 
     # Add graph edges
-
-    workflow.add_edge(START, "retrieve")
-    workflow.add_edge("retrieve", "grade_documents")
-    workflow.add_conditional_edges(
+    persona.add_edge(START, "retrieve")
+    persona.add_edge("retrieve", "grade_documents")
+    persona.add_conditional_edges(
       "grade_documents",
       nodes.decide_to_generate,
        {
@@ -47,40 +53,112 @@ if __name__ == '__main__':
            "generate": "generate"
        },
     )
-    workflow.add_edge("websearch", "index_info")
-    workflow.add_edge("index_info", "retrieve")
-    workflow.add_conditional_edges(
-        "generate",
+    persona.add_edge("websearch", "index_info")
+    persona.add_edge("index_info", "retrieve")
+    persona.add_edge("generate", "grade_generation")
+    persona.add_conditional_edges(
+        "grade_generation",
         nodes.grade_generation_v_documents_and_question,
         {
             "not supported": "generate",
-            "useful": "next_note",
+            "useful": END,
             "not useful": "websearch",
+            "exhausted": END,
         },
     )
-    workflow.add_conditional_edges(
-        "next_note",
-        nodes.increment_persona_or_move_on,
-        { "increment_persona": "retrieve", "move_on": "rate_notes" }
-     )
-    workflow.add_conditional_edges(
-        "rate_notes",
-        nodes.increment_persona_or_move_on,
-        {
-            "increment_persona": "rate_notes",
-            "move_on": "pick_winning_note",
-        },
-    )
+    return persona.compile()
+
+def build_workflow(nodes, recursion_limit=20):
+    """
+    Builds the workflow as a map-reduce over personas. In multi-persona
+    mode the index is first walked once for every persona. Then every
+    persona writes its note in its own branch of build_persona_graph, all
+    at once, starting from the sources found for it if there are any; their
+    notes are collected, every persona rates them in parallel, and the
+    best rated note wins. It takes about as long as the slowest persona
+    rather than all of them in turn.
+
+    Args:
+        nodes (RagNodes): The nodes of the graph.
+        recursion_limit (int): The most steps each persona's graph may take.
+
+    Returns:
+        The compiled workflow, run on a FanOutState.
+    """
+    persona_app = build_persona_graph(nodes)
+
+    async def write_note(branch):
+        result = await persona_app.ainvoke(
+            branch, RunnableConfig(recursion_limit=recursion_limit))
+        return {"responses": result["responses"][-1:]}
+
+    workflow = StateGraph(nodedef.FanOutState)
+    workflow.add_node("retrieve_for_all", nodes.retrieve_for_all)
+    workflow.add_node("persona", write_note)
+    # the notes are only rated once every branch has returned one
+    workflow.add_node("collect_notes", lambda state: {})
+    workflow.add_node("rate_notes", nodes.rate_for_persona)
+    workflow.add_node("pick_winning_note", nodes.pick_winner_from_ratings)
+    workflow.add_edge(START, "retrieve_for_all")
+    workflow.add_conditional_edges("retrieve_for_all", nodes.send_personas,
+                                   ["persona"])
+    workflow.add_edge("persona", "collect_notes")
+    workflow.add_conditional_edges("collect_notes", nodes.send_raters,
+                                   ["rate_notes"])
+    workflow.add_edge("rate_notes", "pick_winning_note")
     workflow.add_edge("pick_winning_note", END)
+    return workflow.compile()
 
-    app = workflow.compile()
+if __name__ == '__main__':
+    # set global variables. USER_AGENT identifies the process to html requests.
+    os.environ["USER_AGENT"] = "FnordFiddler"
+    # local llm sets the local llm profile to call using ollama. Every node
+    # shares one pooled connection to the server.
+    llm_client.configure(max_concurrency=4)
+    llm = llm_client.shared_llm().bind(format="json")
+
+    # Read the index from the packed store built by node_store.py if there
+    # is one, otherwise from the JSON files in data/.
+    node_store = None
+    if os.path.exists("data/index.sqlite"):
+        node_store = NodeStore("data/index.sqlite")
+    # Relevance scores are kept across runs, so repeated questions and
+    # retrieving again after a web search do not re-score the same sources.
+    relevance_cache = RelevanceCache("data/relevance.sqlite")
+    # Summary vectors, from summary_vectors.py or written with the index,
+    # let retrieval skip children unrelated to the question.
+    summary_vectors = None
+    if os.path.exists("data/belegarth_vectors.npy"):
+        summary_vectors = SummaryVectors("data", "belegarth")
+    # A BM25 index of the leaves, from bm25_index.py or written with the
+    # index, seeds retrieval with keyword hits before the tree walk.
+    bm25 = None
+    if os.path.exists("data/belegarth_bm25.npz"):
+        bm25 = BM25Index("data", "belegarth")
+    # The personas, running in parallel, share one walk of the index that
+    # finds every persona's sources. A walk still running after 30 seconds
+    # returns the best sources found so far.
+    nodes = nodedef.RagNodes("data/belegarth_kg.json", llm,
+                             node_store=node_store, batch_relevance=True,
+                             relevance_cache=relevance_cache,
+                             summary_vectors=summary_vectors,
+                             bm25_index=bm25, multi_persona=True,
+                             max_seconds=30)
+
+    app = build_workflow(nodes, recursion_limit=20)
     inputs = {"original_claim": """
               In Belegarth, what is the most effective weapon set?
               """
               }
     config = RunnableConfig(recursion_limit=20)
-    for output in app.stream(inputs, config):
-        for key, value in output.items():
-            print(f"Finished running: {key}:")
-            print(f"With result: {value}:")
-    print(value["winning_note"])
+
+    # retrieve is async, so the graph runs on an event loop
+    async def run_graph():
+        async for output in app.astream(inputs, config):
+            for key, value in output.items():
+                print(f"Finished running: {key}:")
+                print(f"With result: {value}:")
+        return value
+
+    print(asyncio.run(run_graph())["winning_note"])
+    print("Relevance cache:", relevance_cache)
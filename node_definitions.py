@@ -6,51 +6,62 @@ Created on Mon Sep 23 15:19:48 2024
 @author: magfrump
 """
 
+import asyncio
+import operator
+import time
 from pprint import pprint
-from typing import List
+from typing import Annotated, List, Optional
 
+from langchain_core.exceptions import OutputParserException
 from langchain_core.output_parsers import JsonOutputParser
+from langgraph.types import Send
 from typing_extensions import TypedDict
+import numpy as np
 from prompt_definitions import PromptCreator
 from generate_personas import generate_personas
+from beam_search import BeamSearch, MAX_MEMORY_NODES
 import indexed_info_node as iin
+import llm_client
+from relevance_cache import RelevanceCache
 
-def scored_list_insert(scored_entry, ordered_list):
-    """
-    Adds a tuple of (entry, score) in descending order by score to an existing
-    ordered list of such tuples.
-
-    Parameters
-    ----------
-    scored_entry : A tuple of (entry, score)
-    ordered_list : A list of tuples (entry, score) sorted in descending order
-        of score.
-    """
+# Bump whenever the relevance prompts change so cached scores are not reused.
+RELEVANCE_PROMPT_VERSION = 1
 
-    if len(ordered_list)==0:
-        ordered_list.append(scored_entry)
-        return
-    index_score = ordered_list[0][0]
-    index = 0
-    while(index_score > scored_entry[0] and index < len(ordered_list)-1):
-        index += 1
-        index_score = ordered_list[index][0]
-    ordered_list.insert(index, scored_entry)
-    return
-    
 ### State
 
+class Attempt(TypedDict):
+    seconds: float
+    # None until grade_generation has graded the attempt
+    grounded: Optional[bool]
+    useful: Optional[bool]
+
 class Response(TypedDict):
     response_content: str
     response_sources: List[str]
-    response_ratings: List[float]
+    response_truncated: bool
+    response_attempts: List[Attempt]
 
 class GraphState(TypedDict):
     original_claim: str
     responses: List[Response]
     persona_index: int
-    winning_note: str
     new_sources: List[str]
+    pending_response: Response
+
+class Rating(TypedDict):
+    persona_index: int
+    scores: List[str]
+
+class FanOutState(TypedDict):
+    """
+    The state of a workflow running each persona in its own parallel branch.
+    The responses and ratings the branches return are concatenated.
+    """
+    original_claim: str
+    responses: Annotated[List[Response], operator.add]
+    ratings: Annotated[List[Rating], operator.add]
+    winning_note: str
+    persona_responses: List[Response]
 
 
 
@@ -79,12 +90,46 @@ class RagNodes():
             corresponding prompt texts
         _index_root (str): The root directory of the document index used for
             retrieval
+        _node_store (NodeStore): A packed store to read index nodes from, or
+            None to read each node from its own JSON file
+        _batch_relevance (bool): Whether retrieve scores all children of a
+            node with one LLM call instead of one call per child
+        _frontier_width (int): How many of the best unexplored nodes
+            aretrieve expands at once
+        _max_in_flight (int): The most LLM calls aretrieve, and
+            grade_documents, make at once
+        _beam_width (int): The most unexplored nodes retrieve keeps
+        _max_llm_calls (int): The most relevance calls retrieve makes, or
+            None for no limit
+        _max_depth (int): The deepest level of the index retrieve explores,
+            or None for no limit
+        _max_seconds (float): How long retrieval may search before returning
+            the best sources found so far, or None for no limit
+        _max_generations (int): The most notes each persona generates and
+            grades before its last note is kept as it is
+        last_search_report (SearchReport): What the last retrieve spent
+        _relevance_cache (RelevanceCache): Relevance scores already given by
+            the model, or None to score every text again
+        _summary_vectors (SummaryVectors): Vectors of the index's summaries,
+            used to send only the vector_top_k children of a node most
+            similar to the question to the LLM, or None to score them all
+        _bm25_index (BM25Index): A keyword index of the index's leaves,
+            whose bm25_seeds best hits for the question are scored before
+            the tree is walked, or None to only walk the tree
+        _bm25_enough (float): If a BM25 hit scores at least this, retrieval
+            skips the tree walk; None always walks it
+        _multi_persona (bool): Whether retrieve_for_all walks the index
+            once for every persona before the personas' branches start
 
     Methods:
         __init__(doc_index_root, llm): Initialize the RagNodes instance with
-            a document index and a language model
+            a document index and a language model, by default the pooled
+            llm_client.shared_llm() producing JSON
         retrieve(state): Retrieve relevant documents from the index based on
             the input state
+        aretrieve(state): Retrieve the same way, expanding several nodes at
+            once with concurrent LLM calls
+        retrieve_for_all(state): Retrieve for every persona with one walk
         generate(state): Generate text based on the input state using the RAG
             architecture
         grade_documents(state): Evaluate the quality and relevance of generated
@@ -95,19 +140,39 @@ class RagNodes():
             processing
         decide_to_generate(state): Decide whether to generate an answer or
             include web search results
-        grade_generation_v_documents_and_question(state): Evaluate the quality
-            and relevance of generated text compared to retrieved documents
-            and the original question
+        grade_generation(state): Grade whether generated text is grounded
+            in the retrieved documents and answers the original question
+        grade_generation_v_documents_and_question(state): Route on those
+            grades, within the persona's budget of generations
+        send_personas(state), send_raters(state): Fan a FanOutState out to
+            one branch per persona, each with the sources retrieve_for_all
+            found for it
+        rate_for_persona(state): Rate every note for one persona
+        pick_winner_from_ratings(state): Pick the best note from the ratings
+            of the parallel rating branches
 
     Note:
         This class is designed to be used in conjunction with a PromptCreator
             instance, which provides pre-defined prompts for each node.
     """
-    def __init__(self, doc_index_root, llm, num_personas = 2):
+    def __init__(self, doc_index_root, llm = None, num_personas = 2,
+                 node_store = None, batch_relevance = False,
+                 frontier_width = 4, max_in_flight = 4,
+                 beam_width = MAX_MEMORY_NODES, max_llm_calls = None,
+                 max_depth = None, relevance_cache = None,
+                 summary_vectors = None, vector_top_k = 3,
+                 bm25_index = None, bm25_seeds = 5, bm25_enough = 0.8,
+                 multi_persona = False, max_seconds = None,
+                 max_generations = 3):
+        if llm is None:
+            llm = llm_client.shared_llm().bind(format="json")
         ## Create prompts
         prompt_name_list = ["retrieval_grader", "rag_generate",
                           "hallucination_grader", "answer_grader",
-                          "text_relevance", "rate_note"]
+                          "text_relevance", "batch_relevance",
+                          "persona_relevance", "persona_batch_relevance",
+                          "generation_grader",
+                          "rate_note"]
         self._prompt_dict = {}
         prompt_creator = PromptCreator()
         for prompt_name in prompt_name_list:
@@ -115,13 +180,40 @@ class RagNodes():
             self._prompt_dict[prompt_name] = prompt_text | llm | \
                     JsonOutputParser()
         self._index_root = doc_index_root
+        self._node_store = node_store
+        self._batch_relevance = batch_relevance
+        self._frontier_width = frontier_width
+        self._max_in_flight = max_in_flight
+        self._beam_width = beam_width
+        self._max_llm_calls = max_llm_calls
+        self._max_depth = max_depth
+        self._max_seconds = max_seconds
+        self._max_generations = max_generations
+        self.last_search_report = None
+        self._relevance_cache = relevance_cache
+        self._summary_vectors = summary_vectors
+        self._vector_top_k = vector_top_k
+        self._bm25_index = bm25_index
+        self._bm25_seeds = bm25_seeds
+        self._bm25_enough = bm25_enough
+        self._multi_persona = multi_persona
+        self._model = getattr(llm, "model", type(llm).__name__)
         # Not yet implemented
         self._num_personas = num_personas
         self._persona_list = generate_personas(num_personas)
 
     def retrieve(self, state):
         """
-        Retrieve documents from vectorstore
+        Retrieve documents from vectorstore, by a beam search down the
+        index held to the configured beam width, LLM calls, time and depth.
+        What the search spent is kept in last_search_report. If the LLM call
+        or time budget runs out, the best sources found so far are returned
+        and the response is marked response_truncated. With a BM25 index,
+        its best hits seed the results, and the walk is skipped if one of
+        them scores at least bm25_enough.
+
+        If the state holds a pending_response, the sources retrieve_for_all
+        found for this persona, it is used instead of walking, once.
     
         Args:
             state (dict): The current graph state
@@ -134,56 +226,571 @@ class RagNodes():
         question = state["original_claim"]
         if "persona_index" not in state:
             state["persona_index"]=0
+        response = self._take_pending(state)
+        if response is not None:
+            state["responses"].append(response)
+            return state
         response = Response()
 
         # Retrieval
-        max_memory_nodes = 10
-        relevance_threshold = 0.1
-        nodes_to_explore = [(1,self._index_root)]
-        text_nodes = []
-        while nodes_to_explore:
-            current_node = \
-                iin.IndexedInfoNode.fromfilename(nodes_to_explore.pop(0)[1])
-            if current_node.get_type=='TEXT':
-                relevance = \
-                    self._prompt_dict["text_relevance"].invoke( \
-                        {"persona":self._persona_list[state["persona_index"]],
-                         "question":question, "text": current_node.get_text})
-                scored_list_insert((relevance["relevance"], current_node),
-                                   text_nodes)
-            else:
-                # print(current_node.get_text)
-                children = current_node.get_children()
-                scored_children = []
-                for child in children:
-                    relevance = \
-                        self._prompt_dict["text_relevance"].invoke( \
-                            {"persona":self._persona_list[state["persona_index"]],
-                             "question":question, "text": child.node_summary})
-                    #print(child.node_reference, " has relevance ", relevance)
-                    scored_list_insert( \
-                        (relevance["relevance"], child.node_reference), \
-                            scored_children)
-                if scored_children:
-                    scored_list_insert(scored_children.pop(0), \
-                                       nodes_to_explore)
-                    while(scored_children and scored_children[0][0] > \
-                          relevance_threshold):
-                        scored_list_insert(scored_children.pop(0), \
-                                           nodes_to_explore)
-            if len(nodes_to_explore) > max_memory_nodes:
-                nodes_to_explore = nodes_to_explore[:max_memory_nodes]
-            if len(text_nodes) > max_memory_nodes:
-                text_nodes = text_nodes[:max_memory_nodes]
+        persona = self._persona_list[state["persona_index"]]
+        search = BeamSearch(
+            self._load_node,
+            lambda children, max_calls: self._score_children(
+                children, persona, question, max_calls),
+            lambda text, max_calls: self._score_text(text, persona,
+                                                     question),
+            beam_width=self._beam_width, max_llm_calls=self._max_llm_calls,
+            max_depth=self._max_depth, children_cost=self._children_cost,
+            max_seconds=self._max_seconds)
+        text_nodes, self.last_search_report = search.search(
+            self._index_root, seeds=self._keyword_seeds(question),
+            enough=self._bm25_enough)
+        print("---SEARCH:", self.last_search_report, "---")
         response["response_sources"] = [_[1].get_text for _ in text_nodes]
+        response["response_truncated"] = self.last_search_report.truncated
         #print(len(documents))
         #for d in documents:
         #    print(d, "\n\n")
+        state["responses"].append(response)
+        return state
+
+    def retrieve_for_all(self, state):
+        """
+        In multi-persona mode, walks the index once for every persona
+        before their branches start, scoring each text for all of them with
+        one persona_relevance call. With batch relevance on, all children of
+        a node are scored for all of them with one persona_batch_relevance
+        call. send_personas then sends each branch its own sources.
+
+        Args:
+            state (dict): The current FanOutState
+
+        Returns:
+            dict: An update with each persona's Response, in order, in
+                persona_responses, or no update outside multi-persona mode
+        """
+        if not self._multi_persona:
+            return {}
+        print("---RETRIEVE FOR ALL PERSONAS---")
+        question = state["original_claim"]
+        search = BeamSearch(
+            self._load_node,
+            lambda children, max_calls: self._score_children_for_all(
+                children, question, max_calls),
+            lambda text, max_calls: self._score_for_all(text, question,
+                                                        max_calls),
+            beam_width=self._beam_width, max_llm_calls=self._max_llm_calls,
+            max_depth=self._max_depth,
+            children_cost=self._multi_children_cost,
+            personas=len(self._persona_list), max_seconds=self._max_seconds)
+        per_persona, self.last_search_report = search.search(
+            self._index_root, seeds=self._keyword_seeds(question),
+            enough=self._bm25_enough)
+        print("---SEARCH:", self.last_search_report, "---")
+        truncated = self.last_search_report.truncated
+        return {"persona_responses": [
+            Response(response_sources=[node.get_text for _, node in
+                                       text_nodes],
+                     response_truncated=truncated)
+            for text_nodes in per_persona]}
+
+    @staticmethod
+    def _take_pending(state):
+        """
+        Takes the pending_response out of the state, adding the list of
+        responses to the state if there is none.
+
+        Returns:
+            Response: The pending response, or None.
+        """
         if "responses" not in state:
             state["responses"] = []
+        response = state.get("pending_response")
+        state["pending_response"] = None
+        if response is not None:
+            print("---RETRIEVE: sources found for every persona---")
+        return response
+
+    def _keyword_seeds(self, question):
+        """
+        Returns:
+            list: The references of the leaves BM25 ranks best for the
+                question, or none without a BM25 index.
+        """
+        if self._bm25_index is None:
+            return []
+        return [reference for _, reference in
+                self._bm25_index.search(question, self._bm25_seeds)]
+
+    def _score_children(self, children, persona, question, max_calls=None):
+        """
+        Scores how relevant each child's summary is to the question. Only
+        the candidates picked by _vector_candidates are scored by the LLM;
+        the rest are given 0.
+
+        Args:
+            max_calls (int): The most LLM calls to make, or None for no
+                limit.
+
+        Returns:
+            tuple: The relevance of each child, in order, and the number of
+                LLM calls made.
+        """
+        candidates = self._vector_candidates(children, question)
+        scores = [0.0] * len(children)
+        candidate_scores, calls = self._score_summaries(
+            [children[i].node_summary for i in candidates], persona,
+            question, max_calls)
+        for i, score in zip(candidates, candidate_scores):
+            scores[i] = score
+        return scores, calls
+
+    def _score_children_for_all(self, children, question, max_calls=None):
+        """
+        Scores how relevant each child's summary is to the question for
+        every persona, like _score_children. With batch relevance on, the
+        uncached summaries are scored for every persona in one LLM call,
+        and each is scored by _score_for_all only if that call's output
+        cannot be used. Children left unscored once max_calls calls are made
+        are given 0 by every persona.
+
+        Returns:
+            tuple: A list of each persona's relevance for each child, in
+                order, and the number of LLM calls made.
+        """
+        candidates = self._vector_candidates(children, question)
+        scores = [[0.0] * len(self._persona_list) for _ in children]
+        summaries = [children[i].node_summary for i in candidates]
+        rows = [self._cached_for_all("persona_batch_relevance", question,
+                                     summary)
+                if self._batch_relevance else None
+                for summary in summaries]
+        calls = 0
+        missing = self._unscored(rows)
+        if self._batch_relevance and len(missing) > 1:
+            matrix = self._score_matrix([summaries[i] for i in missing],
+                                        question)
+            calls += 1
+            for i, row in zip(missing, matrix or []):
+                rows[i] = row
+                self._cache_for_all("persona_batch_relevance", question,
+                                    summaries[i], row)
+        for i in self._unscored(rows):
+            if max_calls is not None and calls >= max_calls:
+                break
+            rows[i], made = self._score_for_all(
+                summaries[i], question,
+                None if max_calls is None else max_calls - calls)
+            calls += made
+        for i, row in zip(candidates, rows):
+            if row is not None:
+                scores[i] = row
+        return scores, calls
+
+    def _score_for_all(self, text, question, max_calls=None):
+        """
+        Scores how relevant one text is to the question for every persona
+        with one persona_relevance call, unless the scores are cached. If
+        that call's output cannot be used, each persona scores the text with
+        its own text_relevance call.
+
+        Returns:
+            tuple: The relevance for each persona, in order, and the number
+                of LLM calls made.
+        """
+        scores = self._cached_for_all("persona_relevance", question, text)
+        if scores is not None:
+            return scores, 0
+        try:
+            result = self._prompt_dict["persona_relevance"].invoke(
+                {"count": len(self._persona_list),
+                 "personas": self._readers(), "question": question,
+                 "text": text})
+            joint = self._batch_scores(result, len(self._persona_list))
+        except OutputParserException:
+            joint = None
+        calls = 1
+        if joint is None:
+            joint = [None] * len(self._persona_list)
+            for i in self._within(self._unscored(joint), calls, max_calls):
+                joint[i], made = self._score_text(text,
+                                                  self._persona_list[i],
+                                                  question)
+                calls += made
+            joint = self._zero_unscored(joint)
+        self._cache_for_all("persona_relevance", question, text, joint)
+        return joint, calls
+
+    def _score_matrix(self, summaries, question):
+        """
+        Scores several summaries for every persona with one LLM call.
+
+        Returns:
+            list: For each summary, the relevance for each persona, or None
+                if the model's output was not a list of one such list per
+                summary.
+        """
+        try:
+            result = self._prompt_dict["persona_batch_relevance"].invoke(
+                {"count": len(self._persona_list),
+                 "personas": self._readers(), "question": question,
+                 "source_count": len(summaries),
+                 "sources": self._numbered(summaries)})
+        except OutputParserException:
+            return None
+        if isinstance(result, dict):
+            result = result.get("relevance")
+        if not isinstance(result, list) or len(result) != len(summaries):
+            return None
+        rows = [self._batch_scores(row, len(self._persona_list))
+                for row in result]
+        return None if None in rows else rows
+
+    def _readers(self):
+        return "\n".join(f"Reader {i+1}: {persona}"
+                         for i, persona in enumerate(self._persona_list))
+
+    def _cached_for_all(self, prompt_name, question, text):
+        """
+        Returns:
+            list: The cached relevance of a text for each persona, or None
+                unless every persona's is cached.
+        """
+        scores = [self._cached_score(prompt_name, persona, question, text)
+                  for persona in self._persona_list]
+        return None if None in scores else scores
+
+    def _cache_for_all(self, prompt_name, question, text, scores):
+        for persona, score in zip(self._persona_list, scores):
+            self._cache_score(prompt_name, persona, question, text, score)
+
+    def _vector_candidates(self, children, question):
+        """
+        Picks the children worth scoring with the LLM: the vector_top_k
+        whose summary vectors are most similar to the question, all found
+        with one vectorized cosine product, and any without a stored
+        vector. Without summary vectors every child is a candidate.
+
+        Returns:
+            list: The indices of the candidates, in order.
+        """
+        if self._summary_vectors is None or \
+                len(children) <= self._vector_top_k:
+            return list(range(len(children)))
+        similarities = self._summary_vectors.similarities(
+            question, [child.node_reference for child in children])
+        unknown = np.isnan(similarities)
+        ranked = np.argsort(-np.where(unknown, -np.inf, similarities),
+                            kind="stable")
+        top = [int(i) for i in ranked if not unknown[i]]
+        return sorted(set(top[:self._vector_top_k]) |
+                      {int(i) for i in np.flatnonzero(unknown)})
+
+    def _score_summaries(self, summaries, persona, question,
+                         max_calls=None):
+        """
+        Scores how relevant several summaries are to the question, using
+        cached scores where there are any. With batch relevance on, the
+        uncached ones are scored in one LLM call, and each is scored by its
+        own call only if that call's output cannot be used. Summaries left
+        unscored once max_calls calls are made are given 0.
+
+        Returns:
+            tuple: The relevance of each summary, in order, and the number
+                of LLM calls made.
+        """
+        calls = 0
+        scores, batched = self._batch_plan(summaries, persona, question)
+        if batched:
+            batch = self._score_batch([summaries[i] for i in batched],
+                                      persona, question)
+            calls += 1
+            self._apply_batch(summaries, persona, question, scores, batched,
+                              batch)
+        missing = self._unscored(scores)
+        for i in self._within(missing, calls, max_calls):
+            scores[i], made = self._score_text(summaries[i], persona,
+                                               question)
+            calls += made
+        return self._zero_unscored(scores), calls
+
+    def _batch_plan(self, summaries, persona, question):
+        """
+        Looks up the batch scores of several summaries in the cache.
+
+        Returns:
+            tuple: The cached score of each summary, or None, and the
+                indices of the summaries to score with one batch call,
+                which are none unless batch relevance is on and more than
+                one summary is missing.
+        """
+        scores = [None] * len(summaries)
+        if not self._batch_relevance or len(summaries) < 2:
+            return scores, []
+        scores = [self._cached_score("batch_relevance", persona, question,
+                                     summary)
+                  for summary in summaries]
+        missing = self._unscored(scores)
+        return scores, missing if len(missing) > 1 else []
+
+    def _apply_batch(self, summaries, persona, question, scores, batched,
+                     batch):
+        """
+        Fills in and caches the scores from a batch call, unless its output
+        could not be used.
+        """
+        if batch is None:
+            return
+        for i, score in zip(batched, batch):
+            scores[i] = score
+            self._cache_score("batch_relevance", persona, question,
+                              summaries[i], score)
+
+    @staticmethod
+    def _unscored(scores):
+        return [i for i, score in enumerate(scores) if score is None]
+
+    @staticmethod
+    def _within(missing, calls, max_calls):
+        """
+        The missing scores that can each get their own call when calls
+        have been made, keeping to max_calls.
+        """
+        if max_calls is None:
+            return missing
+        return missing[:max(max_calls - calls, 0)]
+
+    @staticmethod
+    def _zero_unscored(scores):
+        return [0.0 if score is None else score for score in scores]
+
+    def _score_text(self, text, persona, question):
+        """
+        Scores how relevant one text is to the question with the
+        text_relevance prompt, unless the score is cached.
+
+        Returns:
+            tuple: The relevance and the number of LLM calls made.
+        """
+        score = self._cached_score("text_relevance", persona, question, text)
+        if score is not None:
+            return score, 0
+        result = self._prompt_dict["text_relevance"].invoke(
+            {"persona": persona, "question": question, "text": text})
+        return self._keep_text_score(text, persona, question, result), 1
+
+    def _keep_text_score(self, text, persona, question, result):
+        """
+        Reads and caches the score from the output of the text_relevance
+        prompt.
+        """
+        score = result["relevance"]
+        self._cache_score("text_relevance", persona, question, text, score)
+        return score
+
+    def _cache_key(self, prompt_name, persona, question, text):
+        return RelevanceCache.make_key(
+            persona, question, text, self._model,
+            f"{prompt_name}@{RELEVANCE_PROMPT_VERSION}")
+
+    def _cached_score(self, prompt_name, persona, question, text):
+        """
+        Returns:
+            float: The cached relevance of a text, or None.
+        """
+        if self._relevance_cache is None:
+            return None
+        return self._relevance_cache.get(
+            self._cache_key(prompt_name, persona, question, text))
+
+    def _cache_score(self, prompt_name, persona, question, text, score):
+        if self._relevance_cache is not None:
+            self._relevance_cache.put(
+                self._cache_key(prompt_name, persona, question, text), score)
+
+    def _children_cost(self, num_children):
+        """
+        The LLM calls _score_children is expected to make.
+        """
+        if self._summary_vectors is not None:
+            num_children = min(num_children, self._vector_top_k)
+        if self._batch_relevance and num_children > 1:
+            return 1
+        return num_children
+
+    def _multi_children_cost(self, num_children):
+        """
+        The LLM calls _score_children_for_all is expected to make, the same
+        as _score_children.
+        """
+        return self._children_cost(num_children)
+
+    def _score_batch(self, summaries, persona, question):
+        """
+        Scores several summaries with one LLM call.
+
+        Returns:
+            list: The relevance of each summary, or None if the model's
+                output was not a list of one number per summary.
+        """
+        try:
+            result = self._prompt_dict["batch_relevance"].invoke(
+                self._batch_input(summaries, persona, question))
+        except OutputParserException:
+            return None
+        return self._batch_scores(result, len(summaries))
+
+    async def _ascore_batch(self, summaries, persona, question, slots):
+        """
+        Scores several summaries with one LLM call like _score_batch,
+        waiting for a free slot.
+        """
+        try:
+            async with slots:
+                result = await self._prompt_dict["batch_relevance"].ainvoke(
+                    self._batch_input(summaries, persona, question))
+        except OutputParserException:
+            return None
+        return self._batch_scores(result, len(summaries))
+
+    @staticmethod
+    def _batch_input(summaries, persona, question):
+        return {"persona": persona, "question": question,
+                "count": len(summaries),
+                "sources": RagNodes._numbered(summaries)}
+
+    @staticmethod
+    def _numbered(summaries):
+        return "\n".join(f"Source {i+1}: {summary}"
+                         for i, summary in enumerate(summaries))
+
+    @staticmethod
+    def _batch_scores(result, count):
+        """
+        Reads the scores from the output of the batch_relevance prompt, or
+        returns None if they are not a list of count numbers.
+        """
+        if isinstance(result, dict):
+            result = result.get("relevance")
+        if not isinstance(result, list) or len(result) != count:
+            return None
+        try:
+            return [float(score) for score in result]
+        except (TypeError, ValueError):
+            return None
+
+    async def aretrieve(self, state):
+        """
+        Retrieve documents from the index like retrieve, with the same beam
+        search, budgets and BM25 seeds, but score the best frontier_width
+        unexplored nodes at once, with concurrent LLM calls, at most
+        max_in_flight at a time. The time taken grows with the depth of the
+        tree rather than with the number of nodes visited.
+
+        A pending_response is used instead of walking, once, as in retrieve.
+
+        With max_seconds set, the LLM calls still running at the deadline
+        are cancelled, and the best sources found so far are returned with
+        the response marked response_truncated.
+
+        Args:
+            state (dict): The current graph state
+
+        Returns:
+            state (dict): New key added to state, documents, that contains
+                retrieved documents
+        """
+        print("---RETRIEVE---")
+        question = state["original_claim"]
+        if "persona_index" not in state:
+            state["persona_index"]=0
+        response = self._take_pending(state)
+        if response is not None:
+            state["responses"].append(response)
+            return state
+        persona = self._persona_list[state["persona_index"]]
+        slots = asyncio.Semaphore(self._max_in_flight)
+        response = Response()
+
+        search = BeamSearch(
+            self._load_node,
+            lambda children, max_calls: self._ascore_children(
+                children, persona, question, slots, max_calls),
+            lambda text, max_calls: self._ascore_text(text, persona,
+                                                      question, slots),
+            beam_width=self._beam_width, max_llm_calls=self._max_llm_calls,
+            max_depth=self._max_depth, children_cost=self._children_cost,
+            max_seconds=self._max_seconds)
+        text_nodes, self.last_search_report = await search.asearch(
+            self._index_root, seeds=self._keyword_seeds(question),
+            enough=self._bm25_enough, width=self._frontier_width)
+        print("---SEARCH:", self.last_search_report, "---")
+        response["response_sources"] = [_[1].get_text for _ in text_nodes]
+        response["response_truncated"] = self.last_search_report.truncated
         state["responses"].append(response)
         return state
 
+    async def _ascore_children(self, children, persona, question, slots,
+                               max_calls=None):
+        """
+        Scores each child's summary like _score_children, with concurrent
+        LLM calls.
+        """
+        candidates = self._vector_candidates(children, question)
+        scores = [0.0] * len(children)
+        candidate_scores, calls = await self._ascore_summaries(
+            [children[i].node_summary for i in candidates], persona,
+            question, slots, max_calls)
+        for i, score in zip(candidates, candidate_scores):
+            scores[i] = score
+        return scores, calls
+
+    async def _ascore_summaries(self, summaries, persona, question, slots,
+                                max_calls=None):
+        """
+        Scores several summaries like _score_summaries, with concurrent LLM
+        calls.
+        """
+        calls = 0
+        scores, batched = self._batch_plan(summaries, persona, question)
+        if batched:
+            batch = await self._ascore_batch(
+                [summaries[i] for i in batched], persona, question, slots)
+            calls += 1
+            self._apply_batch(summaries, persona, question, scores, batched,
+                              batch)
+        missing = self._within(self._unscored(scores), calls, max_calls)
+        missed = await asyncio.gather(
+            *(self._ascore_text(summaries[i], persona, question, slots)
+              for i in missing))
+        for i, (score, made) in zip(missing, missed):
+            scores[i] = score
+            calls += made
+        return self._zero_unscored(scores), calls
+
+    async def _ascore_text(self, text, persona, question, slots):
+        """
+        Scores one text like _score_text, waiting for a free slot.
+        """
+        score = self._cached_score("text_relevance", persona, question, text)
+        if score is not None:
+            return score, 0
+        async with slots:
+            result = await self._prompt_dict["text_relevance"].ainvoke(
+                {"persona": persona, "question": question, "text": text})
+        return self._keep_text_score(text, persona, question, result), 1
+
+    def _load_node(self, reference):
+        """
+        Reads an index node from the node store, if there is one, or else
+        from its JSON file. A stored node's text is only read if it is
+        used.
+        """
+        if self._node_store is not None:
+            return self._node_store.get_lazy(reference)
+        return iin.IndexedInfoNode.fromfilename(reference)
+
     def generate(self, state):
         """
         Generate answer using RAG on retrieved documents
@@ -193,24 +800,32 @@ class RagNodes():
     
         Returns:
             state (dict): New key added to state, generation, that contains
-                LLM generation
+                LLM generation, and a new attempt recording how long it took
         """
         print("---GENERATE---")
         question = state["original_claim"]
-        response = state["responses"][state["persona_index"]]
+        response = state["responses"][-1]
         documents = response["response_sources"]
+        started = time.monotonic()
         # RAG generation
         response["response_content"] = \
             self._prompt_dict["rag_generate"].invoke({"persona":self._persona_list[state["persona_index"]],
                                                       "context": documents,
                                                       "question": question})
         #print(generation)
+        response.setdefault("response_attempts", []).append(
+            Attempt(seconds=time.monotonic() - started, grounded=None,
+                    useful=None))
         return state
 
     def grade_documents(self, state):
         """
         Determines whether the retrieved documents are relevant to the question
         If any document is not relevant, we will set a flag to run web search
+
+        Each document is graded by its own retrieval_grader call, so every
+        grade is the one a call made on its own would give, but the calls
+        run concurrently, at most max_in_flight at a time.
     
         Args:
             state (dict): The current graph state
@@ -222,16 +837,17 @@ class RagNodes():
 
         print("---CHECK DOCUMENT RELEVANCE TO QUESTION---")
         question = state["original_claim"]
-        response = state["responses"][state["persona_index"]]
+        response = state["responses"][-1]
         documents = response["response_sources"]
 
         # Score each doc
+        persona = self._persona_list[state["persona_index"]]
+        scores = self._prompt_dict["retrieval_grader"].batch(
+            [{"persona": persona, "question": question, "document": d}
+             for d in documents],
+            config={"max_concurrency": self._max_in_flight})
         filtered_docs = []
-        for d in documents:
-            score = self._prompt_dict["retrieval_grader"].invoke(
-                {"persona":self._persona_list[state["persona_index"]],
-                 "question": question, "document": d}
-            )
+        for d, score in zip(documents, scores):
             #summary = score["relevant_text"]
             #print(score)
             grade = score["score"]
@@ -249,6 +865,60 @@ class RagNodes():
         response["response_sources"] = filtered_docs
         return state
 
+    def grade_generation(self, state):
+        """
+        Grades whether the generation is grounded in the documents and
+            answers the question, with one generation_grader call giving
+            both verdicts. If its output lacks either verdict, the
+            hallucination_grader and answer_grader prompts are used instead.
+            Without documents, any answer counts as grounded.
+
+        Args:
+            state (dict): The current graph state
+
+        Returns:
+            state (dict): The grades, and the time grading took, added to
+                the latest attempt
+        """
+        print("---CHECK HALLUCINATIONS AND ANSWER---")
+        question = state["original_claim"]
+        persona = self._persona_list[state["persona_index"]]
+        response = state["responses"][-1]
+        documents = response["response_sources"]
+        generation = response["response_content"]
+        started = time.monotonic()
+
+        grades = {}
+        if len(documents)!=0:
+            try:
+                grades = self._prompt_dict["generation_grader"].invoke(
+                    {"persona": persona, "documents": documents,
+                     "generation": generation, "question": question})
+            except OutputParserException:
+                grades = {}
+            if not isinstance(grades, dict):
+                grades = {}
+        else:
+            # if no relevant documents could be found, allow giving an opinion
+            grades = {"grounded": "yes"}
+        if grades.get("grounded") not in ("yes", "no"):
+            grades["grounded"] = self._prompt_dict["hallucination_grader"] \
+                .invoke({"persona": persona, "documents": documents,
+                         "generation": generation})["score"]
+        if grades["grounded"] == "yes" and \
+                grades.get("useful") not in ("yes", "no"):
+            grades["useful"] = self._prompt_dict["answer_grader"].invoke(
+                {"persona": persona, "question": question,
+                 "generation": generation})["score"]
+
+        attempts = response.setdefault("response_attempts", [])
+        if not attempts:
+            attempts.append(Attempt(seconds=0.0, grounded=None, useful=None))
+        attempts[-1]["seconds"] += time.monotonic() - started
+        attempts[-1]["grounded"] = grades["grounded"] == "yes"
+        attempts[-1]["useful"] = grades.get("useful") == "yes"
+        return state
+
     def web_search(self, state):
         """
         Web search based based on the question
@@ -295,84 +965,84 @@ class RagNodes():
         #                 (we want to retrieve only relevant subsections)
         return state
 
-    def next_note(self, state):
+    ### Fan-out workflow
+    def send_personas(self, state):
         """
-        Increment the persona index to generate using the next persona.
+        Starts a branch for each persona, each with its own list of
+        responses, so the personas retrieve and generate in parallel. A
+        branch is sent the Response retrieve_for_all found for its persona,
+        if any, as its pending_response.
 
         Args:
-            state (dict): The current graph state
+            state (dict): The current FanOutState
 
         Returns:
-            state (dict): The current graph state with persona_index incremented or reset
+            list: A Send to the "persona" node for each persona
         """
-        state["persona_index"] = (state["persona_index"]+1)%self._num_personas
-        return state
+        pending = state.get("persona_responses") or \
+            [None] * self._num_personas
+        return [Send("persona", {"original_claim": state["original_claim"],
+                                 "persona_index": index, "responses": [],
+                                 "pending_response": pending[index]})
+                for index in range(self._num_personas)]
 
-    def rate_notes(self, state):
+    def send_raters(self, state):
         """
-        Uses the current persona to add a rating to each note
+        Starts a branch for each persona to rate every note.
 
         Args:
-            state (dict): The current graph state
+            state (dict): The current FanOutState
 
         Returns:
-            state (dict): The current graph state with a new rating on each note
+            list: A Send to the "rate_notes" node for each persona
         """
-        print("---RATING NOTES---")
-        for note in state["responses"]:
-            if "response_ratings" not in note:
-                note["response_ratings"] = []
-            rating = \
-                self._prompt_dict["rate_note"].invoke({"persona":self._persona_list[state["persona_index"]],
-                                                       "question": state["original_claim"],
-                                                       #"references": note["response_sources"],
-                                                       "generation": note["response_content"]})
-            note["response_ratings"].append(rating["score"])
-        state["persona_index"] = (state["persona_index"]+1)%self._num_personas
-        return state
+        return [Send("rate_notes", {"original_claim": state["original_claim"],
+                                    "persona_index": index,
+                                    "responses": state["responses"]})
+                for index in range(self._num_personas)]
 
-    def pick_winner(self, state):
+    def rate_for_persona(self, state):
         """
-        Assesses the ratings of each note across personas to pick the best note
+        Uses one persona to rate each note, with concurrent calls, at most
+        max_in_flight at a time.
 
         Args:
-            state (dict): The current graph state
+            state (dict): A rate_notes branch's state, from send_raters
 
         Returns:
-            state (dict): The content of the winning note filled in
+            dict: An update adding the persona's Rating to ratings
         """
-        winning_note = ""
-        best_score = 0
-        for response in state["responses"]:
-            score = 0
-            for rating in response["response_ratings"]:
-                if rating=="yes":
-                    score+=1
-            if score > best_score:
-                best_score = score
-                winning_note = response["response_content"]
-        state["winning_note"] = winning_note
-        return state
+        print("---RATING NOTES---")
+        persona = self._persona_list[state["persona_index"]]
+        ratings = self._prompt_dict["rate_note"].batch(
+            [{"persona": persona, "question": state["original_claim"],
+              "generation": note["response_content"]}
+             for note in state["responses"]],
+            config={"max_concurrency": self._max_in_flight})
+        return {"ratings": [Rating(persona_index=state["persona_index"],
+                                   scores=[rating["score"]
+                                           for rating in ratings])]}
 
-    ### Conditional edge
-    def increment_persona_or_move_on(self, state):
+    def pick_winner_from_ratings(self, state):
         """
-        Checks whether more personas remain to generate for.
+        Assesses the ratings of each note across personas, returned by the
+        rating branches, to pick the best note.
 
         Args:
-            state (dict): The current graph state
+            state (dict): The current FanOutState
 
         Returns:
-            str: Whether to move on or not
+            dict: An update with the content of the winning note
         """
-        if len(state["responses"]) < self._num_personas:
-            return "increment_persona"
-        if "response_ratings" not in state["responses"][0]:
-            return "move_on"
-        num_ratings = len(state["responses"][0]["response_ratings"])
-        if 0 < num_ratings < self._num_personas:
-            return "increment_persona"
-        return "move_on"
+        winning_note = ""
+        best_score = 0
+        for index, response in enumerate(state["responses"]):
+            score = sum(rating["scores"][index]=="yes"
+                        for rating in state["ratings"])
+            if score > best_score:
+                best_score = score
+                winning_note = response["response_content"]
+        return {"winning_note": winning_note}
 
     ### Conditional edge
     def decide_to_generate(self, state):
@@ -405,7 +1075,12 @@ class RagNodes():
     def grade_generation_v_documents_and_question(self, state):
         """
         Determines whether the generation is grounded in the document and
-            answers question.
+            answers question, from the grades grade_generation gave the
+            latest attempt. A persona that has already made max_generations
+            attempts stops with its latest note, whatever its grades. The
+            attempts of every note in the state count, including notes
+            retrieved again after a web search, so the state should be a
+            persona's branch, holding only that persona's notes.
     
         Args:
             state (dict): The current graph state
@@ -413,37 +1088,18 @@ class RagNodes():
         Returns:
             str: Decision for next node to call
         """
-
-        print("---CHECK HALLUCINATIONS---")
-        question = state["original_claim"]
-        response = state["responses"][state["persona_index"]]
-        documents = response["response_sources"]
-        generation = response["response_content"]
-
-        if len(documents)!=0:
-            score = self._prompt_dict["hallucination_grader"].invoke(
-                {"persona":self._persona_list[state["persona_index"]],
-                "documents": documents, "generation": generation}
-            )
-            grade = score["score"]
-        else:
-            # if no relevant documents could be found, allow giving an opinion
-            grade = "yes"
-
-        # Check hallucination
-        if grade == "yes":
-            print("---DECISION: GENERATION IS GROUNDED IN DOCUMENTS---")
-            # Check question-answering
-            print("---GRADE GENERATION vs QUESTION---")
-            score = \
-                self._prompt_dict["answer_grader"].invoke( \
-                                                    {"persona":self._persona_list[state["persona_index"]],
-                                                     "question": question,
-                                                     "generation": generation})
-            grade = score["score"]
-            if grade == "yes":
-                print("---DECISION: GENERATION ADDRESSES QUESTION---")
-                return "useful"
+        attempt = state["responses"][-1]["response_attempts"][-1]
+        made = sum(len(response.get("response_attempts", []))
+                   for response in state["responses"])
+        if attempt["grounded"] and attempt["useful"]:
+            print("---DECISION: GENERATION IS GROUNDED AND ADDRESSES "
+                  "QUESTION---")
+            return "useful"
+        if made >= self._max_generations:
+            print(f"---DECISION: NO USEFUL GENERATION IN {made} ATTEMPTS, "
+                  "KEEPING THE LAST---")
+            return "exhausted"
+        if attempt["grounded"]:
             print("---DECISION: GENERATION DOES NOT ADDRESS QUESTION---")
             return "not useful"
         pprint("---DECISION: GENERATION IS NOT GROUNDED IN DOCUMENTS, RE-TRY---")
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 15:10:00 2026
+
+@author: magfrump
+
+Names the nodes of a written knowledge graph. The root of a graph is named
+by its prefix and every other node gets the next free name prefix_N, so
+names never collide however many children a node has.
+
+Each graph keeps a manifest, prefix_manifest.json, mapping the path of
+every node in the tree (the child indices leading to it from the root,
+joined by "/", e.g. "0/12") to its name. Rewriting or refreshing the graph
+reuses the name at each path, so unchanged nodes keep their files. The
+manifest also records the layout of the tree: "tree" for graphs written
+by a KnowledgeGraph and "streaming" for graphs written by a
+StreamingGraphBuilder, which group their nodes differently.
+
+Classes:
+    NodeIdAllocator: Hands out node names for one graph and records its
+        manifest.
+"""
+
+import json
+import os
+
+class NodeIdAllocator:
+    """
+    Hands out the names of the nodes of one graph.
+
+    Attributes:
+        prefix (str): The name of the root node.
+        paths (dict): The name given to each tree path during this build,
+            keyed by path string.
+        layout (str): How the graph's tree was built, "tree" or
+            "streaming".
+    """
+    def __init__(self, prefix, known_paths=None, next_id=0, layout="tree"):
+        """
+        Args:
+            prefix (str): The name of the root node.
+            known_paths (dict): Names given to tree paths by an earlier
+                build, which are reused for the same paths.
+            next_id (int): The number of the next free name.
+            layout (str): How the graph's tree is built.
+        """
+        self.prefix = prefix
+        self.layout = layout
+        self.paths = {}
+        self._known_paths = dict(known_paths or {})
+        self._next_id = next_id
+
+    @staticmethod
+    def manifest_filename(directory, prefix):
+        """
+        Returns:
+            str: The manifest file of the graph named prefix.
+        """
+        return directory+"/"+prefix+"_manifest.json"
+
+    @classmethod
+    def load(cls, directory, prefix):
+        """
+        Creates an allocator that reuses the names in a graph's manifest, if
+        it has one.
+
+        Args:
+            directory (str): The directory the graph is written to.
+            prefix (str): The name of the root node.
+
+        Returns:
+            NodeIdAllocator: The allocator.
+        """
+        filename = cls.manifest_filename(directory, prefix)
+        if not os.path.exists(filename):
+            return cls(prefix)
+        with open(filename, encoding='utf-8') as f:
+            manifest = json.load(f)
+        return cls(prefix, manifest["paths"], manifest["next_id"],
+                   manifest.get("layout", "tree"))
+
+    def allocate(self):
+        """
+        Returns:
+            str: A name not given to any other node of the graph.
+        """
+        node_id = self.prefix+"_"+str(self._next_id)
+        self._next_id += 1
+        return node_id
+
+    def node_id(self, path):
+        """
+        Names the node at a tree path, reusing the name from the manifest
+        if the path had one.
+
+        Args:
+            path (tuple): The child indices leading from the root to the
+                node; the root's path is ().
+
+        Returns:
+            str: The node's name.
+        """
+        key = "/".join(str(i) for i in path)
+        if key not in self.paths:
+            if not path:
+                self.paths[key] = self.prefix
+            elif key in self._known_paths:
+                self.paths[key] = self._known_paths[key]
+            else:
+                self.paths[key] = self.allocate()
+        return self.paths[key]
+
+    def assign(self, path, node_id):
+        """
+        Records the name of a node named with allocate.
+        """
+        self.paths["/".join(str(i) for i in path)] = node_id
+
+    def keep(self, path):
+        """
+        Keeps the manifest's names for an unchanged subtree that is not
+        being rewritten.
+
+        Args:
+            path (tuple): The tree path of the subtree's root.
+        """
+        key = "/".join(str(i) for i in path)
+        for known, node_id in self._known_paths.items():
+            if known == key or known.startswith(key+"/"):
+                self.paths[known] = node_id
+
+    def write(self, directory):
+        """
+        Writes the manifest of the names given during this build. Paths of
+        an earlier build that are no longer in the graph are dropped, but
+        their names are not handed out again.
+        """
+        with open(self.manifest_filename(directory, self.prefix), 'w',
+                  encoding='utf-8') as f:
+            json.dump({"prefix": self.prefix, "next_id": self._next_id,
+                       "layout": self.layout, "paths": self.paths}, f)
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 14:20:00 2026
+
+@author: magfrump
+
+Packs every node of a document index into a single sqlite file, so that
+reading a node is one indexed lookup instead of opening one small JSON file
+per node.
+
+Nodes are stored under the same references their parents use for them
+(e.g. "data/belegarth0_kg.json"), so an index converted from a directory of
+JSON files is navigated exactly as before. A node's text is kept in its own
+column, so get_lazy can hand back a node without reading its text.
+
+Classes:
+    NodeStore: A single-file store of IndexedInfoNodes keyed by reference.
+
+Run as a script to convert a directory:
+    python node_store.py data data/index.sqlite
+"""
+
+import json
+import os
+import sqlite3
+import sys
+import threading
+import indexed_info_node as iin
+
+class NodeStore:
+    """
+    A single-file store of IndexedInfoNodes keyed by node reference.
+
+    Attributes:
+        path (str): The sqlite file backing the store.
+    """
+    def __init__(self, path):
+        """
+        Opens (or creates) a node store.
+
+        Args:
+            path (str): The sqlite file backing the store.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS nodes (
+                                reference TEXT PRIMARY KEY,
+                                node TEXT NOT NULL,
+                                text TEXT)""")
+        columns = [row[1] for row in
+                   self._conn.execute("PRAGMA table_info(nodes)")]
+        if "text" not in columns:
+            # stores written before text had its own column keep it inline
+            self._conn.execute("ALTER TABLE nodes ADD COLUMN text TEXT")
+        self._conn.commit()
+
+    def get(self, reference):
+        """
+        Looks up a node by reference.
+
+        Args:
+            reference (str): The node's reference.
+
+        Returns:
+            IndexedInfoNode: The stored node.
+
+        Raises:
+            KeyError: If no node is stored under the reference.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT node, text FROM nodes WHERE reference = ?",
+                (reference,)).fetchone()
+        if row is None:
+            raise KeyError(f"Node '{reference}' not found")
+        as_json = json.loads(row[0])
+        if row[1] is not None:
+            as_json["text"] = row[1]
+        return iin.IndexedInfoNode.fromjson(as_json)
+
+    def get_lazy(self, reference):
+        """
+        Looks up a node by reference, leaving its text in the store until
+        the node's get_text is first used.
+
+        Args:
+            reference (str): The node's reference.
+
+        Returns:
+            LazyIndexedInfoNode: The stored node.
+
+        Raises:
+            KeyError: If no node is stored under the reference.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT node FROM nodes WHERE reference = ?",
+                (reference,)).fetchone()
+        if row is None:
+            raise KeyError(f"Node '{reference}' not found")
+        as_json = json.loads(row[0])
+        if "text" in as_json:
+            return iin.LazyIndexedInfoNode.fromjson(as_json)
+        as_json["text"] = None
+        return iin.LazyIndexedInfoNode.fromjson(
+            as_json, load_text=lambda: self._get_text(reference))
+
+    def _get_text(self, reference):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT text FROM nodes WHERE reference = ?",
+                (reference,)).fetchone()[0]
+
+    def put(self, reference, node):
+        """
+        Stores a node, replacing any node stored under the same reference.
+
+        Args:
+            reference (str): The node's reference.
+            node (IndexedInfoNode): The node to store.
+        """
+        self.put_many([(reference, node)])
+
+    def put_many(self, items):
+        """
+        Stores many nodes in one transaction.
+
+        Args:
+            items: An iterable of (reference, IndexedInfoNode) pairs.
+        """
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO nodes VALUES (?, ?, ?)",
+                (self._row(reference, node) for reference, node in items))
+            self._conn.commit()
+
+    @staticmethod
+    def _row(reference, node):
+        as_json = node.to_json()
+        text = as_json.pop("text")
+        return reference, json.dumps(as_json), text
+
+    def import_json_dir(self, directory):
+        """
+        Copies every *_kg.json node file in a directory into the store, under
+        the reference write_doc_to_dir gives it (directory+"/"+filename).
+
+        Args:
+            directory (str): The directory of node files.
+
+        Returns:
+            int: The number of nodes imported.
+        """
+        names = sorted(name for name in os.listdir(directory)
+                       if name.endswith("_kg.json"))
+        self.put_many((directory+"/"+name,
+                       iin.IndexedInfoNode.fromfilename(
+                           os.path.join(directory, name)))
+                      for name in names)
+        return len(names)
+
+    def __contains__(self, reference):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM nodes WHERE reference = ?",
+                (reference,)).fetchone() is not None
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM nodes").fetchone()[0]
+
+    def close(self):
+        """
+        Closes the underlying sqlite connection.
+        """
+        self._conn.close()
+
+if __name__ == '__main__':
+    source_dir = sys.argv[1] if len(sys.argv) > 1 else "data"
+    store_path = sys.argv[2] if len(sys.argv) > 2 else \
+        source_dir+"/index.sqlite"
+    store = NodeStore(store_path)
+    print("Imported", store.import_json_dir(source_dir), "nodes into",
+          store_path)
+    store.close()
@@ -108,6 +108,24 @@ class PromptCreator:
             <|eot_id|><|start_header_id|>assistant<|end_header_id|>""",
             input_variables=["persona", "generation", "question"],
         )
+        generation_grader_prompt = PromptTemplate(
+            template="""<|begin_of_text|><|start_header_id|>system<|end_header_id|>
+            You are {persona} assessing an answer to a question. Give two
+            binary 'yes' or 'no' scores: whether the answer is grounded in /
+            supported by the set of facts, and whether the answer is useful to
+            resolve the question. Provide the scores as a JSON with two keys,
+            'grounded' and 'useful', and no preamble or explanation.
+            <|eot_id|><|start_header_id|>user<|end_header_id|>
+            Here are the facts:
+            \n ------- \n
+            {documents}
+            \n ------- \n
+            Here is the answer: {generation}
+            \n ------- \n
+            Here is the question: {question}
+            <|eot_id|><|start_header_id|>assistant<|end_header_id|>""",
+            input_variables=["persona", "documents", "generation", "question"],
+        )
         question_router_prompt = PromptTemplate(
             template="""<|begin_of_text|><|start_header_id|>system<|end_header_id|>
             You are {persona}. Use the vectorstore for questions on belegarth. You do
@@ -170,15 +188,83 @@ class PromptCreator:
             """,
             input_variables = ["persona", "question", "text"],
         )
+        batch_relevance_prompt = PromptTemplate(
+            template="""
+            <|begin_of_text|><|start_header_id|>system<|end_header_id|>
+            You are {persona}, with perfectly calibrated predictive
+            accuracy. For each of the {count} numbered information sources
+            below, give a probability estimate that the source will contain
+            information that is directly relevant to the given query.
+            Provide the response as a JSON with a single key, 'relevance' and
+            value a list of {count} probabilities between 0 and 1, one for
+            each source in the order they are numbered.
+            Query to find sources for: {question}
+            \n ------- \n
+            Sources:
+            {sources}
+            <|eot_id|><|start_header_id|>assistant<|end_header_id|>
+            """,
+            input_variables = ["persona", "question", "count", "sources"],
+        )
+        persona_relevance_prompt = PromptTemplate(
+            template="""
+            <|begin_of_text|><|start_header_id|>system<|end_header_id|>
+            You are a panel of {count} readers, each with perfectly
+            calibrated predictive accuracy. For each of the numbered readers
+            below, give a probability estimate, from that reader's point of
+            view, that the following information source will contain
+            information that is directly relevant to the given query.
+            Provide the response as a JSON with a single key, 'relevance' and
+            value a list of {count} probabilities between 0 and 1, one for
+            each reader in the order they are numbered.
+            Readers:
+            {personas}
+            Query to find sources for: {question}
+            \n ------- \n
+            Source: {text}
+            <|eot_id|><|start_header_id|>assistant<|end_header_id|>
+            """,
+            input_variables = ["count", "personas", "question", "text"],
+        )
+        persona_batch_relevance_prompt = PromptTemplate(
+            template="""
+            <|begin_of_text|><|start_header_id|>system<|end_header_id|>
+            You are a panel of {count} readers, each with perfectly
+            calibrated predictive accuracy. For each of the {source_count}
+            numbered information sources below, and for each of the numbered
+            readers, give a probability estimate, from that reader's point
+            of view, that the source will contain information that is
+            directly relevant to the given query.
+            Provide the response as a JSON with a single key, 'relevance' and
+            value a list of {source_count} lists, one for each source in the
+            order they are numbered, each holding {count} probabilities
+            between 0 and 1, one for each reader in the order they are
+            numbered.
+            Readers:
+            {personas}
+            Query to find sources for: {question}
+            \n ------- \n
+            Sources:
+            {sources}
+            <|eot_id|><|start_header_id|>assistant<|end_header_id|>
+            """,
+            input_variables = ["count", "personas", "question",
+                               "source_count", "sources"],
+        )
         self._available_prompts = {"retrieval_grader": retrieval_grader_prompt,
                     "new_retrieval_grader": updated_retrieval_grader_prompt,
                     "structure_question": structure_question_prompt,
                     "rag_generate": rag_generate_prompt,
                     "hallucination_grader": hallucination_grader_prompt,
                     "answer_grader": answer_grader_prompt,
+                    "generation_grader": generation_grader_prompt,
                     "question_router": question_router_prompt,
                     "improve_question": improve_question_prompt,
                     "text_relevance": text_relevance_prompt,
+                    "batch_relevance": batch_relevance_prompt,
+                    "persona_relevance": persona_relevance_prompt,
+                    "persona_batch_relevance":
+                        persona_batch_relevance_prompt,
                     "rate_note": answer_grader_prompt}
 
     def get_prompt(self, prompt_title):
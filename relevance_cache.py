@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 18:40:00 2026
+
+@author: magfrump
+
+A cache of the relevance scores retrieval gets from the LLM. The model runs
+at temperature 0, so scoring the same text for the same persona and
+question again, as happens when retrieve runs after a web search or for a
+repeated question, would only repeat an answer already given.
+
+Classes:
+    RelevanceCache: An in-memory LRU of scores, optionally backed by a
+        sqlite file that outlives the process.
+"""
+
+from collections import OrderedDict
+import hashlib
+import sqlite3
+import threading
+
+class RelevanceCache:
+    """
+    Relevance scores keyed by make_key. Recently used scores are kept in
+    memory, up to max_entries; with a path, every score is also written to
+    a sqlite file, which is read when a score is not in memory.
+
+    Attributes:
+        path (str): The sqlite file backing the cache, or None.
+        max_entries (int): The most scores kept in memory.
+        hits (int): Lookups served from memory.
+        disk_hits (int): Lookups served from the sqlite file.
+        misses (int): Lookups of scores not in the cache.
+    """
+    def __init__(self, path=None, max_entries=100000):
+        """
+        Opens (or creates) a relevance cache.
+
+        Args:
+            path (str): The sqlite file backing the cache, or None to keep
+                scores in memory only.
+            max_entries (int): The most scores kept in memory.
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._scores = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        if path is not None:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("""CREATE TABLE IF NOT EXISTS scores (
+                                    key TEXT PRIMARY KEY,
+                                    score REAL NOT NULL)""")
+            self._conn.commit()
+
+    @staticmethod
+    def make_key(persona, question, text, model, prompt_version):
+        """
+        Hashes the inputs that determine a relevance score.
+
+        Args:
+            persona (str): The persona judging relevance.
+            question (str): The question sources are scored for.
+            text (str): The summary or text being scored.
+            model (str): The name of the model scoring it.
+            prompt_version (str): The prompt and its version.
+
+        Returns:
+            str: A hex digest identifying the score.
+        """
+        digest = hashlib.sha256()
+        for part in (str(model), str(prompt_version), persona, question,
+                     text):
+            encoded = part.encode('utf-8')
+            digest.update(len(encoded).to_bytes(8, 'big'))
+            digest.update(encoded)
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        Looks up a score, marking it as recently used.
+
+        Args:
+            key (str): A key from make_key.
+
+        Returns:
+            float: The cached score, or None if it is not cached.
+        """
+        with self._lock:
+            score = self._scores.get(key)
+            if score is not None:
+                self._scores.move_to_end(key)
+                self.hits += 1
+                return score
+            if self._conn is not None:
+                row = self._conn.execute(
+                    "SELECT score FROM scores WHERE key = ?",
+                    (key,)).fetchone()
+                if row is not None:
+                    self.disk_hits += 1
+                    self._remember(key, row[0])
+                    return row[0]
+            self.misses += 1
+            return None
+
+    def put(self, key, score):
+        """
+        Caches a score.
+
+        Args:
+            key (str): A key from make_key.
+            score (float): The relevance score.
+        """
+        with self._lock:
+            self._remember(key, score)
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO scores VALUES (?, ?)",
+                    (key, score))
+                self._conn.commit()
+
+    @property
+    def hit_rate(self):
+        """
+        The share of lookups served from memory or disk.
+        """
+        lookups = self.hits + self.disk_hits + self.misses
+        if lookups == 0:
+            return 0.0
+        return (self.hits + self.disk_hits) / lookups
+
+    def _remember(self, key, score):
+        """
+        Keeps a score in memory, evicting the least recently used ones past
+        max_entries. Call with the lock held.
+        """
+        self._scores[key] = score
+        self._scores.move_to_end(key)
+        while len(self._scores) > self.max_entries:
+            self._scores.popitem(last=False)
+
+    def __len__(self):
+        with self._lock:
+            if self._conn is not None:
+                return self._conn.execute(
+                    "SELECT COUNT(*) FROM scores").fetchone()[0]
+            return len(self._scores)
+
+    def close(self):
+        """
+        Closes the sqlite file, if there is one.
+        """
+        if self._conn is not None:
+            self._conn.close()
+
+    def __str__(self):
+        return (f"{self.hits} memory hits, {self.disk_hits} disk hits, "
+                f"{self.misses} misses, {self.hit_rate:.0%} hit rate")
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 10:30:00 2026
+
+@author: magfrump
+
+An on-disk cache of LLM summaries so that re-ingesting a document only pays
+for the chunks that changed.
+
+Classes:
+    SummaryCache: A sqlite-backed store of summaries keyed by a hash of the
+        summarized text, the model name and the prompt version.
+"""
+
+import hashlib
+import sqlite3
+import threading
+import time
+
+# How many cache hits are remembered before their recency is written back.
+_TOUCH_BATCH = 256
+
+class SummaryCache:
+    """
+    A content-addressed cache of summaries stored in a local sqlite file.
+
+    Entries are keyed by make_key, so a cached summary is only served for
+    the same text, model and prompt version. When the stored summaries grow
+    past max_bytes, the least recently used entries are evicted.
+
+    The total size of the entries is kept as a running count, and the
+    times of cache hits are written back in batches, with the next put or
+    on close, so a hit does not commit a write.
+
+    Attributes:
+        path (str): The sqlite file backing the cache.
+        max_bytes (int): The total size of stored entries to keep.
+    """
+    def __init__(self, path, max_bytes=64*1024*1024):
+        """
+        Opens (or creates) a summary cache.
+
+        Args:
+            path (str): The sqlite file backing the cache.
+            max_bytes (int): The total size of stored entries to keep.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS summaries (
+                                key TEXT PRIMARY KEY,
+                                summary TEXT NOT NULL,
+                                size INTEGER NOT NULL,
+                                last_used REAL NOT NULL)""")
+        self._conn.execute("""CREATE INDEX IF NOT EXISTS summaries_last_used
+                              ON summaries (last_used)""")
+        self._conn.commit()
+        self._size = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM summaries").fetchone()[0]
+        # when each entry hit since the last write-back was last used
+        self._touched = {}
+
+    @staticmethod
+    def make_key(text, model, prompt_version):
+        """
+        Hashes the inputs that determine a summary.
+
+        Args:
+            text (str): The text being summarized.
+            model (str): The name of the model producing the summary.
+            prompt_version (int): The version of the summary prompt.
+
+        Returns:
+            str: A hex digest identifying the summary.
+        """
+        digest = hashlib.sha256()
+        for part in (str(model), str(prompt_version), text):
+            encoded = part.encode('utf-8')
+            digest.update(len(encoded).to_bytes(8, 'big'))
+            digest.update(encoded)
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        Looks up a cached summary, marking it as recently used.
+
+        Args:
+            key (str): A key from make_key.
+
+        Returns:
+            str: The cached summary, or None if it is not cached.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT summary FROM summaries WHERE key = ?",
+                (key,)).fetchone()
+            if row is None:
+                return None
+            self._touched[key] = time.time()
+            if len(self._touched) >= _TOUCH_BATCH:
+                self._write_touches()
+                self._conn.commit()
+        return row[0]
+
+    def put(self, key, summary):
+        """
+        Stores a summary, evicting old entries if the cache is too large.
+
+        Args:
+            key (str): A key from make_key.
+            summary (str): The summary to store.
+        """
+        size = len(key) + len(summary.encode('utf-8'))
+        with self._lock:
+            replaced = self._conn.execute(
+                "SELECT size FROM summaries WHERE key = ?",
+                (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO summaries VALUES (?, ?, ?, ?)",
+                (key, summary, size, time.time()))
+            self._touched.pop(key, None)
+            self._size += size - (replaced[0] if replaced else 0)
+            if self._size > self.max_bytes:
+                self._evict()
+            self._write_touches()
+            self._conn.commit()
+
+    def _evict(self):
+        """
+        Deletes least recently used entries until the cache fits in
+        max_bytes. The caller holds the lock.
+        """
+        self._write_touches()
+        stale = []
+        for key, size in self._conn.execute(
+                "SELECT key, size FROM summaries ORDER BY last_used"):
+            if self._size <= self.max_bytes:
+                break
+            stale.append((key,))
+            self._size -= size
+        self._conn.executemany("DELETE FROM summaries WHERE key = ?", stale)
+
+    def _write_touches(self):
+        """
+        Writes the times of the hits since the last write-back, without
+        committing. The caller holds the lock.
+        """
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE summaries SET last_used = ? WHERE key = ?",
+                [(used, key) for key, used in self._touched.items()])
+            self._touched = {}
+
+    def size_bytes(self):
+        """
+        Returns:
+            int: The total size of the stored entries.
+        """
+        with self._lock:
+            return self._size
+
+    def __len__(self):
+        return self._conn.execute(
+            "SELECT COUNT(*) FROM summaries").fetchone()[0]
+
+    def close(self):
+        """
+        Writes back the times of recent hits and closes the underlying
+        sqlite connection.
+        """
+        with self._lock:
+            self._write_touches()
+            self._conn.commit()
+            self._conn.close()
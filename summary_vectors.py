@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 19:20:00 2026
+
+@author: magfrump
+
+Vectors of the summaries in a document index, so retrieval can rule out
+children that have nothing to do with the question before asking the LLM.
+
+Summaries are turned into vectors offline with the hashing trick: each
+word is hashed to one of DIMENSIONS signed buckets, and the counts are
+log-scaled and normalized, so the dot product of two vectors is their
+cosine similarity. The vectors of an index are stored next to it as a
+prefix_vectors.npy matrix, read through a memory map, and a
+prefix_vectors.json map from each node reference to its row.
+
+Classes:
+    SummaryVectors: The stored vectors of one index.
+
+Functions:
+    vectorize(text): The hashed vector of a text.
+    build_vectors(directory, prefix): Writes the vectors of every summary
+        in a written index.
+
+Run as a script to add vectors to an existing index:
+    python summary_vectors.py data belegarth
+"""
+
+from collections import Counter
+import json
+import re
+import sys
+import zlib
+
+import numpy as np
+import indexed_info_node as iin
+
+DIMENSIONS = 1024
+
+_WORD = re.compile(r"\w+")
+
+def vectorize(text, dimensions=DIMENSIONS):
+    """
+    Hashes the words of a text into a unit vector.
+
+    Args:
+        text (str): The text.
+        dimensions (int): The length of the vector.
+
+    Returns:
+        numpy.ndarray: A float32 vector of unit length, or of zeros if the
+            text has no words.
+    """
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for word, count in Counter(_WORD.findall(text.lower())).items():
+        hashed = zlib.crc32(word.encode('utf-8'))
+        # the top bit picks the sign, so collisions tend to cancel out
+        sign = 1.0 if hashed & 0x80000000 else -1.0
+        vector[hashed % dimensions] += sign * (1.0 + np.log(count))
+    norm = np.linalg.norm(vector)
+    if norm > 0:
+        vector /= norm
+    return vector
+
+def _paths(directory, prefix):
+    return (directory+"/"+prefix+"_vectors.npy",
+            directory+"/"+prefix+"_vectors.json")
+
+def build_vectors(directory, prefix, dimensions=DIMENSIONS):
+    """
+    Walks a written index from its root and stores the vector of every
+    child summary under the child's reference. No LLM calls are made.
+
+    Args:
+        directory (str): The directory the index is written to.
+        prefix (str): The name of the root node.
+        dimensions (int): The length of the vectors.
+
+    Returns:
+        int: The number of vectors written.
+    """
+    rows = {}
+    vectors = []
+    references = [directory+"/"+prefix+"_kg.json"]
+    while references:
+        node = iin.IndexedInfoNode.fromfilename(references.pop())
+        for child in node.get_children():
+            if child.node_reference in rows:
+                continue
+            rows[child.node_reference] = len(vectors)
+            vectors.append(vectorize(child.node_summary, dimensions))
+            references.append(child.node_reference)
+    matrix_path, rows_path = _paths(directory, prefix)
+    matrix = np.array(vectors, dtype=np.float32).reshape(-1, dimensions)
+    np.save(matrix_path, matrix)
+    with open(rows_path, 'w', encoding='utf-8') as f:
+        json.dump(rows, f)
+    return len(vectors)
+
+class SummaryVectors:
+    """
+    The stored summary vectors of one index, memory-mapped from disk.
+
+    Methods:
+        similarities(question, references): Cosine similarities of a
+            question to the summaries of several nodes.
+    """
+    def __init__(self, directory, prefix):
+        """
+        Opens the vectors written by build_vectors.
+
+        Args:
+            directory (str): The directory the index is written to.
+            prefix (str): The name of the root node.
+        """
+        matrix_path, rows_path = _paths(directory, prefix)
+        self._matrix = np.load(matrix_path, mmap_mode='r')
+        with open(rows_path, encoding='utf-8') as f:
+            self._rows = json.load(f)
+
+    @property
+    def dimensions(self):
+        return self._matrix.shape[1]
+
+    def similarities(self, question, references):
+        """
+        Scores the summaries of several nodes against a question with one
+        matrix product.
+
+        Args:
+            question (str or numpy.ndarray): The question, or its vector.
+            references (list): The references of the nodes.
+
+        Returns:
+            numpy.ndarray: The cosine similarity of each node's summary to
+                the question, or NaN for nodes without a stored vector.
+        """
+        if isinstance(question, str):
+            question = vectorize(question, self.dimensions)
+        rows = np.array([self._rows.get(reference, -1)
+                         for reference in references])
+        found = rows >= 0
+        scores = np.full(len(references), np.nan, dtype=np.float32)
+        if found.any():
+            scores[found] = self._matrix[rows[found]] @ question
+        return scores
+
+    def __contains__(self, reference):
+        return reference in self._rows
+
+    def __len__(self):
+        return len(self._rows)
+
+if __name__ == '__main__':
+    index_dir = sys.argv[1] if len(sys.argv) > 1 else "data"
+    index_prefix = sys.argv[2] if len(sys.argv) > 2 else "belegarth"
+    print("Wrote", build_vectors(index_dir, index_prefix), "vectors for",
+          index_dir+"/"+index_prefix+"_kg.json")
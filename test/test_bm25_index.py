@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 20:30:00 2026
+
+@author: magfrump
+"""
+
+import tempfile
+import unittest
+import indexed_info_node as iin
+import knowledge_graph as kg
+import bm25_index as bm25
+from test.test_knowledge_graph import FakeSummarizer
+
+class TestBM25Index(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        document = ("swords may be no longer than five feet. shields are "
+                    "round or square. archers use padded arrows. swords "
+                    "and shields are checked before each fight.")
+        self.graph = kg.KnowledgeGraph([document], chunk_length=40,
+                                       chunk_overlap=0, max_subtopics=3,
+                                       llm=FakeSummarizer().llm)
+        self.graph.write_doc_to_dir(self._dir.name, "rules")
+        self.index = bm25.BM25Index(self._dir.name, "rules")
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_tokenize(self):
+        self.assertEqual(bm25.tokenize("Swords, shields & ARROWS!"),
+                         ["swords", "shields", "arrows"])
+
+    def test_indexes_every_leaf(self):
+        leaves = []
+        to_visit = [self._dir.name+"/rules_kg.json"]
+        while to_visit:
+            node = iin.IndexedInfoNode.fromfilename(to_visit.pop())
+            if node.get_type == "TEXT":
+                leaves.append(node)
+            to_visit += [child.node_reference
+                         for child in node.get_children()]
+        self.assertEqual(len(self.index), len(leaves))
+        self.assertEqual(bm25.build_bm25(self._dir.name, "rules"),
+                         len(leaves))
+
+    def test_search_ranks_matching_leaves(self):
+        hits = self.index.search("padded arrows", k=3)
+        self.assertEqual(len(hits), 1)
+        text = iin.IndexedInfoNode.fromfilename(hits[0][1]).get_text
+        self.assertIn("arrows", text)
+        self.assertEqual(self.index.search("banana bread"), [])
+        scores = [score for score, _ in self.index.search("swords shields")]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+        self.assertLessEqual(len(self.index.search("swords", k=1)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
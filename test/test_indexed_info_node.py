@@ -7,6 +7,7 @@ Created on Tue Oct  8 13:13:49 2024
 """
 
 import json
+import os
 import unittest
 import indexed_info_node as iin
 
@@ -43,7 +44,39 @@ class TestInfoNode(unittest.TestCase):
             json.dump(raw, f)
         node2 = iin.IndexedInfoNode.fromfilename(filename)
         self.assertEqual(node, node2)
+
+    def test_text_span(self):
+        blob = "test.blob"
+        with open(blob, 'wb') as f:
+            f.write("prefix ünïcode suffix".encode('utf-8'))
+        span = iin.TextSpan(blob, 7, 16)
+        data = iin.NodeMetaData(0,1,"test","TEXT")
+        node = iin.IndexedInfoNode([], data, "", span)
+        self.assertEqual(node.get_text, "ünïcode")
+        filename = "test.json"
+        node.write_to_file(filename)
+        self.assertEqual(iin.IndexedInfoNode.fromfilename(filename), node)
+        iin.release_blobs()
+        os.remove(blob)
             
 
+    def test_lazy_text(self):
+        meta = iin.NodeMetaData(1, 2, "src", "TEXT")
+        node = iin.IndexedInfoNode([], meta, 'a "quoted" text')
+        reads = []
+
+        def load_text():
+            reads.append(1)
+            return node.get_text
+
+        lazy = iin.LazyIndexedInfoNode.fromjson(
+            dict(node.to_json(), text=None), load_text=load_text)
+        self.assertEqual(lazy.get_type, "TEXT")
+        self.assertEqual(reads, [])
+        self.assertEqual(lazy.get_text, node.get_text)
+        self.assertEqual(lazy, node)
+        self.assertEqual(reads, [1])
+
+
 if __name__ == '__main__':
     unittest.main()
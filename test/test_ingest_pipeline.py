@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 12:40:00 2026
+
+@author: magfrump
+"""
+
+import functools
+import http.server
+import os
+import tempfile
+import threading
+import unittest
+import indexed_info_node as iin
+from ingest_pipeline import IngestPipeline
+from test.test_knowledge_graph import FakeSummarizer
+
+PAGES = {"one.html": "<html><body><p>here's a big old sentence for you to "
+                     "split up lol</p></body></html>",
+         "two.html": "<html><body><p>and a second page of text to index"
+                     "</p></body></html>"}
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+class TestIngestPipeline(unittest.TestCase):
+    def setUp(self):
+        self._site = tempfile.TemporaryDirectory()
+        for name, page in PAGES.items():
+            with open(os.path.join(self._site.name, name), 'w') as f:
+                f.write(page)
+        handler = functools.partial(QuietHandler, directory=self._site.name)
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", 0),
+                                                       handler)
+        threading.Thread(target=self._server.serve_forever,
+                         daemon=True).start()
+        self._url = "http://127.0.0.1:%d/" % self._server.server_address[1]
+        self._index = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._site.cleanup()
+        self._index.cleanup()
+
+    def test_pipeline_writes_every_page(self):
+        fake = FakeSummarizer()
+        pipeline = IngestPipeline(self._index.name, chunk_length=9,
+                                  chunk_overlap=2, max_subtopics=5,
+                                  llm=fake.llm, queue_size=1)
+        written = pipeline.run([(self._url+"one.html", "one"),
+                                (self._url+"two.html", "two"),
+                                (self._url+"missing.html", "missing")])
+        self.assertEqual(sorted(written),
+                         [self._index.name+"/one_kg.json",
+                          self._index.name+"/two_kg.json"])
+        root = iin.IndexedInfoNode.fromfilename(written[0])
+        self.assertEqual(root.get_type, "DOCUMENT")
+        self.assertEqual(pipeline.stats["fetch"].items, 2)
+        self.assertEqual(len(pipeline.stats["fetch"].errors), 1)
+        self.assertEqual(pipeline.stats["write"].items, 2)
+        self.assertEqual(len(pipeline.stats["chunk"].errors), 0)
+        self.assertEqual(pipeline.build_stats.llm_calls, fake.calls)
+
+    def test_streaming_pipeline_stores_text_in_blobs(self):
+        fake = FakeSummarizer()
+        pipeline = IngestPipeline(self._index.name, chunk_length=9,
+                                  chunk_overlap=2, max_subtopics=5,
+                                  llm=fake.llm, streaming=True, blob=True)
+        written = pipeline.run([(self._url+"one.html", "one"),
+                                (self._url+"two.html", "two")])
+        self.assertEqual(sorted(written),
+                         [self._index.name+"/one_kg.json",
+                          self._index.name+"/two_kg.json"])
+        self.assertTrue(os.path.exists(self._index.name+"/one.blob"))
+        node = iin.IndexedInfoNode.fromfilename(written[0])
+        while node.get_children():
+            node = node.retrieve_child(0)
+        self.assertEqual(node.get_type, "TEXT")
+        self.assertNotEqual(node.get_text, "")
+        self.assertEqual(pipeline.build_stats.llm_calls, fake.calls)
+        iin.release_blobs()
+
+    def test_summaries_run_concurrently(self):
+        fake = FakeSummarizer(delay=0.02)
+        pipeline = IngestPipeline(self._index.name, chunk_length=9,
+                                  chunk_overlap=2, max_subtopics=2,
+                                  llm=fake.llm, summarize_workers=1,
+                                  max_workers=3)
+        pipeline.run([(self._url+"one.html", "one")])
+        self.assertGreater(fake.max_in_flight, 1)
+
+    def test_llm_failure_is_recorded(self):
+        fake = FakeSummarizer(fail_after=1)
+        pipeline = IngestPipeline(self._index.name, chunk_length=9,
+                                  chunk_overlap=2, max_subtopics=5,
+                                  llm=fake.llm)
+        written = pipeline.run([(self._url+"one.html", "one")])
+        self.assertEqual(written, [])
+        self.assertEqual(len(pipeline.stats["summarize"].errors), 1)
+        self.assertTrue(os.path.exists(self._index.name+"/one.journal"))
+
+    def test_unexpected_error_stops_the_pipeline(self):
+        class BrokenWritePipeline(IngestPipeline):
+            def _write_stage(self, summarized):
+                raise TypeError("broken write")
+
+        pipeline = BrokenWritePipeline(self._index.name, chunk_length=9,
+                                       chunk_overlap=2, max_subtopics=5,
+                                       llm=FakeSummarizer().llm,
+                                       queue_size=1, streaming=True,
+                                       blob=True)
+        sources = [(self._url+"one.html", "page%d" % i) for i in range(12)]
+        raised = []
+        def run():
+            try:
+                pipeline.run(sources)
+            except TypeError as error:
+                raised.append(error)
+        runner = threading.Thread(target=run, daemon=True)
+        runner.start()
+        runner.join(timeout=30)
+        self.assertFalse(runner.is_alive())
+        self.assertEqual(len(raised), 1)
+        self.assertEqual(len(pipeline.stats["write"].errors), 1)
+        # the builders of unwritten pages were closed, keeping their journals
+        names = os.listdir(self._index.name)
+        self.assertFalse([name for name in names
+                          if name.endswith("_links.sqlite")])
+        self.assertIn("page0.journal", names)
+        iin.release_blobs()
+
+
+if __name__ == '__main__':
+    unittest.main()
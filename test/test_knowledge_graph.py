@@ -6,8 +6,66 @@ Created on Fri Oct  4 13:54:33 2024
 @author: magfrump
 """
 
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
 import unittest
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
 import knowledge_graph as kg
+import indexed_info_node as iin
+from build_journal import BuildJournal
+
+
+class FakeSummarizer:
+    """
+    Stands in for the chat model: returns a short digest of each prompt and
+    records the most summaries ever in flight at once. With fail_after set,
+    calls after that many fail as if the server had crashed.
+    """
+    def __init__(self, delay=0, fail_after=None):
+        self.delay = delay
+        self.fail_after = fail_after
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self.llm = RunnableLambda(self._summarize)
+
+    def _summarize(self, prompt):
+        with self._lock:
+            if self.fail_after is not None and self.calls >= self.fail_after:
+                raise ConnectionError("LLM server went away")
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delay)
+        with self._lock:
+            self.in_flight -= 1
+        digest = hashlib.md5(prompt.to_string().encode()).hexdigest()
+        return AIMessage(content=digest[:8])
+
+
+def _leaf_texts(root, max_children):
+    leaves = []
+    nodes = [iin.IndexedInfoNode.fromfilename(root)]
+    while nodes:
+        node = nodes.pop(0)
+        if node.get_type == "TEXT":
+            leaves.append(node.get_text)
+            continue
+        assert len(node.get_children()) <= max_children
+        nodes.extend(iin.IndexedInfoNode.fromfilename(child.node_reference)
+                     for child in node.get_children())
+    return leaves
+
+
+def _texts(graph):
+    return [graph.get_text()] + [text for sub in graph.subtopics
+                                 for text in _texts(sub)]
 
 
 class TestKnowledgeGraph(unittest.TestCase):
@@ -56,5 +114,238 @@ class TestKnowledgeGraph(unittest.TestCase):
         graph = kg.KnowledgeGraph(input_documents, chunk_length = 4000, chunk_overlap = 20, max_subtopics = 10)
         graph.print()
 
+    def test_concurrent_build_matches_serial(self):
+        input_documents = ["here's a big old sentence for you to split up lol"]
+        serial = kg.KnowledgeGraph(input_documents, chunk_length=9,
+                                   chunk_overlap=2, max_subtopics=5,
+                                   llm=FakeSummarizer().llm)
+        fake = FakeSummarizer(delay=0.01)
+        concurrent = kg.KnowledgeGraph(input_documents, chunk_length=9,
+                                       chunk_overlap=2, max_subtopics=5,
+                                       llm=fake.llm, max_workers=3)
+        self.assertEqual(_texts(serial), _texts(concurrent))
+        self.assertGreater(fake.max_in_flight, 1)
+        self.assertLessEqual(fake.max_in_flight, 3)
+
+    def test_write_reuses_summaries(self):
+        input_documents = ["here's a big old sentence for you to split up lol"]
+        fake = FakeSummarizer()
+        graph = kg.KnowledgeGraph(input_documents, chunk_length=9,
+                                  chunk_overlap=2, max_subtopics=5,
+                                  llm=fake.llm)
+        # one summary per node below the root
+        self.assertEqual(graph.stats.llm_calls, len(_texts(graph)) - 1)
+        self.assertEqual(fake.calls, graph.stats.llm_calls)
+        with tempfile.TemporaryDirectory() as directory:
+            graph.write_doc_to_dir(directory, "doc")
+            self.assertEqual(fake.calls, graph.stats.llm_calls)
+            root = iin.IndexedInfoNode.fromfilename(
+                os.path.join(directory, "doc_kg.json"))
+            self.assertEqual([c.node_summary for c in root.get_children()],
+                             graph.summaries)
+
+    def test_wide_fanout_names_do_not_collide(self):
+        document = "".join(chr(ord("a") + i % 26) * 2 for i in range(150))
+        graph = kg.KnowledgeGraph([document], chunk_length=4,
+                                  chunk_overlap=0, max_subtopics=12,
+                                  llm=FakeSummarizer().llm)
+        with tempfile.TemporaryDirectory() as directory:
+            graph.write_doc_to_dir(directory, "doc")
+            names = [name for name in os.listdir(directory)
+                     if name.endswith("_kg.json")]
+            self.assertEqual(len(names), graph.num_nodes)
+            self.assertEqual(_leaf_texts(directory+"/doc_kg.json", 12),
+                             kg._split_document(document, 4, 0))
+            with open(directory+"/doc_manifest.json", encoding='utf-8') as f:
+                paths = json.load(f)["paths"]
+            self.assertEqual(sorted(name+"_kg.json"
+                                    for name in paths.values()),
+                             sorted(names))
+            self.assertEqual(paths[""], "doc")
+            root = iin.IndexedInfoNode.fromfilename(directory+"/doc_kg.json")
+            for i, child in enumerate(root.get_children()):
+                self.assertEqual(child.node_reference,
+                                 directory+"/"+paths[str(i)]+"_kg.json")
+
+    def test_streaming_builder(self):
+        documents = ["here's a big old sentence for you to split up lol",
+                     "and another one"]
+        fake = FakeSummarizer()
+        with tempfile.TemporaryDirectory() as directory:
+            builder = kg.StreamingGraphBuilder(directory, "doc", 9, 2,
+                                               max_subtopics=3, llm=fake.llm)
+            root = builder.build(document for document in documents)
+            self.assertEqual(root, directory+"/doc_kg.json")
+            self.assertEqual(iin.IndexedInfoNode.fromfilename(root).get_type,
+                             "DOCUMENT")
+            leaves = _leaf_texts(root, 3)
+            expected = [chunk for document in documents
+                        for chunk in kg._split_document(document, 9, 2)]
+            self.assertEqual(leaves, expected)
+            self.assertEqual(fake.calls, builder.stats.llm_calls)
+            with open(directory+"/doc_manifest.json", encoding='utf-8') as f:
+                paths = json.load(f)["paths"]
+            self.assertEqual(len(paths),
+                             len([name for name in os.listdir(directory)
+                                  if name.endswith("_kg.json")]))
+
+    def test_streaming_builder_keeps_links_on_disk(self):
+        document = "here's a big old sentence for you to split up lol"
+        with tempfile.TemporaryDirectory() as directory:
+            builder = kg.StreamingGraphBuilder(directory, "doc", 9, 2,
+                                               max_subtopics=2,
+                                               llm=FakeSummarizer().llm)
+            builder.add_document(document)
+            self.assertTrue(os.path.exists(directory+"/doc_links.sqlite"))
+            root = builder.finish()
+            self.assertFalse(os.path.exists(directory+"/doc_links.sqlite"))
+            with open(directory+"/doc_manifest.json", encoding='utf-8') as f:
+                paths = json.load(f)["paths"]
+            pending = [("", iin.IndexedInfoNode.fromfilename(root))]
+            while pending:
+                key, node = pending.pop()
+                for i, child in enumerate(node.get_children()):
+                    child_key = key+"/"+str(i) if key else str(i)
+                    self.assertEqual(child.node_reference,
+                                     directory+"/"+paths[child_key]+"_kg.json")
+                    pending.append((child_key, iin.IndexedInfoNode
+                                    .fromfilename(child.node_reference)))
+
+    def test_streaming_builder_blob_leaves(self):
+        document = "naïve café text — split into spans of unicode"
+        with tempfile.TemporaryDirectory() as directory:
+            builder = kg.StreamingGraphBuilder(directory, "doc", 9, 2,
+                                               max_subtopics=3, blob=True,
+                                               llm=FakeSummarizer().llm)
+            root = builder.build([document])
+            with open(directory+"/doc.blob", encoding='utf-8') as f:
+                self.assertEqual(f.read(), document)
+            leaf = iin.IndexedInfoNode.fromfilename(directory+"/doc_0_kg.json")
+            self.assertEqual(leaf.get_type, "TEXT")
+            self.assertEqual(leaf.get_text, document[:9])
+            with open(directory+"/doc_0_kg.json", encoding='utf-8') as f:
+                self.assertEqual(json.loads(f.read())["text"], "")
+            self.assertEqual(_leaf_texts(root, 3),
+                             kg._split_document(document, 9, 2))
+            iin.release_blobs()
+
+    def test_refresh_rebuilds_only_changed_subtrees(self):
+        document = "here's a big old sentence for you to split up lol"
+        changed = document.replace("lol", "now")
+        with tempfile.TemporaryDirectory() as directory:
+            kg.KnowledgeGraph([document], chunk_length=9, chunk_overlap=2,
+                              max_subtopics=5, llm=FakeSummarizer().llm
+                              ).write_doc_to_dir(directory, "doc")
+            same = kg.KnowledgeGraph([document], chunk_length=9,
+                                     chunk_overlap=2, max_subtopics=5,
+                                     llm=FakeSummarizer().llm, describe=False)
+            stats = same.refresh_doc_in_dir(directory, "doc")
+            self.assertEqual(stats.llm_calls, 0)
+            self.assertEqual(stats.nodes_reused, same.num_nodes)
+            self.assertEqual(stats.nodes_rebuilt, 0)
+
+            fake = FakeSummarizer()
+            refreshed = kg.KnowledgeGraph([changed], chunk_length=9,
+                                          chunk_overlap=2, max_subtopics=5,
+                                          llm=fake.llm, describe=False)
+            stats = refreshed.refresh_doc_in_dir(directory, "doc")
+            # only the last chunk changed: it, its section and the root
+            self.assertEqual(stats.nodes_rebuilt, 3)
+            self.assertEqual(stats.nodes_reused, refreshed.num_nodes - 3)
+            self.assertEqual(fake.calls, 2)
+
+            full = kg.KnowledgeGraph([changed], chunk_length=9,
+                                     chunk_overlap=2, max_subtopics=5,
+                                     llm=FakeSummarizer().llm)
+            root = iin.IndexedInfoNode.fromfilename(directory+"/doc_kg.json")
+            self.assertEqual(root.get_hash, full.content_hash)
+            self.assertEqual(refreshed.get_text(), full.get_text())
+
+    def test_refresh_streaming_build(self):
+        document = "here's a big old sentence for you to split up lol"
+        changed = document.replace("lol", "now")
+        with tempfile.TemporaryDirectory() as directory:
+            built = kg.StreamingGraphBuilder(directory, "doc", 9, 2,
+                                             max_subtopics=3, blob=True,
+                                             llm=FakeSummarizer().llm)
+            built.build([document])
+            same = kg.StreamingGraphBuilder(directory, "doc", 9, 2,
+                                            max_subtopics=3, blob=True,
+                                            refresh=True,
+                                            llm=FakeSummarizer().llm)
+            same.build([document])
+            self.assertEqual(same.stats.llm_calls, 0)
+            self.assertEqual(same.stats.nodes_reused, built.stats.llm_calls+1)
+            self.assertEqual(same.stats.nodes_rebuilt, 0)
+
+            fake = FakeSummarizer()
+            refreshed = kg.StreamingGraphBuilder(directory, "doc", 9, 2,
+                                                 max_subtopics=3, blob=True,
+                                                 refresh=True, llm=fake.llm)
+            root = refreshed.build([changed])
+            # only the last chunk changed: it, its two sections and the root
+            self.assertEqual(refreshed.stats.nodes_rebuilt, 4)
+            self.assertEqual(fake.calls, 3)
+            self.assertEqual(_leaf_texts(root, 3),
+                             kg._split_document(changed, 9, 2))
+
+            fresh = tempfile.mkdtemp(dir=directory)
+            full = kg.StreamingGraphBuilder(fresh, "doc", 9, 2,
+                                            max_subtopics=3, blob=True,
+                                            llm=FakeSummarizer().llm)
+            self.assertEqual(iin.IndexedInfoNode.fromfilename(root).get_hash,
+                             iin.IndexedInfoNode.fromfilename(
+                                 full.build([changed])).get_hash)
+            iin.release_blobs()
+
+    def test_tree_refresh_rejects_streaming_build(self):
+        document = "here's a big old sentence for you to split up lol"
+        with tempfile.TemporaryDirectory() as directory:
+            kg.StreamingGraphBuilder(directory, "doc", 9, 2, max_subtopics=3,
+                                     llm=FakeSummarizer().llm
+                                     ).build([document])
+            graph = kg.KnowledgeGraph([document], chunk_length=9,
+                                      chunk_overlap=2, max_subtopics=3,
+                                      llm=FakeSummarizer().llm,
+                                      describe=False)
+            with self.assertRaises(ValueError):
+                graph.refresh_doc_in_dir(directory, "doc")
+
+    def test_streaming_refresh_rejects_tree_build(self):
+        document = "here's a big old sentence for you to split up lol"
+        with tempfile.TemporaryDirectory() as directory:
+            kg.KnowledgeGraph([document], chunk_length=9, chunk_overlap=2,
+                              max_subtopics=3, llm=FakeSummarizer().llm
+                              ).write_doc_to_dir(directory, "doc")
+            with self.assertRaises(ValueError):
+                kg.StreamingGraphBuilder(directory, "doc", 9, 2,
+                                         max_subtopics=3, refresh=True,
+                                         llm=FakeSummarizer().llm)
+            self.assertFalse(os.path.exists(directory+"/doc_links.sqlite"))
+
+    def test_resume_from_journal(self):
+        document = "here's a big old sentence for you to split up lol"
+        full = kg.KnowledgeGraph([document], chunk_length=9, chunk_overlap=2,
+                                 max_subtopics=5, llm=FakeSummarizer().llm)
+        with tempfile.TemporaryDirectory() as directory:
+            path = directory+"/doc.journal"
+            journal = BuildJournal(path)
+            with self.assertRaises(ConnectionError):
+                kg.KnowledgeGraph([document], chunk_length=9, chunk_overlap=2,
+                                  max_subtopics=5, journal=journal,
+                                  llm=FakeSummarizer(fail_after=4).llm)
+            journal.close()
+
+            fake = FakeSummarizer()
+            resumed = kg.KnowledgeGraph([document], chunk_length=9,
+                                        chunk_overlap=2, max_subtopics=5,
+                                        llm=fake.llm,
+                                        journal=BuildJournal(path))
+            self.assertEqual(resumed.stats.resumed, 4)
+            self.assertEqual(fake.calls, full.stats.llm_calls - 4)
+            self.assertEqual(_texts(resumed), _texts(full))
+            resumed.journal.discard()
+            self.assertFalse(os.path.exists(path))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 13:30:00 2026
+
+@author: magfrump
+"""
+
+import http.server
+import json
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.prompts import PromptTemplate
+import llm_client
+
+class FakeOllamaHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        server = self.server
+        payload = json.loads(self.rfile.read(
+            int(self.headers["Content-Length"])))
+        with server.lock:
+            server.payloads.append(payload)
+            server.ports.add(self.client_address[1])
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        time.sleep(server.delay)
+        with server.lock:
+            server.in_flight -= 1
+        body = json.dumps({"message": {"role": "assistant",
+                                       "content": "reply"}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class TestLLMClient(unittest.TestCase):
+    def setUp(self):
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", 0),
+                                                       FakeOllamaHandler)
+        self._server.lock = threading.Lock()
+        self._server.payloads = []
+        self._server.ports = set()
+        self._server.in_flight = 0
+        self._server.max_in_flight = 0
+        self._server.delay = 0
+        threading.Thread(target=self._server.serve_forever,
+                         daemon=True).start()
+        self._url = "http://127.0.0.1:%d" % self._server.server_address[1]
+
+    def tearDown(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def test_per_call_parameters_and_keep_alive(self):
+        client = llm_client.OllamaClient(self._url, max_concurrency=2)
+        llm = llm_client.PooledChatOllama(client=client)
+        prompt = PromptTemplate(template="say {word}",
+                                input_variables=["word"])
+        chain = prompt | llm.bind(num_predict=7, format="json")
+        for _ in range(3):
+            self.assertEqual(chain.invoke({"word": "hi"}).content, "reply")
+        payload = self._server.payloads[0]
+        self.assertEqual(payload["model"], "Kale")
+        self.assertEqual(payload["format"], "json")
+        self.assertEqual(payload["options"],
+                         {"temperature": 0, "num_predict": 7})
+        self.assertEqual(payload["messages"],
+                         [{"role": "user", "content": "say hi"}])
+        # sequential calls reuse one pooled connection
+        self.assertEqual(len(self._server.ports), 1)
+        self.assertEqual(client.calls, 3)
+        client.close()
+
+    def test_stream_yields_the_whole_reply(self):
+        client = llm_client.OllamaClient(self._url)
+        llm = llm_client.PooledChatOllama(client=client)
+        chunks = list(llm.stream("say hi"))
+        self.assertEqual([chunk.content for chunk in chunks], ["reply"])
+        self.assertEqual(client.calls, 1)
+        with self.assertRaises(NotImplementedError):
+            llm.bind_tools([])
+        client.close()
+
+    def test_concurrency_cap(self):
+        self._server.delay = 0.05
+        client = llm_client.OllamaClient(self._url, max_concurrency=2)
+        llm = llm_client.PooledChatOllama(client=client)
+        with ThreadPoolExecutor(max_workers=6) as pool:
+            list(pool.map(lambda _: llm.invoke("hello"), range(6)))
+        self.assertEqual(self._server.max_in_flight, 2)
+        client.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
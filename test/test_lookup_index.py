@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 16:20:00 2026
+
+@author: magfrump
+"""
+
+import os
+import tempfile
+import unittest
+import indexed_info_node as iin
+import lookup_index as li
+
+class TestLibrary(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._path = os.path.join(self._dir.name, "library.sqlite")
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_serialize_node(self):
+        node = li.Node("rules", {"weapons": li.Node("weapons",
+                                                    reference="w_kg.json")})
+        copy = li.deserialize_node(li.serialize_node(node))
+        self.assertEqual(copy.topic, "rules")
+        self.assertIsNone(copy.reference)
+        self.assertEqual(copy.children["weapons"].reference, "w_kg.json")
+
+    def test_codec_round_trips_any_topic(self):
+        node = li.Node("a\x00b ünïcode", {"": li.Node("", reference="")})
+        data = li.serialize_node(node)
+        # decoding reads from a view of a larger buffer without copying it
+        buffer = bytearray(b"padding" + data + b"more")
+        copy = li.deserialize_node(memoryview(buffer)[7:7+len(data)])
+        self.assertEqual(copy.topic, node.topic)
+        self.assertIsNone(copy.reference)
+        self.assertEqual(copy.children[""].reference, "")
+        self.assertEqual(list(li.deserialize_children(
+            li.serialize_children(node.children))), [""])
+        with self.assertRaises(ValueError):
+            li.deserialize_node(data[:1] + b"\x09" + data[2:])
+        with self.assertRaises(ValueError):
+            li.deserialize_node(data[:-1])
+
+    def test_rejects_data_without_a_header(self):
+        unversioned = (b'rules\x00rules_kg.json\x00'
+                       b'[{"topic": "weapons", "reference": null, '
+                       b'"children": []}]')
+        for data in (unversioned, b""):
+            with self.assertRaises(ValueError):
+                li.deserialize_node(data)
+
+    def test_get_chunk_from_disk(self):
+        library = li.Library(self._path)
+        library.add_node(li.Node("rules", {"weapons": li.Node("weapons")}))
+        library.add_node(li.Node("weapons"))
+        library.close()
+        reopened = li.Library(self._path)
+        self.assertEqual(len(reopened), 2)
+        node = reopened.get_chunk("rules")
+        self.assertEqual(list(node.children), ["weapons"])
+        self.assertEqual(node.id, reopened.lookup("rules"))
+        self.assertEqual((reopened.hits, reopened.misses), (0, 1))
+        reopened.get_chunk("rules")
+        self.assertEqual((reopened.hits, reopened.misses), (1, 1))
+        with self.assertRaises(KeyError):
+            reopened.get_chunk("missing")
+        reopened.close()
+
+    def test_cache_evicts_least_recently_used(self):
+        nodes = [li.Node(topic) for topic in ("a", "b", "c")]
+        size = len(li.serialize_node(nodes[0]))
+        library = li.Library(self._path, max_cache_bytes=2*size)
+        library.add_nodes(nodes)
+        self.assertEqual(list(library.cache), ["b", "c"])
+        library.get_chunk("b")
+        library.get_chunk("a")
+        self.assertEqual(list(library.cache), ["b", "a"])
+        self.assertLessEqual(library.cache_bytes, 2*size)
+        self.assertEqual(library.hit_rate, 0.5)
+        library.close()
+
+    def test_load_index_dir(self):
+        library = li.Library(self._path)
+        count = library.load_index_dir("data")
+        self.assertEqual(count, len([name for name in os.listdir("data")
+                                     if name.endswith("_kg.json")]))
+        root = library.get_chunk("belegarth")
+        self.assertEqual(root.reference, "data/belegarth_kg.json")
+        index_root = iin.IndexedInfoNode.fromfilename(root.reference)
+        first = index_root.get_children()[0]
+        self.assertIn(first.node_summary, root.children)
+        self.assertEqual(library.get_chunk(first.node_summary).reference,
+                         first.node_reference)
+        library.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
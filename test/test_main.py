@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 21:30:00 2026
+
+@author: magfrump
+"""
+
+import asyncio
+import json
+import tempfile
+import threading
+import time
+import unittest
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+import knowledge_graph as kg
+import main
+import node_definitions as nodedef
+from test.test_node_definitions import DOCUMENT, FakeScorer, _echo_summary
+
+class FakeModel:
+    """
+    Stands in for the chat model in the whole workflow: scores relevance
+    like FakeScorer, finds every document relevant, answers as the persona
+    it is asked to be, and accepts every answer. Records the most
+    generations in flight at once.
+    """
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.scorer = FakeScorer()
+        self.generating = 0
+        self.max_generating = 0
+        self._lock = threading.Lock()
+        self.llm = RunnableLambda(self._respond)
+
+    def _respond(self, prompt):
+        text = prompt.to_string()
+        if "Query to find sources for:" in text:
+            return self.scorer.llm.invoke(prompt)
+        if "'grounded' and 'useful'" in text:
+            return AIMessage(content=json.dumps({"grounded": "yes",
+                                                 "useful": "yes"}))
+        if "pieces of retrieved context" not in text:
+            return AIMessage(content=json.dumps({"score": "yes"}))
+        with self._lock:
+            self.generating += 1
+            self.max_generating = max(self.max_generating, self.generating)
+        time.sleep(self.delay)
+        with self._lock:
+            self.generating -= 1
+        persona = text.split("You are", 1)[1].split(".")[0].strip()
+        return AIMessage(content=json.dumps({"thoughts": "",
+                                             "answer": persona}))
+
+
+class TestWorkflow(unittest.TestCase):
+    def test_personas_run_in_parallel(self):
+        model = FakeModel(delay=0.1)
+        with tempfile.TemporaryDirectory() as directory:
+            kg.KnowledgeGraph([DOCUMENT], chunk_length=30, chunk_overlap=0,
+                              max_subtopics=3,
+                              llm=RunnableLambda(_echo_summary)
+                              ).write_doc_to_dir(directory, "fruit")
+            nodes = nodedef.RagNodes(directory+"/fruit_kg.json", model.llm,
+                                     num_personas=3, multi_persona=True)
+            app = main.build_workflow(nodes)
+            result = asyncio.run(app.ainvoke(
+                {"original_claim": "what grows on trees"}))
+        self.assertEqual(model.max_generating, 3)
+        answers = sorted(response["response_content"]["answer"]
+                         for response in result["responses"])
+        self.assertEqual(answers, sorted(
+            persona.split(".")[0].strip()
+            for persona in nodes._persona_list))
+        for response in result["responses"]:
+            self.assertEqual(len(response["response_attempts"]), 1)
+        self.assertEqual(sorted(rating["persona_index"]
+                                for rating in result["ratings"]), [0, 1, 2])
+        for rating in result["ratings"]:
+            self.assertEqual(rating["scores"], ["yes"] * 3)
+        self.assertEqual(result["winning_note"],
+                         result["responses"][0]["response_content"])
+        # one walk of the index served every persona
+        self.assertEqual(nodes.last_search_report.llm_calls,
+                         model.scorer.calls)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,573 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 17:20:00 2026
+
+@author: magfrump
+"""
+
+import asyncio
+import json
+import re
+import tempfile
+import threading
+import time
+import unittest
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+import knowledge_graph as kg
+from generate_personas import generate_personas
+import node_definitions as nodedef
+from beam_search import BeamSearch
+from bm25_index import BM25Index
+from relevance_cache import RelevanceCache
+from summary_vectors import SummaryVectors
+
+_WORD = re.compile(r"[a-z]+")
+
+DOCUMENT = ("apples grow on trees in the orchard. bananas grow in bunches. "
+            "cherries are small and red. dates come from palm trees. "
+            "elderberries make a dark syrup. figs are sweet and soft.")
+
+
+def _overlap(question, text):
+    wanted = set(_WORD.findall(question.lower()))
+    return len(wanted & set(_WORD.findall(text.lower()))) / len(wanted)
+
+
+_PERSONAS = [persona.strip() for persona in generate_personas(4)]
+
+
+def _weight(persona):
+    """
+    How much a persona cares about relevance: the n-th persona in
+    personas.json rates every source 1/n as relevant as the first.
+    """
+    return 1 / (1 + _PERSONAS.index(persona.strip()))
+
+
+def _echo_summary(prompt):
+    """
+    Stands in for the summarizer, using the text to summarize as its own
+    summary so that summaries share the text's words.
+    """
+    text = prompt.to_string().split("The text to be summarized is:")[-1]
+    return AIMessage(content=text.split("<|eot_id|>")[0].strip())
+
+
+class FakeScorer:
+    """
+    Stands in for the chat model in retrieval: rates a source by the share
+    of the question's words it contains, scaled by the persona's _weight,
+    and records the most calls ever in flight at once. With broken_batches
+    set, batched and multi-persona scoring calls get output that is not
+    JSON.
+    """
+    def __init__(self, broken_batches=False, delay=0):
+        self.broken_batches = broken_batches
+        self.delay = delay
+        self.calls = 0
+        self.batch_calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self.llm = RunnableLambda(self._respond)
+
+    def _respond(self, prompt):
+        prompt = prompt.to_string()
+        query = prompt.split("Query to find sources for:")[-1]
+        question = query.split("------- ")[0]
+        with self._lock:
+            self.calls += 1
+            if "Sources:" in query:
+                self.batch_calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delay)
+        with self._lock:
+            self.in_flight -= 1
+        if "Readers:" in prompt:
+            readers = prompt.split("Readers:", 1)[1].split(
+                "Query to find sources for:")[0]
+            weights = [_weight(persona) for persona in
+                       re.split(r"Reader \d+: ", readers)[1:]]
+        else:
+            persona = prompt.split("You are ", 1)[1].split(
+                ", with perfectly")[0]
+            weights = [_weight(persona)]
+        if "Sources:" in query:
+            sources = re.split(r"Source \d+: ",
+                               query.split("Sources:", 1)[1])[1:]
+        else:
+            sources = [query.split("Source:", 1)[1]]
+        if self.broken_batches and ("Readers:" in prompt or
+                                    "Sources:" in query):
+            return AIMessage(content="these all look great")
+        relevance = [[_overlap(question, source) * weight
+                      for weight in weights] for source in sources]
+        if "Readers:" not in prompt:
+            relevance = [row[0] for row in relevance]
+        if "Sources:" not in query:
+            relevance = relevance[0]
+        return AIMessage(content=json.dumps({"relevance": relevance}))
+
+
+class FakeClock:
+    """
+    Stands in for time.monotonic: time only passes when a test says so.
+    """
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeGrader:
+    """
+    Stands in for the chat model in grade_documents: grades a document
+    relevant if it mentions trees, and records the most calls in flight.
+    """
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self.llm = RunnableLambda(self._respond)
+
+    def _respond(self, prompt):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delay)
+        with self._lock:
+            self.in_flight -= 1
+        document = prompt.to_string().split("retrieved document:")[1]
+        document = document.split("Here is the user question")[0]
+        score = "yes" if "trees" in document else "no"
+        return AIMessage(content=json.dumps({"score": score}))
+
+class FakeJudge:
+    """
+    Stands in for the chat model in generation and its grading: answers
+    every question, then gives the configured verdicts. With fused set to
+    False, the fused grading prompt gets output missing its verdicts. Counts
+    the calls made with each prompt.
+    """
+    def __init__(self, grounded="yes", useful="yes", fused=True, delay=0):
+        self.grounded = grounded
+        self.useful = useful
+        self.fused = fused
+        self.delay = delay
+        self.calls = {}
+        self.llm = RunnableLambda(self._respond)
+
+    def _respond(self, prompt):
+        text = prompt.to_string()
+        time.sleep(self.delay)
+        if "pieces of retrieved context" in text:
+            kind, content = "generate", {"thoughts": "", "answer": "figs"}
+        elif "'grounded' and 'useful'" in text:
+            kind = "fused"
+            content = {"grounded": self.grounded, "useful": self.useful}
+            if not self.fused:
+                content = {"score": "yes"}
+        elif "grounded in / supported by" in text:
+            kind, content = "hallucination", {"score": self.grounded}
+        else:
+            kind, content = "answer", {"score": self.useful}
+        self.calls[kind] = self.calls.get(kind, 0) + 1
+        return AIMessage(content=json.dumps(content))
+
+class TestRetrieve(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        kg.KnowledgeGraph([DOCUMENT], chunk_length=30, chunk_overlap=0,
+                          max_subtopics=3, llm=RunnableLambda(_echo_summary)
+                          ).write_doc_to_dir(self._dir.name, "fruit")
+        self._root = self._dir.name+"/fruit_kg.json"
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _retrieve(self, scorer, **kwargs):
+        nodes = nodedef.RagNodes(self._root, scorer.llm, num_personas=1,
+                                 **kwargs)
+        state = nodes.retrieve({"original_claim": "what grows on trees"})
+        return state["responses"][0]["response_sources"]
+
+    def _aretrieve(self, scorer, **kwargs):
+        nodes = nodedef.RagNodes(self._root, scorer.llm, num_personas=1,
+                                 **kwargs)
+        state = asyncio.run(
+            nodes.aretrieve({"original_claim": "what grows on trees"}))
+        return state["responses"][0]["response_sources"]
+
+    def test_batched_scoring_matches_per_child(self):
+        single = FakeScorer()
+        batched = FakeScorer()
+        self.assertEqual(self._retrieve(batched, batch_relevance=True),
+                         self._retrieve(single))
+        self.assertGreater(batched.batch_calls, 0)
+        self.assertLess(batched.calls, single.calls)
+
+    def test_batched_scoring_falls_back_per_child(self):
+        single = FakeScorer()
+        broken = FakeScorer(broken_batches=True)
+        self.assertEqual(self._retrieve(broken, batch_relevance=True),
+                         self._retrieve(single))
+        self.assertEqual(broken.calls, single.calls + broken.batch_calls)
+
+    def test_async_retrieve_matches_retrieve(self):
+        single = FakeScorer()
+        concurrent = FakeScorer(delay=0.01)
+        self.assertEqual(sorted(self._aretrieve(concurrent, max_in_flight=3)),
+                         sorted(self._retrieve(single)))
+        self.assertEqual(concurrent.calls, single.calls)
+        self.assertGreater(concurrent.max_in_flight, 1)
+        self.assertLessEqual(concurrent.max_in_flight, 3)
+
+    def test_async_retrieve_batched(self):
+        batched = FakeScorer()
+        self.assertEqual(sorted(self._aretrieve(batched,
+                                                batch_relevance=True)),
+                         sorted(self._retrieve(FakeScorer())))
+        self.assertGreater(batched.batch_calls, 0)
+
+    def test_search_report_counts_calls(self):
+        scorer = FakeScorer()
+        nodes = nodedef.RagNodes(self._root, scorer.llm, num_personas=1)
+        nodes.retrieve({"original_claim": "what grows on trees"})
+        report = nodes.last_search_report
+        self.assertEqual(report.llm_calls, scorer.calls)
+        self.assertEqual(report.stopped, "exhausted")
+        self.assertGreater(report.deepest, 1)
+
+    def test_llm_call_budget(self):
+        scorer = FakeScorer()
+        nodes = nodedef.RagNodes(self._root, scorer.llm, num_personas=1,
+                                 max_llm_calls=4)
+        nodes.retrieve({"original_claim": "what grows on trees"})
+        self.assertLessEqual(scorer.calls, 4)
+        self.assertEqual(nodes.last_search_report.llm_calls, scorer.calls)
+        self.assertEqual(nodes.last_search_report.stopped, "llm_calls")
+
+    def test_max_depth(self):
+        scorer = FakeScorer()
+        nodes = nodedef.RagNodes(self._root, scorer.llm, num_personas=1,
+                                 max_depth=1)
+        state = nodes.retrieve({"original_claim": "what grows on trees"})
+        report = nodes.last_search_report
+        self.assertEqual(report.deepest, 1)
+        self.assertEqual(report.nodes_expanded, 1)
+        self.assertEqual(state["responses"][0]["response_sources"], [])
+
+    def test_async_budgets(self):
+        for budget in ({"max_llm_calls": 4}, {"max_depth": 1}):
+            scorer = FakeScorer()
+            nodes = nodedef.RagNodes(self._root, scorer.llm, num_personas=1,
+                                     **budget)
+            asyncio.run(nodes.aretrieve(
+                {"original_claim": "what grows on trees"}))
+            report = nodes.last_search_report
+            self.assertEqual(report.llm_calls, scorer.calls)
+            if "max_llm_calls" in budget:
+                self.assertLessEqual(scorer.calls, 4)
+                self.assertEqual(report.stopped, "llm_calls")
+            else:
+                self.assertEqual(report.deepest, 1)
+                self.assertEqual(report.nodes_expanded, 1)
+
+    def test_batch_fallback_stays_within_budget(self):
+        for walk in (self._retrieve, self._aretrieve):
+            for budget in (1, 2, 3, 5):
+                broken = FakeScorer(broken_batches=True)
+                walk(broken, batch_relevance=True, max_llm_calls=budget)
+                self.assertLessEqual(broken.calls, budget)
+
+    def test_relevance_cache_skips_repeated_scores(self):
+        cache = RelevanceCache()
+        first = FakeScorer()
+        sources = self._retrieve(first, relevance_cache=cache)
+        again = FakeScorer()
+        self.assertEqual(self._retrieve(again, relevance_cache=cache),
+                         sources)
+        self.assertEqual(again.calls, 0)
+        self.assertEqual(cache.hits, first.calls)
+        batched = FakeScorer()
+        self.assertEqual(sorted(self._aretrieve(batched, relevance_cache=cache,
+                                                batch_relevance=True)),
+                         sorted(sources))
+        self.assertGreater(batched.batch_calls, 0)
+        self.assertEqual(batched.calls, batched.batch_calls)
+
+    def test_summary_vectors_prune_children(self):
+        vectors = SummaryVectors(self._dir.name, "fruit")
+        single = FakeScorer()
+        pruned = FakeScorer()
+        question = "where do dates and figs come from"
+        sources = nodedef.RagNodes(self._root, single.llm, num_personas=1
+                                   ).retrieve({"original_claim": question}
+                                              )["responses"][0]
+        nodes = nodedef.RagNodes(self._root, pruned.llm, num_personas=1,
+                                 summary_vectors=vectors, vector_top_k=1)
+        state = nodes.retrieve({"original_claim": question})
+        self.assertLess(pruned.calls, single.calls)
+        self.assertEqual(nodes.last_search_report.llm_calls, pruned.calls)
+        self.assertIn(sources["response_sources"][0],
+                      state["responses"][0]["response_sources"])
+
+    def test_bm25_seeds_skip_the_walk(self):
+        bm25 = BM25Index(self._dir.name, "fruit")
+        question = "where do dates come from"
+        walked = FakeScorer()
+        sources = nodedef.RagNodes(self._root, walked.llm, num_personas=1
+                                   ).retrieve({"original_claim": question}
+                                              )["responses"][0]
+        seeded = FakeScorer()
+        nodes = nodedef.RagNodes(self._root, seeded.llm, num_personas=1,
+                                 bm25_index=bm25, bm25_seeds=2,
+                                 bm25_enough=0.5)
+        state = nodes.retrieve({"original_claim": question})
+        report = nodes.last_search_report
+        self.assertEqual(report.stopped, "seeds")
+        hits = len(bm25.search(question, 2))
+        self.assertEqual((report.seeds_scored, report.nodes_expanded),
+                         (hits, 0))
+        self.assertEqual(seeded.calls, hits)
+        self.assertEqual(state["responses"][0]["response_sources"][0],
+                         sources["response_sources"][0])
+        concurrent = FakeScorer()
+        state = asyncio.run(nodedef.RagNodes(
+            self._root, concurrent.llm, num_personas=1, bm25_index=bm25,
+            bm25_seeds=2, bm25_enough=0.5
+            ).aretrieve({"original_claim": question}))
+        self.assertEqual(concurrent.calls, hits)
+        self.assertEqual(state["responses"][0]["response_sources"][0],
+                         sources["response_sources"][0])
+
+    def test_bm25_seeds_are_not_scored_again(self):
+        bm25 = BM25Index(self._dir.name, "fruit")
+        seeded = FakeScorer()
+        nodes = nodedef.RagNodes(self._root, seeded.llm, num_personas=1,
+                                 bm25_index=bm25, bm25_enough=None)
+        state = nodes.retrieve({"original_claim": "what grows on trees"})
+        report = nodes.last_search_report
+        self.assertGreater(report.seeds_scored, 0)
+        self.assertGreater(report.nodes_expanded, 0)
+        self.assertEqual(report.llm_calls, seeded.calls)
+        sources = state["responses"][0]["response_sources"]
+        self.assertEqual(len(sources), len(set(sources)))
+        self.assertEqual(sorted(self._retrieve(FakeScorer()))[:1],
+                         sorted(sources)[:1])
+
+    def test_multi_persona_walks_once(self):
+        question = {"original_claim": "what grows on trees"}
+        single = FakeScorer()
+        sources = self._retrieve(single)
+        for broken in (False, True):
+            scorer = FakeScorer(broken_batches=broken)
+            nodes = nodedef.RagNodes(self._root, scorer.llm, num_personas=2,
+                                     multi_persona=True)
+            update = nodes.retrieve_for_all(dict(question))
+            calls = scorer.calls
+            self.assertEqual(nodes.last_search_report.llm_calls, calls)
+            if not broken:
+                self.assertEqual(calls, single.calls)
+            responses = update["persona_responses"]
+            self.assertEqual(responses[0]["response_sources"], sources)
+            state = dict(question, persona_index=1,
+                         pending_response=responses[1])
+            state = nodes.retrieve(state)
+            self.assertEqual(scorer.calls, calls)
+            self.assertIsNone(state["pending_response"])
+            self.assertEqual(state["responses"], [responses[1]])
+            # the pending sources are used once, then the persona walks
+            asyncio.run(nodes.aretrieve(state))
+            self.assertGreater(scorer.calls, calls)
+            self.assertEqual(len(state["responses"]), 2)
+
+    def test_no_walk_for_all_outside_multi_persona_mode(self):
+        scorer = FakeScorer()
+        nodes = nodedef.RagNodes(self._root, scorer.llm, num_personas=2)
+        self.assertEqual(
+            nodes.retrieve_for_all({"original_claim": "what grows on trees"}),
+            {})
+        self.assertEqual(scorer.calls, 0)
+
+    def test_multi_persona_scores_keep_reader_order(self):
+        question = "what grows on trees"
+        for batch_relevance in (False, True):
+            scorer = FakeScorer()
+            nodes = nodedef.RagNodes(self._root, scorer.llm, num_personas=3,
+                                     batch_relevance=batch_relevance)
+            root = nodes._load_node(self._root)
+            children = nodes._load_node(
+                root.get_children()[0].node_reference).get_children()
+            self.assertGreater(len(children), 1)
+            scores, calls = nodes._score_children_for_all(children, question)
+            self.assertEqual(calls, 1 if batch_relevance else len(children))
+            for p, persona in enumerate(nodes._persona_list):
+                self.assertEqual(
+                    [row[p] for row in scores],
+                    [nodes._score_text(child.node_summary, persona,
+                                       question)[0]
+                     for child in children])
+
+    def test_multi_persona_batch_scores_every_persona_at_once(self):
+        question = {"original_claim": "what grows on trees"}
+        walks = 0
+        for index in range(3):
+            scorer = FakeScorer()
+            nodes = nodedef.RagNodes(self._root, scorer.llm, num_personas=3,
+                                     batch_relevance=True)
+            nodes.retrieve(dict(question, persona_index=index))
+            walks += scorer.calls
+        for broken in (False, True):
+            scorer = FakeScorer(broken_batches=broken)
+            nodes = nodedef.RagNodes(self._root, scorer.llm, num_personas=3,
+                                     batch_relevance=True,
+                                     multi_persona=True)
+            update = nodes.retrieve_for_all(dict(question))
+            self.assertEqual(update["persona_responses"][0]
+                             ["response_sources"],
+                             self._retrieve(FakeScorer()))
+            if not broken:
+                self.assertGreater(scorer.batch_calls, 0)
+                self.assertLess(scorer.calls, walks)
+            for budget in (1, 2, 5):
+                limited = FakeScorer(broken_batches=broken)
+                nodedef.RagNodes(self._root, limited.llm, num_personas=3,
+                                 batch_relevance=True, multi_persona=True,
+                                 max_llm_calls=budget
+                                 ).retrieve_for_all(dict(question))
+                self.assertLessEqual(limited.calls, budget)
+
+    def test_deadline_returns_best_so_far(self):
+        question = {"original_claim": "what grows on trees"}
+        full = FakeScorer()
+        nodes = nodedef.RagNodes(self._root, full.llm, num_personas=1)
+        state = nodes.retrieve(dict(question))
+        self.assertFalse(state["responses"][0]["response_truncated"])
+        # every LLM call takes one second of a fake clock
+        clock = FakeClock()
+        slow = FakeScorer()
+        nodes = nodedef.RagNodes(self._root, slow.llm, num_personas=1)
+        persona = nodes._persona_list[0]
+
+        def timed(score):
+            def scored(argument, max_calls):
+                calls = slow.calls
+                result = score(argument, persona, question["original_claim"])
+                clock.now += slow.calls - calls
+                return result
+            return scored
+
+        search = BeamSearch(nodes._load_node, timed(nodes._score_children),
+                            timed(nodes._score_text), max_seconds=3,
+                            clock=clock)
+        text_nodes, report = search.search(self._root)
+        self.assertEqual(report.stopped, "deadline")
+        self.assertTrue(report.truncated)
+        self.assertLess(slow.calls, full.calls)
+        self.assertGreaterEqual(report.seconds, 3)
+        self.assertEqual(report.seconds, slow.calls)
+        self.assertEqual(report.llm_calls, slow.calls)
+        self.assertEqual(len(text_nodes), report.texts_scored)
+        budget = nodedef.RagNodes(self._root, FakeScorer().llm,
+                                  num_personas=1, max_llm_calls=4)
+        state = budget.retrieve(dict(question))
+        self.assertTrue(state["responses"][0]["response_truncated"])
+
+    def test_async_deadline_cancels_calls(self):
+        question = {"original_claim": "what grows on trees"}
+        state = asyncio.run(nodedef.RagNodes(
+            self._root, FakeScorer().llm, num_personas=1
+            ).aretrieve(dict(question)))
+        self.assertFalse(state["responses"][0]["response_truncated"])
+        slow = FakeScorer(delay=0.3)
+        nodes = nodedef.RagNodes(self._root, slow.llm, num_personas=1,
+                                 max_seconds=0.05)
+
+        async def timed():
+            start = time.monotonic()
+            state = await nodes.aretrieve(dict(question))
+            return state, time.monotonic() - start
+
+        # a cancelled call's worker thread still sleeps in the background
+        state, seconds = asyncio.run(timed())
+        self.assertLess(seconds, 0.3)
+        self.assertTrue(state["responses"][0]["response_truncated"])
+        self.assertEqual(state["responses"][0]["response_sources"], [])
+
+
+
+class TestGradeDocuments(unittest.TestCase):
+    def test_grades_concurrently_in_order(self):
+        documents = [f"document {i} about {'trees' if i % 3 else 'rocks'}"
+                     for i in range(10)]
+        grader = FakeGrader(delay=0.05)
+        nodes = nodedef.RagNodes("unused", grader.llm, num_personas=1,
+                                 max_in_flight=3)
+        state = nodes.grade_documents({
+            "original_claim": "what grows on trees", "persona_index": 0,
+            "responses": [{"response_sources": list(documents)}]})
+        self.assertEqual(state["responses"][0]["response_sources"],
+                         [d for d in documents if "trees" in d])
+        self.assertGreater(grader.max_in_flight, 1)
+        self.assertLessEqual(grader.max_in_flight, 3)
+
+
+
+class TestGradeGeneration(unittest.TestCase):
+    def _state(self, sources=("figs are sweet",)):
+        return {"original_claim": "are figs sweet", "persona_index": 0,
+                "responses": [{"response_sources": list(sources)}]}
+
+    def _grade(self, judge, state, max_generations=3):
+        nodes = nodedef.RagNodes("unused", judge.llm, num_personas=1,
+                                 max_generations=max_generations)
+        state = nodes.grade_generation(nodes.generate(state))
+        return state, nodes.grade_generation_v_documents_and_question(state)
+
+    def test_one_fused_call(self):
+        judge = FakeJudge(delay=0.01)
+        state, decision = self._grade(judge, self._state())
+        self.assertEqual(decision, "useful")
+        self.assertEqual(judge.calls, {"generate": 1, "fused": 1})
+        attempt = state["responses"][0]["response_attempts"][0]
+        self.assertTrue(attempt["grounded"] and attempt["useful"])
+        self.assertGreaterEqual(attempt["seconds"], 0.02)
+
+    def test_falls_back_to_separate_graders(self):
+        judge = FakeJudge(useful="no", fused=False)
+        _, decision = self._grade(judge, self._state())
+        self.assertEqual(decision, "not useful")
+        self.assertEqual(judge.calls, {"generate": 1, "fused": 1,
+                                       "hallucination": 1, "answer": 1})
+
+    def test_without_sources_only_usefulness_is_graded(self):
+        judge = FakeJudge(grounded="no")
+        _, decision = self._grade(judge, self._state(sources=()))
+        self.assertEqual(decision, "useful")
+        self.assertEqual(judge.calls, {"generate": 1, "answer": 1})
+
+    def test_retries_are_bounded(self):
+        judge = FakeJudge(grounded="no")
+        state = self._state()
+        decisions = []
+        for _ in range(3):
+            state, decision = self._grade(judge, state, max_generations=3)
+            decisions.append(decision)
+        self.assertEqual(decisions,
+                         ["not supported", "not supported", "exhausted"])
+        self.assertEqual(len(state["responses"][0]["response_attempts"]), 3)
+        # attempts on notes retrieved again after a web search still count
+        state["responses"].append({"response_sources": ["figs"]})
+        _, decision = self._grade(FakeJudge(useful="no"), state,
+                                  max_generations=4)
+        self.assertEqual(decision, "exhausted")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 14:40:00 2026
+
+@author: magfrump
+"""
+
+import os
+import tempfile
+import unittest
+import indexed_info_node as iin
+from node_store import NodeStore
+
+class TestNodeStore(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._store = NodeStore(os.path.join(self._dir.name, "index.sqlite"))
+
+    def tearDown(self):
+        self._store.close()
+        self._dir.cleanup()
+
+    def test_put_and_get(self):
+        node = iin.IndexedInfoNode([iin.ChildNode("child1", "a child")],
+                                   iin.NodeMetaData(0, 1, "test", "INDEX"), "")
+        self._store.put("root", node)
+        self.assertEqual(self._store.get("root"), node)
+        self.assertIn("root", self._store)
+        with self.assertRaises(KeyError):
+            self._store.get("missing")
+
+    def test_get_lazy(self):
+        leaf = iin.IndexedInfoNode([], iin.NodeMetaData(0, 1, "test", "TEXT"),
+                                   "some text")
+        self._store.put("leaf", leaf)
+        lazy = self._store.get_lazy("leaf")
+        self.assertIsNone(lazy._text)
+        self.assertEqual(lazy.get_text, "some text")
+        self.assertEqual(lazy, leaf)
+
+    def test_import_json_dir(self):
+        count = self._store.import_json_dir("data")
+        names = [name for name in os.listdir("data")
+                 if name.endswith("_kg.json")]
+        self.assertEqual(count, len(names))
+        self.assertEqual(len(self._store), len(names))
+        root = self._store.get("data/belegarth_kg.json")
+        self.assertEqual(root,
+                         iin.IndexedInfoNode.fromfilename(
+                             "data/belegarth_kg.json"))
+        # children are found under the references their parents use
+        for child in root.get_children():
+            self.assertIn(child.node_reference, self._store)
+
+
+if __name__ == '__main__':
+    unittest.main()
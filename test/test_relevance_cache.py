@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 19:00:00 2026
+
+@author: magfrump
+"""
+
+import os
+import tempfile
+import unittest
+from relevance_cache import RelevanceCache
+
+class TestRelevanceCache(unittest.TestCase):
+    def test_key_depends_on_every_input(self):
+        parts = ["persona", "question", "text", "Kale", "text_relevance@1"]
+        key = RelevanceCache.make_key(*parts)
+        for i in range(len(parts)):
+            changed = list(parts)
+            changed[i] += "!"
+            self.assertNotEqual(key, RelevanceCache.make_key(*changed))
+        # parts are length-prefixed, so moving text between them matters
+        self.assertNotEqual(
+            RelevanceCache.make_key("ab", "c", "text", "Kale", 1),
+            RelevanceCache.make_key("a", "bc", "text", "Kale", 1))
+
+    def test_memory_tier_evicts_least_recently_used(self):
+        cache = RelevanceCache(max_entries=2)
+        cache.put("a", 0.1)
+        cache.put("b", 0.2)
+        self.assertEqual(cache.get("a"), 0.1)
+        cache.put("c", 0.3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 0.3)
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+        self.assertAlmostEqual(cache.hit_rate, 2/3)
+
+    def test_disk_tier(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "relevance.sqlite")
+            cache = RelevanceCache(path, max_entries=1)
+            cache.put("a", 0.5)
+            cache.put("b", 0.0)
+            # evicted from memory but still on disk
+            self.assertEqual(cache.get("a"), 0.5)
+            self.assertEqual(cache.disk_hits, 1)
+            cache.close()
+            reopened = RelevanceCache(path)
+            self.assertEqual(len(reopened), 2)
+            self.assertEqual(reopened.get("b"), 0.0)
+            self.assertEqual(reopened.get("b"), 0.0)
+            self.assertEqual((reopened.disk_hits, reopened.hits), (1, 1))
+            reopened.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 10:45:00 2026
+
+@author: magfrump
+"""
+
+import os
+import tempfile
+import unittest
+import knowledge_graph as kg
+from summary_cache import SummaryCache
+from test.test_knowledge_graph import FakeSummarizer
+
+class TestSummaryCache(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._path = os.path.join(self._dir.name, "cache.sqlite")
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_key_depends_on_model_and_prompt(self):
+        key = SummaryCache.make_key("text", "Kale", 1)
+        self.assertEqual(key, SummaryCache.make_key("text", "Kale", 1))
+        self.assertNotEqual(key, SummaryCache.make_key("text", "Other", 1))
+        self.assertNotEqual(key, SummaryCache.make_key("text", "Kale", 2))
+        self.assertNotEqual(key, SummaryCache.make_key("text2", "Kale", 1))
+
+    def test_get_and_put(self):
+        cache = SummaryCache(self._path)
+        self.assertIsNone(cache.get("a"))
+        cache.put("a", "summary of a")
+        self.assertEqual(cache.get("a"), "summary of a")
+        cache.close()
+        reopened = SummaryCache(self._path)
+        self.assertEqual(reopened.get("a"), "summary of a")
+        reopened.close()
+
+    def test_evicts_least_recently_used(self):
+        cache = SummaryCache(self._path, max_bytes=25)
+        cache.put("a", "x"*10)
+        cache.put("b", "x"*10)
+        cache.get("a")
+        cache.put("c", "x"*10)
+        self.assertEqual(cache.get("a"), "x"*10)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), "x"*10)
+        self.assertLessEqual(cache.size_bytes(), 25)
+        cache.close()
+
+    def test_size_is_kept_across_replacements_and_reopening(self):
+        cache = SummaryCache(self._path)
+        cache.put("a", "x"*10)
+        cache.put("b", "x"*5)
+        cache.put("a", "x"*3)
+        self.assertEqual(cache.size_bytes(), (1+3) + (1+5))
+        cache.close()
+        reopened = SummaryCache(self._path)
+        self.assertEqual(reopened.size_bytes(), (1+3) + (1+5))
+        reopened.close()
+
+    def test_hits_are_remembered_after_closing(self):
+        cache = SummaryCache(self._path)
+        cache.put("a", "x"*10)
+        cache.put("b", "x"*10)
+        cache.get("a")
+        cache.close()
+        reopened = SummaryCache(self._path, max_bytes=25)
+        reopened.put("c", "x"*10)
+        self.assertEqual(reopened.get("a"), "x"*10)
+        self.assertIsNone(reopened.get("b"))
+        reopened.close()
+
+    def test_rebuild_only_summarizes_changes(self):
+        cache = SummaryCache(self._path)
+        document = "here's a big old sentence for you to split up lol"
+        first = kg.KnowledgeGraph([document], chunk_length=9, chunk_overlap=2,
+                                  max_subtopics=5, llm=FakeSummarizer().llm,
+                                  cache=cache)
+        second = kg.KnowledgeGraph([document], chunk_length=9, chunk_overlap=2,
+                                   max_subtopics=5, llm=FakeSummarizer().llm,
+                                   cache=cache)
+        self.assertEqual(second.stats.llm_calls, 0)
+        self.assertEqual(second.stats.cache_hits, first.stats.llm_calls)
+        self.assertEqual(second.get_text(), first.get_text())
+
+        changed = kg.KnowledgeGraph([document.replace("lol", "now")],
+                                    chunk_length=9, chunk_overlap=2,
+                                    max_subtopics=5, llm=FakeSummarizer().llm,
+                                    cache=cache)
+        self.assertGreater(changed.stats.llm_calls, 0)
+        self.assertLess(changed.stats.llm_calls, first.stats.llm_calls)
+        cache.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 19:50:00 2026
+
+@author: magfrump
+"""
+
+import math
+import tempfile
+import unittest
+import indexed_info_node as iin
+import knowledge_graph as kg
+import summary_vectors as sv
+from test.test_knowledge_graph import FakeSummarizer
+
+class TestSummaryVectors(unittest.TestCase):
+    def test_vectorize(self):
+        vector = sv.vectorize("Swords and shields, swords!")
+        self.assertAlmostEqual(float(vector @ vector), 1.0, places=5)
+        same = sv.vectorize("shields and swords swords")
+        self.assertAlmostEqual(float(vector @ same), 1.0, places=5)
+        related = sv.vectorize("rules for swords")
+        unrelated = sv.vectorize("banana bread recipe")
+        self.assertGreater(float(vector @ related),
+                           float(vector @ unrelated))
+        self.assertFalse(sv.vectorize("...").any())
+
+    def test_build_and_read_vectors(self):
+        document = "here's a big old sentence for you to split up lol"
+        graph = kg.KnowledgeGraph([document], chunk_length=9,
+                                  chunk_overlap=2, max_subtopics=5,
+                                  llm=FakeSummarizer().llm)
+        with tempfile.TemporaryDirectory() as directory:
+            graph.write_doc_to_dir(directory, "doc")
+            vectors = sv.SummaryVectors(directory, "doc")
+            self.assertEqual(len(vectors), graph.num_nodes - 1)
+            self.assertEqual(vectors.dimensions, sv.DIMENSIONS)
+            first = iin.IndexedInfoNode.fromfilename(
+                directory+"/doc_kg.json").get_children()[0].node_reference
+            self.assertIn(first, vectors)
+            scores = vectors.similarities(graph.summaries[0],
+                                          [first, "missing"])
+            self.assertAlmostEqual(float(scores[0]), 1.0, places=5)
+            self.assertTrue(math.isnan(scores[1]))
+
+
+if __name__ == '__main__':
+    unittest.main()